@@ -1,39 +1,247 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_file
+import time
+import uuid
+import json
+import hashlib
+from flask import (Flask, render_template, request, jsonify, send_file, session, Response, stream_with_context,
+                   make_response, g, abort)
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.wsgi import get_input_stream
+from werkzeug.exceptions import RequestEntityTooLarge
 import logging
 from utils.image_processor import ImageProcessor
 from utils.text_processor import TextProcessor
 from utils.ai_processor import AIProcessor
+from utils.image_cache import image_cache
+from utils.job_queue import JobQueue, QueueFullError
+from utils.lazy import warm_up, stats as component_stats, current_rss
+from utils.batch import run_batch
+from utils.upload import stream_to_disk, UploadError
+from utils.result_cache import ResultCache, canonical_params
+from utils.output_store import output_store
+from utils.ocr import ocr_engine
+from utils import jpeg, tiling
+from utils.metrics import metrics, trace, span
+from utils.profiler import SlowRequestProfiler
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; LOG_LEVEL=DEBUG brings back per-request detail
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.secret_key = os.urandom(24)
+app.config['STREAM_MAX_CONTENT_LENGTH'] = int(os.environ.get('STREAM_MAX_CONTENT_LENGTH', 2 * 1024 * 1024 * 1024))
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+app.config['HISTORY_MAX_BYTES'] = int(os.environ.get('HISTORY_MAX_BYTES', 256 * 1024 * 1024))
+app.config['HISTORY_MAX_IDLE'] = int(os.environ.get('HISTORY_MAX_IDLE', 30 * 60))
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 4))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get('JOB_MAX_PENDING', 32))
+# Upper bound on the worker processes one /batch request may ask for
+app.config['BATCH_MAX_WORKERS'] = int(os.environ.get('BATCH_MAX_WORKERS', os.cpu_count() or 1))
+app.config['CAPTION_BATCH_SIZE'] = int(os.environ.get('CAPTION_BATCH_SIZE', 8))
+app.config['CAPTION_MAX_WAIT'] = float(os.environ.get('CAPTION_MAX_WAIT', 0.05))
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 1))
+# Largest image the tiled path decodes; it replaces Pillow's decompression bomb limit there
+app.config['TILED_MAX_PIXELS'] = int(os.environ.get('TILED_MAX_PIXELS', 1000 * 1000 * 1000))
+app.config['RESULT_CACHE_DIR'] = os.environ.get('RESULT_CACHE_DIR', 'cache/results')
+app.config['RESULT_CACHE_MEMORY_BYTES'] = int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+app.config['RESULT_CACHE_DISK_BYTES'] = int(os.environ.get('RESULT_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+app.config['FACE_DETECTOR'] = os.environ.get('FACE_DETECTOR', 'haar')
+# Faster face detection on large images, at the cost of missing faces smaller than
+# 24 pixels times long edge / FACE_MAX_SIDE; 0 detects at full resolution
+app.config['FACE_MAX_SIDE'] = int(os.environ.get('FACE_MAX_SIDE', 0)) or None
+app.config['FACE_DNN_MODEL'] = os.environ.get('FACE_DNN_MODEL')
+app.config['FACE_DNN_CONFIG'] = os.environ.get('FACE_DNN_CONFIG')
+app.config['OCR_WORKERS'] = int(os.environ.get('OCR_WORKERS', os.cpu_count() or 1))
+app.config['OUTPUT_MAX_AGE'] = int(os.environ.get('OUTPUT_MAX_AGE', 60 * 60))
+app.config['OUTPUT_GC_INTERVAL'] = int(os.environ.get('OUTPUT_GC_INTERVAL', 5 * 60))
+# Requests slower than this many milliseconds have their sampled stacks written; 0 disables profiling
+app.config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+# Versioned output URLs never change content, so clients may keep them as long as
+# the file is guaranteed to exist; superseded versions are collected after OUTPUT_MAX_AGE
+app.config['OUTPUT_MAX_AGE_HEADER'] = min(int(os.environ.get('OUTPUT_MAX_AGE_HEADER', app.config['OUTPUT_MAX_AGE'])),
+                                          app.config['OUTPUT_MAX_AGE'])
+# Share SECRET_KEY between workers so session cookies are valid on all of them
+app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24)
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Decoded uploads are shared across all actions
+image_cache.configure(app.config['IMAGE_CACHE_MAX_BYTES'])
+
+# Outputs are versioned per session; superseded versions are removed in the background
+output_store.configure(max_age=app.config['OUTPUT_MAX_AGE'])
+output_store.start_gc(app.config['OUTPUT_GC_INTERVAL'])
+
+# OCR runs on a pool of tesseract workers shared by all requests
+ocr_engine.configure(workers=app.config['OCR_WORKERS'])
+
+# Optional backends; everything works without them, only slower
+if jpeg.JPEGTRAN is None:
+    logger.warning("jpegtran not found; JPEG rotations, flips and crops are decoded and re-encoded")
+if tiling.tifffile is None:
+    logger.warning("tifffile is not installed; large TIFFs are decoded instead of memory-mapped")
+
+# Results of repeated (image, action, params) requests are reused
+result_cache = ResultCache(app.config['RESULT_CACHE_DIR'],
+                           memory_bytes=app.config['RESULT_CACHE_MEMORY_BYTES'],
+                           disk_bytes=app.config['RESULT_CACHE_DISK_BYTES'])
+
 # Initialize processors
-image_processor = ImageProcessor()
-text_processor = TextProcessor()
-ai_processor = AIProcessor()
+image_processor = ImageProcessor(history_max_bytes=app.config['HISTORY_MAX_BYTES'],
+                                 history_max_idle=app.config['HISTORY_MAX_IDLE'],
+                                 tiled_max_pixels=app.config['TILED_MAX_PIXELS'],
+                                 workers=app.config['IMAGE_WORKERS'])
+text_processor = TextProcessor(page_cache=result_cache)
+ai_processor = AIProcessor(caption_batch_size=app.config['CAPTION_BATCH_SIZE'],
+                           caption_max_wait=app.config['CAPTION_MAX_WAIT'],
+                           face_backend=app.config['FACE_DETECTOR'],
+                           face_max_side=app.config['FACE_MAX_SIDE'],
+                           face_dnn_model=app.config['FACE_DNN_MODEL'],
+                           face_dnn_config=app.config['FACE_DNN_CONFIG'],
+                           content_hash=result_cache.content_hash)
+FILTER_ACTIONS = {'grayscale', 'sepia', 'warm', 'sharp', 'blur', 'edge'}
+TRANSFORM_ACTIONS = {'rotate', 'flip', 'crop', 'resize'}
+CACHEABLE_ACTIONS = FILTER_ACTIONS | TRANSFORM_ACTIONS | {
+    'pipeline', 'ocr', 'face_detect', 'face_blur', 'remove_bg', 'caption'}
+
+# Slow actions run in the background on threads. The heavy ones release the GIL
+# (OpenCV, onnxruntime, torch, tesseract) or need state in this process, so no
+# worker processes are forked from the server.
+job_queue = JobQueue(max_workers=app.config['JOB_WORKERS'], process_workers=0,
+                     max_pending=app.config['JOB_MAX_PENDING'])
+# Optionally load heavy components now, e.g. WARMUP=caption_model,rembg
+if os.environ.get('WARMUP'):
+    warm_up(os.environ['WARMUP'].split(','))
+
+# Video runs its own decode/detect/encode threads, background removal keeps its
+# rembg sessions and mask cache in this process, and captions share a batch
+ASYNC_ACTIONS = {'remove_bg', 'caption', 'ocr', 'tts', 'face_blur_video'}
+# Other async actions answer synchronously unless the request sets "async": true
+ASYNC_BY_DEFAULT = {'face_blur_video'}
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'pdf', 'mp4', 'mov', 'avi'}
+
+# Actions used as metric labels; anything else is counted as 'invalid'
+KNOWN_ACTIONS = CACHEABLE_ACTIONS | set(ASYNC_ACTIONS) | {'translate'}
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+profiler = None
+if app.config['PROFILE_SLOW_MS'] > 0:
+    profiler = SlowRequestProfiler(app.config['PROFILE_SLOW_MS'], app.config['PROFILE_DIR'],
+                                   app.config['PROFILE_INTERVAL_MS'] / 1000)
+
+
+def _labelled(samples, label):
+    return [({label: name}, value) for name, value in samples.items()]
+
+
+def register_metrics():
+    """Expose component gauges and counters on /metrics; read only when scraped."""
+    metrics.register('process_resident_memory_bytes', 'Resident set size of this process.', current_rss)
+    metrics.register('image_cache_bytes', 'Decoded pixels held by the image cache.',
+                     lambda: image_cache.stats()['bytes'])
+    metrics.register('image_cache_entries', 'Images in the decoded image cache.',
+                     lambda: image_cache.stats()['entries'])
+    metrics.register('image_cache_hits_total', 'Image cache hits.', lambda: image_cache.hits, 'counter')
+    metrics.register('image_cache_misses_total', 'Image cache misses.', lambda: image_cache.misses, 'counter')
+    metrics.register('image_cache_evictions_total', 'Image cache evictions.',
+                     lambda: image_cache.evictions, 'counter')
+    metrics.register('result_cache_bytes', 'Bytes held by the result cache, by tier.',
+                     lambda: _labelled({'memory': result_cache.stats()['memory_bytes'],
+                                        'disk': result_cache.stats()['disk_bytes']}, 'tier'))
+    metrics.register('result_cache_lookups_total', 'Result cache lookups by action and outcome.',
+                     lambda: [({'action': action, 'outcome': outcome}, count)
+                              for action, counts in result_cache.stats()['actions'].items()
+                              for outcome, count in counts.items() if outcome != 'hit_rate'], 'counter')
+    metrics.register('history_bytes', 'Memory and disk held by undo history, by tier.',
+                     lambda: _labelled({tier: image_processor.history_usage()[f'{tier}_bytes']
+                                        for tier in ('raw', 'compressed', 'spilled')}, 'tier'))
+    metrics.register('jobs', 'Background jobs by state.', lambda: _labelled(job_queue.stats()['jobs'], 'state'))
+    metrics.register('jobs_active', 'Jobs pending or running.', job_queue.active_count)
+    metrics.register('jobs_max_pending', 'Jobs accepted before new ones are refused.',
+                     lambda: job_queue.max_pending)
+    metrics.register('ocr_images_total', 'Images recognised by the OCR pool.',
+                     lambda: ocr_engine.stats()['images'], 'counter')
+    metrics.register('ocr_stage_seconds_total', 'Time spent by the OCR pool, by stage.',
+                     lambda: _labelled({stage: ms / 1000 for stage, ms in ocr_engine.stats()['total_ms'].items()},
+                                       'stage'), 'counter')
+    metrics.register('batch_items_total', 'Items run through each model micro-batcher.',
+                     lambda: _labelled({name: stats['items'] for name, stats in ai_processor.batch_stats().items()
+                                        if 'items' in stats}, 'batcher'), 'counter')
+    metrics.register('batches_total', 'Model calls made by each micro-batcher.',
+                     lambda: _labelled({name: stats['batches'] for name, stats in ai_processor.batch_stats().items()
+                                        if 'batches' in stats}, 'batcher'), 'counter')
+    metrics.register('mask_cache_bytes', 'Alpha masks held for background removal.',
+                     lambda: ai_processor.masks.stats()['bytes'])
+    metrics.register('face_cache_hits_total', 'Face detections answered from the box cache.',
+                     lambda: ai_processor.face_detector.hits, 'counter')
+    metrics.register('face_cache_misses_total', 'Face detections that ran the detector.',
+                     lambda: ai_processor.face_detector.misses, 'counter')
+    metrics.register('slow_request_profiles_total', 'Profiles written for slow requests.',
+                     lambda: profiler.dumps if profiler is not None else None, 'counter')
+
+
+register_metrics()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def current_session_id():
+    """Return the caller's output namespace, creating one on first use.
+
+    The id only ever comes from the signed session cookie, so a client
+    cannot pick another session's namespace.
+    """
+    if 'sid' not in session:
+        session['sid'] = uuid.uuid4().hex
+    return session['sid']
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if profiler is not None and request.endpoint != 'metrics_endpoint':
+        g.profile = profiler.begin()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.http.observe(time.perf_counter() - g.request_start, endpoint=endpoint,
+                         method=request.method, status=response.status_code)
+    if g.get('profile') is not None:
+        profiler.end(g.profile, f"{endpoint}-{g.get('action', '')}".rstrip('-'))
+    return response
+
+def run_action(filepath, action, params, session_id=None):
+    """Dispatch a slow action; module level so worker processes can run it."""
+    if action == 'ocr':
+        result = text_processor.extract_text(filepath, params.get('lang', 'eng'), params.get('regions', False))
+    elif action == 'tts':
+        return text_processor.text_to_speech(params.get('text'), params.get('lang', 'en'), session_id)
+    else:
+        result = ai_processor.process_image(filepath, action, params, session_id)
+    # Video outputs can be gigabytes, so only actions the cache is meant for are stored
+    if action in CACHEABLE_ACTIONS:
+        result_cache.store(filepath, action, params, result)
+    return result
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    """Save a multipart upload.
+
+    Werkzeug has already spooled the whole form body to memory or a
+    temporary file before this runs, so stream_to_disk only validates
+    and hashes a local copy here. Large files should use
+    PUT /upload/stream/<name>, which reads the socket as data arrives.
+    """
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file part'}), 400
@@ -50,10 +258,12 @@ def upload_file():
                 filename = secure_filename(file.filename)
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
                 
-                # Test if we can write to the directory
+                # Validate, hash and cache the upload while writing it
                 try:
-                    with open(filepath, 'wb') as f:
-                        file.save(filepath)
+                    info = stream_to_disk(file.stream, filepath, app.config['MAX_CONTENT_LENGTH'])
+                    result_cache.remember_hash(filepath, info['sha256'])
+                except UploadError as e:
+                    return jsonify({'error': str(e)}), 400
                 except (IOError, OSError) as e:
                     logger.error(f"Failed to save file: {str(e)}")
                     return jsonify({'error': f'Failed to save file: {str(e)}'}), 500
@@ -61,7 +271,8 @@ def upload_file():
                 return jsonify({
                     'success': True,
                     'filename': filename,
-                    'filepath': f'/static/uploads/{filename}'
+                    'filepath': f'/static/uploads/{filename}',
+                    **info
                 })
             except (IOError, OSError) as e:
                 logger.error(f"Failed to create upload directory: {str(e)}")
@@ -73,44 +284,225 @@ def upload_file():
         logger.error(f"Error in upload: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/stream/<name>', methods=['PUT', 'POST'])
+def upload_stream(name):
+    """Stream a raw request body to disk, for scans larger than MAX_CONTENT_LENGTH."""
+    try:
+        filename = secure_filename(name)
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type'}), 400
+
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        limit = app.config['STREAM_MAX_CONTENT_LENGTH']
+        stream = get_input_stream(request.environ, max_content_length=limit)
+        # Scans sent here may exceed Pillow's pixel limit; they are processed tile by tile
+        info = stream_to_disk(stream, filepath, limit, max_pixels=app.config['TILED_MAX_PIXELS'])
+        result_cache.remember_hash(filepath, info['sha256'])
+
+        return jsonify({
+            'success': True,
+            'filename': filename,
+            'filepath': f'/static/uploads/{filename}',
+            **info
+        })
+
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Upload too large'}), 413
+    except Exception as e:
+        logger.error(f"Error in streamed upload: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/process', methods=['POST'])
 def process_image():
+    """Run one action or a pipeline, timing each stage for /metrics and Server-Timing."""
+    data = request.get_json(silent=True)
+    action = 'pipeline' if data and data.get('steps') else (data or {}).get('action')
+    g.action = action if action in KNOWN_ACTIONS or action == 'pipeline' else 'invalid'
+    with trace(g.action) as request_trace:
+        response = make_response(handle_process(data))
+    response.headers['Server-Timing'] = request_trace.server_timing()
+    logger.debug(f"/process {g.action}: {request_trace.server_timing()}")
+    return response
+
+def handle_process(data):
     try:
-        data = request.get_json()
         if not data:
             return jsonify({'error': 'No data received'}), 400
 
         filename = data.get('filename')
         action = data.get('action')
         params = data.get('params', {})
+        steps = data.get('steps')
+        # Encode settings for image results: format, preset, quality, keep_metadata, ...
+        output = data.get('output')
 
-        if not filename or not action:
+        if not filename or not (action or steps):
             return jsonify({'error': 'Missing filename or action'}), 400
 
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        session_id = current_session_id()
+        cache_action, cache_params = ('pipeline', {'steps': steps}) if steps else (action, params)
+        cache_key_params = dict(cache_params, output=output) if output else cache_params
+
+        # Repeated requests are answered from the result cache
+        if cache_action in CACHEABLE_ACTIONS and os.path.exists(filepath):
+            with span('cache_lookup'):
+                cached = result_cache.lookup(filepath, cache_action, cache_key_params, session_id)
+            if cached is not None:
+                if cache_action in FILTER_ACTIONS:
+                    image_processor.record_state(filepath, 'filter', action, params, session_id)
+                elif cache_action in TRANSFORM_ACTIONS:
+                    image_processor.record_state(filepath, 'transform', action, params, session_id)
+                elif cache_action == 'pipeline':
+                    image_processor.record_state(filepath, 'pipeline', 'pipeline', cache_params, session_id)
+                with span('respond'):
+                    return jsonify(cached)
         
-        # Process based on action type
-        if action in ['grayscale', 'sepia', 'warm', 'sharp', 'blur', 'edge']:
-            result = image_processor.apply_filter(filepath, action, params)
-        elif action in ['rotate', 'flip', 'crop', 'resize']:
-            result = image_processor.transform_image(filepath, action, params)
-        elif action == 'ocr':
-            result = text_processor.extract_text(filepath, params.get('lang', 'eng'))
-        elif action == 'tts':
-            result = text_processor.text_to_speech(params.get('text'), params.get('lang', 'en'))
-        elif action == 'translate':
-            result = text_processor.translate_text(params.get('text'), params.get('target_lang', 'en'))
-        elif action in ['face_detect', 'face_blur', 'remove_bg', 'caption']:
-            result = ai_processor.process_image(filepath, action, params)
-        else:
+        # Slow actions return a job id when the client asks for one
+        if action in ASYNC_ACTIONS and data.get('async', action in ASYNC_BY_DEFAULT):
+            try:
+                job_id = job_queue.submit(action, run_action, filepath, action, params, session_id)
+            except QueueFullError as e:
+                return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': f'/jobs/{job_id}'
+            }), 202
+
+        # Process based on action type. Processors time their own decode, history and
+        # encode stages; whatever they do not cover is counted as the operation.
+        with span('operation'):
+            result = dispatch_action(filepath, action, params, steps, session_id, output)
+        if result is None:
             return jsonify({'error': 'Invalid action'}), 400
 
-        return jsonify(result)
+        if cache_action in CACHEABLE_ACTIONS and not result.get('tiled'):
+            with span('cache_store'):
+                result_cache.store(filepath, cache_action, cache_key_params, result)
+        with span('respond'):
+            return jsonify(result)
 
     except Exception as e:
         logger.error(f"Error in processing: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def dispatch_action(filepath, action, params, steps, session_id, output):
+    """Run a /process action synchronously; None if the action is unknown."""
+    if steps:
+        return image_processor.apply_pipeline(filepath, steps, session_id, output)
+    elif action in FILTER_ACTIONS:
+        return image_processor.apply_filter(filepath, action, params, session_id, output)
+    elif action in TRANSFORM_ACTIONS:
+        return image_processor.transform_image(filepath, action, params, session_id, output)
+    elif action == 'ocr':
+        return text_processor.extract_text(filepath, params.get('lang', 'eng'), params.get('regions', False))
+    elif action == 'tts':
+        return text_processor.text_to_speech(params.get('text'), params.get('lang', 'en'), session_id)
+    elif action == 'translate':
+        return text_processor.translate_text(params.get('text'), params.get('target_lang', 'en'))
+    elif action in ['face_detect', 'face_blur', 'face_blur_video', 'remove_bg', 'caption']:
+        return ai_processor.process_image(filepath, action, params, session_id)
+    return None
+
+@app.route('/ocr/document', methods=['POST'])
+def ocr_document_pages():
+    """OCR a PDF or multi-page TIFF, streaming one JSON line per page as it finishes."""
+    data = request.get_json()
+    if not data or not data.get('filename'):
+        return jsonify({'error': 'No filename provided'}), 400
+
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(data['filename']))
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+
+    def generate():
+        try:
+            for page in text_processor.iter_document_text(filepath, data.get('lang', 'eng'),
+                                                          data.get('regions', False)):
+                yield json.dumps(page) + '\n'
+        except Exception as e:
+            logger.error(f"Error in document OCR: {str(e)}")
+            yield json.dumps({'error': str(e)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/preview', methods=['POST'])
+def preview_image():
+    """Render steps on a viewport-sized proxy; optionally queue the full-size render."""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'No data received'}), 400
+
+        filename = data.get('filename')
+        steps = data.get('steps') or [{'action': data.get('action'), 'params': data.get('params', {})}]
+        if not filename or not steps[0].get('action'):
+            return jsonify({'error': 'Missing filename or steps'}), 400
+
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        session_id = current_session_id()
+        result = image_processor.render_preview(filepath, steps, data.get('viewport', (800, 600)), session_id)
+
+        # The full-resolution render runs in the background when asked for
+        if data.get('full') and 'error' not in result:
+            result['job_id'] = job_queue.submit('render', image_processor.apply_pipeline, filepath, steps,
+                                                session_id)
+        return jsonify(result)
+
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        logger.error(f"Error in preview: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/batch', methods=['POST'])
+def batch_process():
+    """Apply a recipe to every upload matching a glob, as a background job."""
+    try:
+        data = request.get_json()
+        if not data or not data.get('steps'):
+            return jsonify({'error': 'Missing steps'}), 400
+
+        upload_root = os.path.abspath(app.config['UPLOAD_FOLDER'])
+        pattern = os.path.abspath(os.path.join(upload_root, data.get('input', '*')))
+        name = secure_filename(data.get('name', '')) or 'batch'
+        output_dir = os.path.join(upload_root, 'batch', name)
+        if not pattern.startswith(upload_root + os.sep):
+            return jsonify({'error': 'Input must be inside the upload folder'}), 400
+
+        max_workers = app.config['BATCH_MAX_WORKERS']
+        try:
+            workers = min(max(int(data.get('workers') or max_workers), 1), max_workers)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'workers must be an integer'}), 400
+
+        job_id = job_queue.submit('batch', run_batch, pattern, output_dir, data['steps'],
+                                  workers=workers, output_format=data.get('format'))
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}',
+            'manifest': f'/static/uploads/batch/{name}/manifest.jsonl'
+        }), 202
+
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+    except Exception as e:
+        logger.error(f"Error in batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def export_etag(content):
+    """Strong ETag of an export: a hash of its content and of every image it embeds."""
+    sha = hashlib.sha256(json.dumps(canonical_params(content), sort_keys=True).encode())
+    for path in content.get('images', []):
+        if os.path.isfile(path):
+            sha.update(result_cache.content_hash(path).encode())
+    return sha.hexdigest()
+
 @app.route('/export', methods=['POST'])
 def export_results():
     try:
@@ -119,8 +511,15 @@ def export_results():
         content = data.get('content', {})
         
         if export_type == 'pdf':
-            pdf_path = text_processor.export_to_pdf(content)
-            return send_file(pdf_path, as_attachment=True)
+            # POST is not conditional in Werkzeug, so If-None-Match is checked here,
+            # before the PDF is built
+            etag = export_etag(content)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            pdf_path = text_processor.export_to_pdf(content, current_session_id(), key=etag)
+            return send_file(os.path.abspath(pdf_path), as_attachment=True, download_name='export.pdf', etag=etag)
         else:
             return jsonify({'error': 'Invalid export type'}), 400
 
@@ -137,7 +536,7 @@ def undo_action():
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
             
-        result = image_processor.undo(filename)
+        result = image_processor.undo(filename, current_session_id())
         return jsonify(result)
 
     except Exception as e:
@@ -153,12 +552,68 @@ def redo_action():
         if not filename:
             return jsonify({'error': 'No filename provided'}), 400
             
-        result = image_processor.redo(filename)
+        result = image_processor.redo(filename, current_session_id())
         return jsonify(result)
 
     except Exception as e:
         logger.error(f"Error in redo: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if job_queue.status(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not job_queue.cancel(job_id):
+        return jsonify({'error': 'Job already finished'}), 409
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/warmup', methods=['GET', 'POST'])
+def warmup():
+    """Report (GET) or trigger (POST) loading of lazy components."""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        warm_up(data.get('components'))
+    return jsonify(component_stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'image_cache': image_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'history': image_processor.history_usage()
+    })
+
+@app.route(output_store.url_prefix + '/<path:name>', methods=['GET'])
+def serve_output(name):
+    """Serve a versioned output with a content-hash ETag, ranges and a cache lifetime matching retention."""
+    path = output_store.path_for(f'{output_store.url_prefix}/{name}')
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    response = send_file(os.path.abspath(path), conditional=True, etag=result_cache.content_hash(path),
+                         max_age=app.config['OUTPUT_MAX_AGE_HEADER'])
+    # The URL names one version, so browsers need not revalidate it even on reload
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/static/uploads/<path:filename>', methods=['GET'])
+def serve_upload(filename):
+    """Serve an upload; it can be replaced under the same name, so clients revalidate."""
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_file(os.path.abspath(path), conditional=True, etag=result_cache.content_hash(path))
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of request histograms and component gauges."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
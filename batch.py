@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+from utils.batch import run_batch
+
+
+def parse_step(text):
+    """Parse 'action' or 'action:key=value,key=value' into a pipeline step."""
+    action, _, options = text.partition(':')
+    params = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return {'action': action, 'params': params}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Apply a filter/transform recipe to a directory or glob of images.')
+    parser.add_argument('input', help='directory or glob pattern, e.g. "drops/*.jpg"')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('steps', nargs='*',
+                        help='steps such as sepia, blur:radius=3, resize:width=800,height=600')
+    parser.add_argument('--recipe', help='JSON file with a list of steps')
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--max-in-flight', type=int, help='files being processed at once')
+    parser.add_argument('--format', help='output format extension, e.g. jpg or webp')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+
+    if args.recipe:
+        with open(args.recipe) as f:
+            steps = json.load(f)
+    else:
+        steps = [parse_step(step) for step in args.steps]
+    if not steps:
+        parser.error('no steps given')
+
+    def progress(entry):
+        if not args.quiet:
+            status = entry['status'] if entry['status'] == 'ok' else f"error: {entry['error']}"
+            print(f"{entry['source']} -> {entry['output']} ({entry['seconds']:.2f}s) {status}")
+
+    summary = run_batch(args.input, args.output, steps, workers=args.workers,
+                        max_in_flight=args.max_in_flight, output_format=args.format,
+                        progress=progress)
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['error'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
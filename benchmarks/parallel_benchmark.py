@@ -0,0 +1,88 @@
+"""Measure how the band-parallel filters scale with the number of threads.
+
+Usage:
+    python benchmarks/parallel_benchmark.py [--megapixels 24] [--threads 1 2 4 8 16]
+
+Every run is checked against the single-thread output, which must match
+exactly.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor as DesktopProcessor
+from utils.image_processor import ImageProcessor as WebProcessor
+from utils.parallel import band_halo
+
+
+def make_image(megapixels, seed=0):
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def operations(workers):
+    desktop = DesktopProcessor(workers=workers)
+    web = WebProcessor(workers=workers)
+
+    def web_filter(name, params=None):
+        params = params or {}
+        return lambda image: web.bands.apply(image, lambda band: web._filter(band, name, params),
+                                             band_halo(name, params))
+
+    return {
+        'sepia': desktop.apply_sepia,
+        'warm': desktop.add_warm_tone,
+        'sharpen': desktop.enhance_sharpness,
+        'gaussian_blur': desktop.apply_gaussian_blur,
+        'median_blur': desktop.apply_median_blur,
+        'web_sepia': web_filter('sepia'),
+        'web_warm': web_filter('warm'),
+        'web_blur': web_filter('blur', {'radius': 4}),
+        'web_edge': web_filter('edge'),
+    }
+
+
+def best_of(func, image, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(image)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, np.asarray(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4, 8, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    image = make_image(args.megapixels)
+    baseline = {}
+    print(f"{'operation':<15}" + ''.join(f'{n:>10}T' for n in args.threads))
+    rows = {}
+    for workers in args.threads:
+        for name, func in operations(workers).items():
+            elapsed, result = best_of(func, image, args.repeat)
+            if name not in baseline:
+                baseline[name] = (elapsed, result)
+            elif not np.array_equal(result, baseline[name][1]):
+                raise SystemExit(f'{name} with {workers} threads differs from the first run')
+            rows.setdefault(name, []).append(baseline[name][0] / elapsed)
+
+    for name, speedups in rows.items():
+        print(f'{name:<15}' + ''.join(f'{s:>10.2f}x' for s in speedups))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark the vectorized sepia filter against the old per-pixel loop.
+
+Usage:
+    python benchmarks/sepia_benchmark.py [--sizes 1 12 48] [--estimate-legacy]
+
+The legacy loop takes minutes at 48 MP; with --estimate-legacy it is only
+timed on a 1 MP image and its per-pixel cost is scaled to the larger sizes.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processor import ImageProcessor
+
+
+def legacy_sepia(image):
+    """The original getpixel/putpixel implementation, kept for comparison."""
+    width, height = image.size
+    pixels = image.load()
+
+    for py in range(height):
+        for px in range(width):
+            r, g, b = image.getpixel((px, py))
+
+            tr = min(255, int(0.393 * r + 0.769 * g + 0.189 * b))
+            tg = min(255, int(0.349 * r + 0.686 * g + 0.168 * b))
+            tb = min(255, int(0.272 * r + 0.534 * g + 0.131 * b))
+
+            pixels[px, py] = (tr, tg, tb)
+
+    return image
+
+
+def make_image(megapixels, seed=0):
+    """Create a random RGB test image with roughly the given pixel count."""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def time_call(func, image):
+    start = time.perf_counter()
+    result = func(image)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=float, default=[1, 12, 48],
+                        help='image sizes in megapixels')
+    parser.add_argument('--estimate-legacy', action='store_true',
+                        help='extrapolate the legacy loop from a 1 MP run')
+    args = parser.parse_args()
+
+    processor = ImageProcessor()
+    legacy_per_pixel = None
+    if args.estimate_legacy:
+        sample = make_image(1)
+        elapsed, _ = time_call(legacy_sepia, sample.copy())
+        legacy_per_pixel = elapsed / (sample.width * sample.height)
+
+    print(f"{'size':>8} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9} {'match':>6}")
+    for megapixels in args.sizes:
+        image = make_image(megapixels)
+        pixels = image.width * image.height
+
+        fast_time, fast = time_call(processor.apply_sepia, image)
+        if legacy_per_pixel is not None:
+            legacy_time = legacy_per_pixel * pixels
+            match = '-'
+        else:
+            legacy_time, legacy = time_call(legacy_sepia, image.copy())
+            match = 'yes' if np.array_equal(np.asarray(legacy), np.asarray(fast)) else 'NO'
+
+        print(f"{megapixels:>6g}MP {legacy_time:>12.2f} {fast_time:>15.3f} "
+              f"{legacy_time / fast_time:>8.0f}x {match:>6}")
+
+
+if __name__ == '__main__':
+    main()
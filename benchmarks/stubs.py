@@ -0,0 +1,137 @@
+"""Stand-ins for models and tools missing from the benchmark machine.
+
+A stub does a small amount of work proportional to its input, so a
+stubbed operation still measures everything around the model: decoding,
+resizing, pre- and post-processing, caching and encoding. Results record
+which stubs were active; compare them only with runs that used the same
+stubs.
+"""
+import sys
+import types
+import shutil
+import importlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+STUB_TEXT = 'The quick brown fox jumps over the lazy dog'
+STUB_CAPTION = 'a synthetic test image'
+
+
+def _importable(name):
+    try:
+        importlib.import_module(name)
+        return True
+    except ImportError:
+        return False
+
+
+def image_to_string(image, lang=None, config=''):
+    """Stand-in for pytesseract.image_to_string: touches every pixel once."""
+    np.asarray(image.convert('L')).mean()
+    return STUB_TEXT
+
+
+def _pytesseract_module():
+    module = types.ModuleType('pytesseract')
+    # ocr_handler sets pytesseract.pytesseract.tesseract_cmd
+    module.pytesseract = types.SimpleNamespace(tesseract_cmd='tesseract')
+    module.image_to_string = image_to_string
+    return module
+
+
+def _rembg_module():
+    module = types.ModuleType('rembg')
+
+    def new_session(model='u2net'):
+        return types.SimpleNamespace(model=model)
+
+    def remove(image, session=None, only_mask=False):
+        # Threshold luminance instead of running the segmentation network
+        mask = image.convert('L').point(lambda v: 255 if v > 96 else 0)
+        if only_mask:
+            return mask
+        result = image.convert('RGBA')
+        result.putalpha(mask)
+        return result
+
+    module.new_session = new_session
+    module.remove = remove
+    return module
+
+
+def _transformers_module():
+    module = types.ModuleType('transformers')
+
+    def pipeline(task, model=None):
+        def generate(inputs, batch_size=None):
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            for path in inputs:
+                # BLIP's processor resizes every input to 384x384
+                with Image.open(path) as image:
+                    image.convert('RGB').resize((384, 384))
+            return [[{'generated_text': STUB_CAPTION}] for _ in inputs]
+        return generate
+
+    module.pipeline = pipeline
+    return module
+
+
+def _fpdf_module():
+    module = types.ModuleType('fpdf')
+
+    class FPDF:
+        def __init__(self, *args, **kwargs):
+            self._lines = []
+
+        def add_page(self):
+            pass
+
+        def set_font(self, *args, **kwargs):
+            pass
+
+        def multi_cell(self, w, h, txt='', *args, **kwargs):
+            self._lines.append(txt)
+
+        def output(self, name='', dest=''):
+            with open(name, 'w') as f:
+                f.write('\n'.join(self._lines))
+
+    module.FPDF = FPDF
+    return module
+
+
+class CascadeClassifier:
+    """Stand-in for the Haar cascade: one face in the middle of the frame."""
+
+    def __init__(self, filename=None):
+        self.filename = filename
+
+    def detectMultiScale(self, image, scaleFactor=1.1, minNeighbors=3, minSize=None, maxSize=None):
+        cv2.integral(image)  # the cascade's own first pass over the image
+        height, width = image.shape[:2]
+        side = min(height, width) // 4
+        if side < (minSize or (0, 0))[0]:
+            return np.empty((0, 4), dtype=np.int32)
+        return np.array([[(width - side) // 2, (height - side) // 2, side, side]], dtype=np.int32)
+
+
+def install():
+    """Install stubs for whatever is missing and return their names."""
+    installed = []
+    if not _importable('pytesseract'):
+        sys.modules['pytesseract'] = _pytesseract_module()
+        installed.append('pytesseract')
+    elif shutil.which('tesseract') is None and not _importable('tesserocr'):
+        importlib.import_module('pytesseract').image_to_string = image_to_string
+        installed.append('tesseract')
+    for name, factory in (('rembg', _rembg_module), ('transformers', _transformers_module),
+                          ('fpdf', _fpdf_module)):
+        if not _importable(name):
+            sys.modules[name] = factory()
+            installed.append(name)
+    if not hasattr(cv2, 'CascadeClassifier'):
+        cv2.CascadeClassifier = CascadeClassifier
+        installed.append('haar_cascade')
+    return installed
@@ -0,0 +1,397 @@
+"""Time every image, OCR and AI operation on synthetic images and write JSON.
+
+Usage:
+    python benchmarks/suite.py [--sizes 0.3 2 12] [--modes RGB RGBA L] [--repeat 5]
+                               [--only web.filter] [--output results.json]
+                               [--compare baseline.json --threshold 1.15]
+
+Each operation runs on generated images at every size and mode, after
+--warmup untimed runs. Caches are cleared before every run unless --warm
+is given, so repeated runs measure the work rather than a cache hit.
+Models and tools that are not installed are replaced by the stubs in
+benchmarks/stubs.py and listed in the output. With --compare, operations
+whose p50 grew by more than --threshold against a previous run are
+listed and the exit status is 1.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import stubs
+
+
+def make_photo(megapixels, mode='RGB', seed=0):
+    """A photo-like test image: smooth gradients, hard-edged shapes and sensor noise.
+
+    Pure noise is the worst case for every encoder and filter, so it is
+    avoided here; the shapes give edge detection and blurs real work.
+    """
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    array = np.dstack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255])
+    image = Image.fromarray(array.astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(min(width, height) // 20, min(width, height) // 4) + 1)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        draw.ellipse((x0, y0, x0 + size, y0 + size), fill=color)
+    noisy = np.asarray(image, dtype=np.int16) + rng.integers(-6, 7, (height, width, 3), dtype=np.int16)
+    image = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+    if mode == 'RGBA':
+        alpha = Image.fromarray((255 - (y / height * 128)).astype(np.uint8))
+        image.putalpha(alpha)
+    elif mode != 'RGB':
+        image = image.convert(mode)
+    return image
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def make_document(megapixels, seed=0):
+    """A white page of printed text lines, for the OCR operations."""
+    width = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    height = int(megapixels * 1_000_000 / width)
+    rng = np.random.default_rng(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    line_height = max(12, height // 60)
+    font = _font(int(line_height * 0.7))
+    for top in range(line_height * 2, height - line_height * 2, line_height):
+        if rng.random() < 0.2:
+            continue  # paragraph gaps
+        words = rng.integers(4, 12)
+        draw.text((width // 12, top), ' '.join(stubs.STUB_TEXT.split()[:words] * 2), fill='black', font=font)
+    return image
+
+
+def make_video(path, megapixels, frames, seed=0):
+    """A short MP4 of a shape moving across a photo-like background."""
+    background = cv2.cvtColor(np.asarray(make_photo(megapixels, seed=seed)), cv2.COLOR_RGB2BGR)
+    height, width = background.shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25, (width, height))
+    side = min(width, height) // 5
+    for i in range(frames):
+        frame = background.copy()
+        x = (width - side) * i // max(1, frames - 1)
+        cv2.circle(frame, (x + side // 2, height // 2), side // 2, (90, 140, 200), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter; False where that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident set size in bytes since the last reset_peak_rss()."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Inputs:
+    """Files and decoded images of one (size, mode) combination."""
+
+    def __init__(self, directory, megapixels, mode, video_frames):
+        self.megapixels = megapixels
+        self.mode = mode
+        label = f'{megapixels:g}mp_{mode}'
+        self.image = make_photo(megapixels, mode)
+        self.path = os.path.join(directory, f'photo_{label}.png')
+        self.image.save(self.path, compress_level=1)
+        self.jpeg_path = None
+        if mode in ('RGB', 'L'):
+            self.jpeg_path = os.path.join(directory, f'photo_{label}.jpg')
+            self.image.save(self.jpeg_path, quality=90)
+        self.document = make_document(megapixels)
+        self.document_path = os.path.join(directory, f'document_{megapixels:g}mp.png')
+        self.document.save(self.document_path, compress_level=1)
+        self.video_path = os.path.join(directory, f'video_{megapixels:g}mp.mp4')
+        if mode == 'RGB' and not os.path.exists(self.video_path):
+            make_video(self.video_path, megapixels, video_frames)
+
+
+def operations(workers):
+    """Return {name: (run(inputs), modes or None for all, stubs it depends on)}.
+
+    Imports happen here, after the stubs are installed.
+    """
+    from image_processor import ImageProcessor as DesktopProcessor
+    from ocr_handler import OCRHandler
+    from utils.image_processor import ImageProcessor as WebProcessor
+    from utils.text_processor import TextProcessor
+    from utils.ai_processor import AIProcessor
+    from utils.image_cache import image_cache
+
+    desktop = DesktopProcessor(workers=workers)
+    web = WebProcessor(workers=workers)
+    tesseract_cmd = sys.modules['pytesseract'].pytesseract.tesseract_cmd
+    ocr = OCRHandler()
+    if os.name != 'nt':
+        # OCRHandler points pytesseract at the default Windows install location
+        sys.modules['pytesseract'].pytesseract.tesseract_cmd = tesseract_cmd
+    text = TextProcessor()
+    ai = AIProcessor()
+
+    def reset():
+        image_cache.clear()
+        web.pyramids.clear()
+        ai.face_detector.clear()
+        ai.masks.clear()
+
+    def half(inputs):
+        return inputs.image.width // 2, inputs.image.height // 2
+
+    ops = {}
+
+    def add(name, run, modes=None, needs=()):
+        ops[name] = (run, modes, needs)
+
+    for name, method, args in (
+            ('grayscale', 'convert_to_grayscale', ()), ('warm', 'add_warm_tone', ()),
+            ('sharpen', 'enhance_sharpness', ()), ('gaussian_blur', 'apply_gaussian_blur', (2,)),
+            ('median_blur', 'apply_median_blur', (3,)), ('sepia', 'apply_sepia', ()),
+            ('brightness_contrast', 'adjust_brightness_contrast', (1.2, 1.1)),
+            ('rotate', 'rotate_image', (30,)), ('flip_horizontal', 'flip_horizontal', ()),
+            ('flip_vertical', 'flip_vertical', ()), ('edge', 'edge_detection', ())):
+        add(f'desktop.{name}', lambda inputs, method=method, args=args:
+            getattr(desktop, method)(inputs.image, *args))
+    add('desktop.crop', lambda inputs: desktop.crop_image(inputs.image, 0, 0, *half(inputs)))
+    add('desktop.resize', lambda inputs: desktop.resize_image(inputs.image, *half(inputs)))
+
+    for name in ('grayscale', 'sepia', 'warm', 'sharp', 'blur', 'edge'):
+        add(f'web.filter.{name}', lambda inputs, name=name: web.apply_filter(inputs.path, name, {}))
+    for name, params in (('rotate90', {'angle': 90}), ('rotate30', {'angle': 30}),
+                         ('flip', {'direction': 'horizontal'})):
+        action = name.rstrip('0123456789')
+        add(f'web.transform.{name}', lambda inputs, action=action, params=params:
+            web.transform_image(inputs.path, action, params))
+    add('web.transform.crop', lambda inputs: web.transform_image(
+        inputs.path, 'crop', dict(zip(('right', 'bottom'), half(inputs)))))
+    add('web.transform.resize', lambda inputs: web.transform_image(
+        inputs.path, 'resize', dict(zip(('width', 'height'), half(inputs)))))
+    add('web.transform.rotate90_jpeg', lambda inputs: web.transform_image(
+        inputs.jpeg_path, 'rotate', {'angle': 90}), modes=('RGB', 'L'))
+    add('web.transform.resize_jpeg', lambda inputs: web.transform_image(
+        inputs.jpeg_path, 'resize', {'width': inputs.image.width // 4, 'height': inputs.image.height // 4}),
+        modes=('RGB', 'L'))
+    pipeline = [{'action': 'sepia'}, {'action': 'contrast', 'params': {'factor': 1.2}},
+                {'action': 'blur', 'params': {'radius': 2}}]
+    add('web.pipeline', lambda inputs: web.apply_pipeline(inputs.path, pipeline))
+    add('web.preview', lambda inputs: web.render_preview(inputs.path, pipeline))
+    for fmt in ('png', 'jpg', 'webp'):
+        add(f'web.encode.{fmt}', lambda inputs, fmt=fmt: web.apply_filter(
+            inputs.path, 'grayscale', {}, output={'format': fmt}))
+
+    ocr_needs = ('pytesseract', 'tesseract')
+    add('ocr_handler.extract_text', lambda inputs: ocr.extract_text(inputs.document, detect_regions=False),
+        modes=('RGB',), needs=ocr_needs)
+    add('ocr_handler.extract_text_regions', lambda inputs: ocr.extract_text(inputs.document, detect_regions=True),
+        modes=('RGB',), needs=ocr_needs)
+    add('ocr_handler.extract_text_batch', lambda inputs: ocr.extract_text_batch([inputs.document] * 4),
+        modes=('RGB',), needs=ocr_needs)
+    add('text.extract_text', lambda inputs: text.extract_text(inputs.document_path),
+        modes=('RGB',), needs=ocr_needs)
+    add('text.extract_text_regions', lambda inputs: text.extract_text(inputs.document_path, detect_regions=True),
+        modes=('RGB',), needs=ocr_needs)
+
+    face_needs = ('haar_cascade',)
+    add('ai.face_detect', lambda inputs: ai.process_image(inputs.path, 'face_detect'), needs=face_needs)
+    for mode in ('box', 'pixelate', 'gaussian'):
+        add(f'ai.face_blur.{mode}', lambda inputs, mode=mode: ai.process_image(
+            inputs.path, 'face_blur', {'mode': mode}), needs=face_needs)
+    add('ai.face_blur_video', lambda inputs: ai.process_image(inputs.video_path, 'face_blur_video'),
+        modes=('RGB',), needs=face_needs)
+    add('ai.remove_bg', lambda inputs: ai.process_image(inputs.path, 'remove_bg'), needs=('rembg',))
+    add('ai.caption', lambda inputs: ai.process_image(inputs.path, 'caption'), needs=('transformers',))
+    return ops, reset
+
+
+def failure(result):
+    """Return the error an operation reported through its return value, if any."""
+    if isinstance(result, dict) and 'error' in result:
+        return result['error']
+    if isinstance(result, str) and result.startswith('Error'):
+        return result
+    if isinstance(result, list) and result and isinstance(result[0], str) and result[0].startswith('Error'):
+        return result[0]
+    return None
+
+
+def measure(run, inputs, reset, repeat, warmup):
+    """Time run(inputs) and return latency percentiles, throughput and peak RSS."""
+    for _ in range(warmup):
+        if reset:
+            reset()
+        error = failure(run(inputs))
+        if error:
+            return {'error': error}
+
+    reset_peak_rss()
+    rss_before = peak_rss()
+    times = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        result = run(inputs)
+        times.append(time.perf_counter() - start)
+        error = failure(result)
+        if error:
+            return {'error': error}
+
+    seconds = np.array(times)
+    mean = float(seconds.mean())
+    return {
+        'runs': repeat,
+        'p50_ms': float(np.percentile(seconds, 50)) * 1000,
+        'p95_ms': float(np.percentile(seconds, 95)) * 1000,
+        'mean_ms': mean * 1000,
+        'min_ms': float(seconds.min()) * 1000,
+        'ops_per_second': 1 / mean if mean else None,
+        'megapixels_per_second': inputs.megapixels / mean if mean else None,
+        'peak_rss_bytes': peak_rss(),
+        'peak_rss_growth_bytes': max(0, peak_rss() - rss_before)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print p50 changes against a previous run and return the regressions."""
+    with open(baseline_path) as f:
+        baseline = {(r['operation'], r['megapixels'], r['mode']): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n{'operation':<36}{'size':>8}{'mode':>6}{'before':>11}{'after':>11}{'ratio':>8}")
+    for result in results:
+        old = baseline.get((result['operation'], result['megapixels'], result['mode']))
+        if old is None or 'p50_ms' not in old or 'p50_ms' not in result:
+            continue
+        ratio = result['p50_ms'] / old['p50_ms'] if old['p50_ms'] else float('inf')
+        flag = '  REGRESSION' if ratio > threshold else ''
+        if flag:
+            regressions.append(result)
+        print(f"{result['operation']:<36}{result['megapixels']:>7g}M{result['mode']:>6}"
+              f"{old['p50_ms']:>9.1f}ms{result['p50_ms']:>9.1f}ms{ratio:>7.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=float, default=[0.3, 2, 12],
+                        help='image sizes in megapixels')
+    parser.add_argument('--modes', nargs='+', default=['RGB', 'RGBA', 'L'])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=None, help='threads for band-parallel filters')
+    parser.add_argument('--video-frames', type=int, default=24)
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='run operations matching these prefixes or glob patterns')
+    parser.add_argument('--warm', action='store_true', help='keep caches between runs')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON from an earlier run to compare p50 latency with')
+    parser.add_argument('--threshold', type=float, default=1.15,
+                        help='p50 ratio above which --compare reports a regression')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    stubbed = stubs.install()
+    if stubbed:
+        print(f"Stubbed: {', '.join(stubbed)}")
+
+    with tempfile.TemporaryDirectory(prefix='benchmark-') as directory:
+        # Outputs, caches and uploads land in the scratch directory
+        os.chdir(directory)
+        ops, reset = operations(args.workers)
+        selected = {name: op for name, op in ops.items()
+                    if not args.only or any(name.startswith(p) or fnmatch.fnmatch(name, p) for p in args.only)}
+
+        results = []
+        print(f"{'operation':<36}{'size':>8}{'mode':>6}{'p50':>11}{'p95':>11}{'MP/s':>9}{'peak RSS':>11}")
+        for megapixels in args.sizes:
+            for mode in args.modes:
+                inputs = Inputs(directory, megapixels, mode, args.video_frames)
+                for name, (run, modes, needs) in selected.items():
+                    if modes is not None and mode not in modes:
+                        continue
+                    try:
+                        stats = measure(run, inputs, None if args.warm else reset, args.repeat, args.warmup)
+                    except Exception as e:
+                        stats = {'error': f'{type(e).__name__}: {e}'}
+                    result = {'operation': name, 'megapixels': megapixels, 'mode': mode,
+                              'stubbed': sorted(set(needs) & set(stubbed)), **stats}
+                    results.append(result)
+                    if 'error' in stats:
+                        print(f"{name:<36}{megapixels:>7g}M{mode:>6}  error: {stats['error']}")
+                    else:
+                        print(f"{name:<36}{megapixels:>7g}M{mode:>6}{stats['p50_ms']:>9.1f}ms"
+                              f"{stats['p95_ms']:>9.1f}ms{stats['megapixels_per_second']:>9.1f}"
+                              f"{stats['peak_rss_bytes'] / 2 ** 20:>9.0f}MB")
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'versions': {'numpy': np.__version__, 'pillow': PIL.__version__, 'opencv': cv2.__version__},
+            'stubbed': stubbed,
+            'peak_rss_per_operation': reset_peak_rss(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Wrote {output}')
+    if baseline and compare(results, baseline, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,11 @@ from PIL import Image, ImageTk
 import os
 from image_processor import ImageProcessor
 from ocr_handler import OCRHandler
+from utils.preview import ProxyEditor
 
 class ImageProcessingApp:
+    display_size = (800, 600)
+
     def __init__(self, root):
         self.root = root
         self.root.title("Image Processing Application")
@@ -17,7 +20,7 @@ class ImageProcessingApp:
         self.setup_ui()
         
         self.original_image = None
-        self.current_image = None
+        self.editor = None  # filters run on a preview proxy, full size on demand
         self.photo_image = None
 
     def setup_ui(self):
@@ -52,47 +55,51 @@ class ImageProcessingApp:
         if file_path:
             try:
                 self.original_image = Image.open(file_path)
-                self.current_image = self.original_image.copy()
+                self.editor = ProxyEditor(self.original_image, self.display_size)
                 self.update_image_display()
                 self.text_display.delete(1.0, tk.END)
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to open image: {str(e)}")
 
+    @property
+    def current_image(self):
+        """The full-resolution result, rendered from the recorded operations."""
+        return self.editor.full_image() if self.editor else None
+
+    def apply(self, func, *args, **kwargs):
+        if self.editor:
+            self.editor.apply(func, *args, **kwargs)
+            self.update_image_display()
+            self.editor.render_in_background()
+
     def update_image_display(self):
-        if self.current_image:
-            # Resize image to fit display while maintaining aspect ratio
-            display_size = (800, 600)
-            display_image = self.current_image.copy()
-            display_image.thumbnail(display_size, Image.Resampling.LANCZOS)
+        if self.editor:
+            # The proxy is already close to the display size, so this is cheap
+            display_image = self.editor.display_image(self.display_size)
             
             self.photo_image = ImageTk.PhotoImage(display_image)
             self.image_label.configure(image=self.photo_image)
 
     def convert_to_grayscale(self):
-        if self.current_image:
-            self.current_image = self.image_processor.convert_to_grayscale(self.current_image)
-            self.update_image_display()
+        self.apply(self.image_processor.convert_to_grayscale)
 
     def add_warm_tone(self):
-        if self.current_image:
-            if self.current_image.mode != 'RGB':
-                self.current_image = self.current_image.convert('RGB')
-            self.current_image = self.image_processor.add_warm_tone(self.current_image)
-            self.update_image_display()
+        if self.editor:
+            if self.editor.proxy.mode != 'RGB':
+                self.editor.apply(Image.Image.convert, 'RGB')
+            self.apply(self.image_processor.add_warm_tone)
 
     def enhance_sharpness(self):
-        if self.current_image:
-            self.current_image = self.image_processor.enhance_sharpness(self.current_image)
-            self.update_image_display()
+        self.apply(self.image_processor.enhance_sharpness)
 
     def extract_text(self):
-        if self.current_image:
+        if self.editor:
             text = self.ocr_handler.extract_text(self.current_image)
             self.text_display.delete(1.0, tk.END)
             self.text_display.insert(tk.END, text)
 
     def save_image(self):
-        if self.current_image:
+        if self.editor:
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".png",
                 filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")]
@@ -2,6 +2,7 @@ import pytesseract
 from PIL import Image
 import cv2
 import numpy as np
+from utils.ocr import ocr_engine
 
 class OCRHandler:
     def __init__(self):
@@ -9,6 +10,9 @@ class OCRHandler:
         # Uncomment this line for Windows and set your Tesseract path:
         # Make sure the path is correct and tesseract is installed there.
         pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+        self.engine = ocr_engine
+        # Per-stage timings of the most recent extract_text call
+        self.last_timings = {}
 
     def preprocess_image(self, image):
         """Preprocess image for better OCR results."""
@@ -27,11 +31,26 @@ class OCRHandler:
         # Convert back to PIL Image and return
         return Image.fromarray(gray)
 
-    def extract_text(self, image):
-        """Extract text from image using OCR."""
-        processed_image = self.preprocess_image(image)
+    def extract_text(self, image, detect_regions=False):
+        """Extract text from image using OCR.
+
+        With detect_regions only detected text regions are preprocessed and
+        read, which is much faster when text covers a small part of the frame.
+        """
         try:
-            text = pytesseract.image_to_string(processed_image)
-            return text.strip()
+            if detect_regions:
+                result = self.engine.recognize_regions(image, preprocess=self.preprocess_image)
+            else:
+                result = self.engine.recognize(image, preprocess=self.preprocess_image)
+            self.last_timings = result['timings']
+            return result['text']
         except Exception as e:
             return f"Error in text extraction: {str(e)}"
+
+    def extract_text_batch(self, images):
+        """Extract text from several images, preprocessed and recognised in parallel."""
+        try:
+            results = self.engine.recognize_batch(images, preprocess=self.preprocess_image)
+            return [result['text'] for result in results]
+        except Exception as e:
+            return [f"Error in text extraction: {str(e)}" for _ in images]
@@ -3,8 +3,11 @@ from tkinter import filedialog, messagebox, simpledialog
 from PIL import Image, ImageTk
 from image_processor import ImageProcessor
 from ocr_handler import OCRHandler
+from utils.preview import ProxyEditor
 
 class ImageProcessingApp:
+    display_size = (700, 500)
+
     def __init__(self, root):
         self.root = root
         self.root.title("Advanced Image Processing App")
@@ -14,7 +17,7 @@ class ImageProcessingApp:
         self.ocr_handler = OCRHandler()
         
         self.original_image = None
-        self.current_image = None
+        self.editor = None  # filters run on a preview proxy, full size on demand
         self.photo = None
 
         self.setup_ui()
@@ -55,88 +58,77 @@ class ImageProcessingApp:
         )
         if file_path:
             self.original_image = Image.open(file_path)
-            self.current_image = self.original_image.copy()
+            self.editor = ProxyEditor(self.original_image, self.display_size)
+            self.update_display()
+
+    @property
+    def current_image(self):
+        """The full-resolution result, rendered from the recorded operations."""
+        return self.editor.full_image() if self.editor else None
+
+    def apply(self, func, *args, **kwargs):
+        if self.editor:
+            self.editor.apply(func, *args, **kwargs)
             self.update_display()
+            self.editor.render_in_background()
 
     def update_display(self):
-        if self.current_image:
-            display_size = (700, 500)
-            image_copy = self.current_image.copy()
-            image_copy.thumbnail(display_size, Image.Resampling.LANCZOS)
+        if self.editor:
+            image_copy = self.editor.display_image(self.display_size)
             self.photo = ImageTk.PhotoImage(image_copy)
             self.image_label.config(image=self.photo)
 
     def convert_to_grayscale(self):
-        if self.current_image:
-            self.current_image = self.image_processor.convert_to_grayscale(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.convert_to_grayscale)
 
     def add_warm_tone(self):
-        if self.current_image:
-            if self.current_image.mode != 'RGB':
-                self.current_image = self.current_image.convert('RGB')
-            self.current_image = self.image_processor.add_warm_tone(self.current_image)
-            self.update_display()
+        if self.editor:
+            if self.editor.proxy.mode != 'RGB':
+                self.editor.apply(Image.Image.convert, 'RGB')
+            self.apply(self.image_processor.add_warm_tone)
 
     def enhance_sharpness(self):
-        if self.current_image:
-            self.current_image = self.image_processor.enhance_sharpness(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.enhance_sharpness)
 
     def gaussian_blur(self):
-        if self.current_image:
-            self.current_image = self.image_processor.apply_gaussian_blur(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.apply_gaussian_blur, radius=2, pixel_params=('radius',))
 
     def median_blur(self):
-        if self.current_image:
-            self.current_image = self.image_processor.apply_median_blur(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.apply_median_blur, radius=3, kernel_params=('radius',))
 
     def sepia_filter(self):
-        if self.current_image:
-            self.current_image = self.image_processor.apply_sepia(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.apply_sepia)
 
     def brightness_contrast(self):
-        if self.current_image:
+        if self.editor:
             brightness = simpledialog.askfloat("Brightness", "Enter brightness (e.g. 1.0):", minvalue=0.0, maxvalue=3.0)
             contrast = simpledialog.askfloat("Contrast", "Enter contrast (e.g. 1.0):", minvalue=0.0, maxvalue=3.0)
             if brightness is not None and contrast is not None:
-                self.current_image = self.image_processor.adjust_brightness_contrast(
-                    self.current_image, brightness, contrast)
-                self.update_display()
+                self.apply(self.image_processor.adjust_brightness_contrast, brightness, contrast)
 
     def rotate_image(self):
-        if self.current_image:
+        if self.editor:
             angle = simpledialog.askinteger("Rotate", "Enter rotation angle (degrees):")
             if angle is not None:
-                self.current_image = self.image_processor.rotate_image(self.current_image, angle)
-                self.update_display()
+                self.apply(self.image_processor.rotate_image, angle)
 
     def flip_horizontal(self):
-        if self.current_image:
-            self.current_image = self.image_processor.flip_horizontal(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.flip_horizontal)
 
     def flip_vertical(self):
-        if self.current_image:
-            self.current_image = self.image_processor.flip_vertical(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.flip_vertical)
 
     def edge_detection(self):
-        if self.current_image:
-            self.current_image = self.image_processor.edge_detection(self.current_image)
-            self.update_display()
+        self.apply(self.image_processor.edge_detection)
 
     def extract_text(self):
-        if self.current_image:
+        if self.editor:
             text = self.ocr_handler.extract_text(self.current_image)
             messagebox.showinfo("OCR Extracted Text", text if text else "No text detected.")
 
     def restore_original(self):
-        if self.original_image:
-            self.current_image = self.original_image.copy()
+        if self.editor:
+            self.editor.reset()
             self.update_display()
 
 def main():
@@ -1,35 +1,117 @@
 import cv2
 import numpy as np
 from PIL import Image
-import torch
-from rembg import remove
-from transformers import pipeline
 import os
 import logging
+from utils.image_cache import image_cache
+from utils.output_store import output_store
+from utils.lazy import lazy, lazy_import
+from utils.batching import MicroBatcher
+from utils.faces import FaceDetector, blur_region, BLUR_MODES, DEFAULT_MAX_SIDE
+from utils.video import blur_video, DEFAULT_DETECT_EVERY
+from utils.background import BackgroundRemover, MaskCache, DEFAULT_MODEL, DEFAULT_MASK_CACHE_BYTES
+from utils.pipeline import Pipeline
+from utils import tiling
+
+CAPTION_MODEL = "Salesforce/blip-image-captioning-base"
 
 logger = logging.getLogger(__name__)
 
+def _to_bgr(array):
+    """Return a writable BGR copy of a cached RGB/RGBA/L array."""
+    if array.ndim == 2:
+        return cv2.cvtColor(array, cv2.COLOR_GRAY2BGR)
+    if array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_RGBA2BGR)
+    return cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+
+# EXIF orientation -> transpose that turns the stored pixels upright
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def _upright_array(filepath):
+    """Cached pixels of filepath turned upright by its EXIF orientation, as cv2.imread does."""
+    array = image_cache.load_array(filepath)
+    try:
+        with tiling.open_unchecked(filepath) as image:
+            orientation = image.getexif().get(0x0112, 1)
+    except Exception:
+        orientation = 1
+    if orientation not in EXIF_TRANSPOSE:
+        return array
+    return np.asarray(Image.fromarray(array).transpose(EXIF_TRANSPOSE[orientation]))
+
+def _load_caption_model():
+    from transformers import pipeline
+    return pipeline("image-to-text", model=CAPTION_MODEL)
+
 class AIProcessor:
-    def __init__(self):
-        # Initialize face detection
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    def __init__(self, caption_batch_size=8, caption_max_wait=0.05,
+                 face_backend='haar', face_max_side=DEFAULT_MAX_SIDE,
+                 face_dnn_model=None, face_dnn_config=None, content_hash=None,
+                 remove_bg_model=DEFAULT_MODEL, mask_cache_bytes=DEFAULT_MASK_CACHE_BYTES):
+        # Initialize face detection; boxes are cached per image
+        self.face_detector = FaceDetector(face_backend, face_max_side, face_dnn_model, face_dnn_config)
+        # Identifies an image for the per-image caches, e.g. ResultCache.content_hash
+        self.content_hash = content_hash
         
-        # Initialize image captioning
+        # Heavy libraries and models load on first use
+        self._rembg = lazy_import('rembg')
+        self._caption_model = lazy('caption_model', _load_caption_model)
+
+        # One rembg session per model; masks are kept per image so edits of a cut-out skip inference
+        self.remove_bg_model = remove_bg_model
+        self.background = BackgroundRemover(self._rembg)
+        self.masks = MaskCache(mask_cache_bytes)
+
+        # Caption requests arriving within max_wait of each other share one forward pass.
+        # rembg has no batched inference, so background removal is not batched; concurrent
+        # requests run side by side on the shared session instead.
+        self._caption_batcher = MicroBatcher(self._caption_batch, caption_batch_size,
+                                             caption_max_wait, name='caption')
+
+    @property
+    def caption_generator(self):
         try:
-            self.caption_generator = pipeline("image-to-text", model="Salesforce/blip-image-captioning-base")
-        except Exception as e:
-            logger.error(f"Error loading caption model: {str(e)}")
-            self.caption_generator = None
+            return self._caption_model.get()
+        except Exception:
+            return None
+
+    def _image_key(self, filepath):
+        if self.content_hash is not None:
+            return self.content_hash(filepath)
+        return image_cache.file_key(filepath)
+
+    def batch_stats(self):
+        return {
+            'caption': self._caption_batcher.stats(),
+            'masks': self.masks.stats()
+        }
 
-    def process_image(self, filepath, action, params=None):
+    def _caption_batch(self, filepaths):
+        """Caption several images in one forward pass."""
+        results = self.caption_generator(filepaths, batch_size=len(filepaths))
+        return [result[0]['generated_text'] if result else "Could not generate caption"
+                for result in results]
+
+    def process_image(self, filepath, action, params=None, session_id=None):
         """Process image with AI-based operations."""
         try:
             if action == 'face_detect':
-                return self._detect_faces(filepath, blur=False)
+                return self._detect_faces(filepath, blur=False, params=params, session_id=session_id)
             elif action == 'face_blur':
-                return self._detect_faces(filepath, blur=True)
+                return self._detect_faces(filepath, blur=True, params=params, session_id=session_id)
+            elif action == 'face_blur_video':
+                return self._blur_video(filepath, params or {}, session_id)
             elif action == 'remove_bg':
-                return self._remove_background(filepath)
+                return self._remove_background(filepath, params or {}, session_id)
             elif action == 'caption':
                 return self._generate_caption(filepath)
             else:
@@ -38,15 +120,21 @@ class AIProcessor:
             logger.error(f"Error in AI processing: {str(e)}")
             return {'error': str(e)}
 
-    def _detect_faces(self, filepath, blur=False):
+    def _detect_faces(self, filepath, blur=False, params=None, session_id=None):
         """Detect faces in image and optionally blur them."""
         try:
-            # Read image
-            image = cv2.imread(filepath)
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            params = params or {}
+            mode = params.get('mode', 'box')
+            if mode not in BLUR_MODES:
+                return {'error': f'Invalid blur mode: {mode}'}
+
+            # Read image, upright like the phone that took it
+            array = _upright_array(filepath)
             
-            # Detect faces
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Detect faces on a downscaled copy, reusing boxes found earlier for this image
+            faces, cached = self.face_detector.detect_cached(
+                self._image_key(filepath), lambda: _to_bgr(array),
+                params.get('min_size'), params.get('max_size'))
             
             if len(faces) == 0:
                 return {
@@ -56,13 +144,12 @@ class AIProcessor:
                 }
             
             # Process faces
+            image = _to_bgr(array)
             face_data = []
             for (x, y, w, h) in faces:
                 if blur:
                     # Apply blur to face region
-                    face_roi = image[y:y+h, x:x+w]
-                    blurred_face = cv2.GaussianBlur(face_roi, (99, 99), 30)
-                    image[y:y+h, x:x+w] = blurred_face
+                    blur_region(image, (x, y, w, h), mode)
                 else:
                     # Draw rectangle around face
                     cv2.rectangle(image, (x, y), (x+w, y+h), (255, 0, 0), 2)
@@ -76,36 +163,81 @@ class AIProcessor:
             
             # Save processed image
             filename = os.path.basename(filepath)
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            cv2.imwrite(output_path, image)
+            with output_store.writing(session_id, f'processed_{filename}',
+                                      os.path.splitext(filename)[1]) as (output_path, url):
+                cv2.imwrite(output_path, image)
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}',
-                'faces': face_data
+                'filepath': url,
+                'faces': face_data,
+                'detection_cached': cached
             }
         
         except Exception as e:
             logger.error(f"Error in face detection: {str(e)}")
             return {'error': str(e)}
 
-    def _remove_background(self, filepath):
-        """Remove background from image."""
+    def _blur_video(self, filepath, params, session_id=None):
+        """Blur faces in a video file, tracking them between detections."""
         try:
+            mode = params.get('mode', 'box')
+            if mode not in BLUR_MODES:
+                return {'error': f'Invalid blur mode: {mode}'}
+
+            filename = os.path.basename(filepath)
+            with output_store.writing(session_id, f'processed_{filename}', '.mp4') as (output_path, url):
+                stats = blur_video(filepath, output_path, self.face_detector,
+                                   detect_every=max(1, int(params.get('detect_every', DEFAULT_DETECT_EVERY))),
+                                   mode=mode, min_size=params.get('min_size'), max_size=params.get('max_size'))
+            
+            return {
+                'success': True,
+                'filepath': url,
+                'frames': stats['frames'],
+                'fps': stats['fps'],
+                'stats': stats
+            }
+        
+        except Exception as e:
+            logger.error(f"Error in video face blur: {str(e)}")
+            return {'error': str(e)}
+
+    def _remove_background(self, filepath, params=None, session_id=None):
+        """Remove background from image, optionally after applying filter steps."""
+        try:
+            params = params or {}
+            model = params.get('model', self.remove_bg_model)
+
             # Read image
-            input_image = Image.open(filepath)
+            input_image = image_cache.load_image(filepath)
             
-            # Remove background
-            output_image = remove(input_image)
+            # Predict the mask, or reuse the one computed earlier for this image
+            key = (self._image_key(filepath), model)
+            mask = self.masks.get(key)
+            cached = mask is not None
+            if mask is None:
+                mask = self.background.full_mask(input_image, model)
+                self.masks.put(key, mask)
+
+            # Filters on the cut-out run on the original and reuse the mask
+            if params.get('steps'):
+                input_image = Pipeline(params['steps']).to_image(input_image)
+                if input_image.size != (mask.shape[1], mask.shape[0]):
+                    return {'error': 'Steps applied to a cut-out must keep the image size'}
+
+            # Composite the mask as alpha
+            output_image = input_image.convert('RGBA')
+            output_image.putalpha(Image.fromarray(mask))
             
             # Save processed image
             filename = os.path.basename(filepath)
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            output_image.save(output_path, 'PNG')
+            url = output_store.save_image(output_image, session_id, f'processed_{filename}', '.png')
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}'
+                'filepath': url,
+                'mask_cached': cached
             }
         
         except Exception as e:
@@ -118,9 +250,8 @@ class AIProcessor:
             if not self.caption_generator:
                 return {'error': 'Caption generator not initialized'}
             
-            # Generate caption
-            result = self.caption_generator(filepath)
-            caption = result[0]['generated_text'] if result else "Could not generate caption"
+            # Generate caption, batched with concurrent requests
+            caption = self._caption_batcher(filepath)
             
             return {
                 'success': True,
@@ -0,0 +1,149 @@
+import threading
+import logging
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'u2net'
+# Side length each rembg model resizes its input to
+MODEL_INPUT_SIZES = {
+    'u2net': 320,
+    'u2netp': 320,
+    'u2net_human_seg': 320,
+    'u2net_cloth_seg': 768,
+    'silueta': 320,
+    'isnet-general-use': 1024,
+    'isnet-anime': 1024,
+}
+DEFAULT_MASK_CACHE_BYTES = 256 * 1024 * 1024
+GUIDED_RADIUS = 2  # in pixels of the inference-size image
+GUIDED_EPS = 1e-3
+
+
+def inference_size(size, model):
+    """Largest size with the image's aspect ratio that fits the model's input."""
+    side = MODEL_INPUT_SIZES.get(model, 320)
+    width, height = size
+    scale = min(1.0, side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def upsample_mask(mask, guide_small, guide_full, radius=GUIDED_RADIUS, eps=GUIDED_EPS):
+    """Upsample a low-resolution alpha mask so its edges follow the full image.
+
+    A fast guided filter: the local linear model alpha = a * I + b is
+    fitted at inference resolution, then a and b are upsampled and applied
+    to the full-resolution grayscale guide I. Edges come from the photo
+    rather than from interpolating the coarse mask, at a cost of two
+    resizes and a multiply-add per output pixel.
+    """
+    height, width = guide_full.shape[:2]
+    if mask.shape[:2] == (height, width):
+        return mask
+    I = guide_small.astype(np.float32) / 255
+    p = mask.astype(np.float32) / 255
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, -1, size)
+
+    mean_I, mean_p = box(I), box(p)
+    var_I = box(I * I) - mean_I * mean_I
+    cov_Ip = box(I * p) - mean_I * mean_p
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+
+    A = cv2.resize(box(a), (width, height), interpolation=cv2.INTER_LINEAR)
+    B = cv2.resize(box(b), (width, height), interpolation=cv2.INTER_LINEAR)
+    np.multiply(A, guide_full, out=A)
+    A *= 1 / 255
+    A += B
+    del B
+    # convertScaleAbs saturates to 0..255 in the same pass
+    return cv2.convertScaleAbs(A, alpha=255)
+
+
+class MaskCache:
+    """LRU cache of full-resolution alpha masks keyed by (image hash, model)."""
+
+    def __init__(self, max_bytes=DEFAULT_MASK_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            mask = self._entries.get(key)
+            if mask is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return mask
+
+    def put(self, key, mask):
+        mask.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key).nbytes
+            if mask.nbytes > self.max_bytes:
+                return
+            self._entries[key] = mask
+            self.current_bytes += mask.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.current_bytes -= old.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.current_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+class BackgroundRemover:
+    """Predict foreground masks with one persistent rembg session per model."""
+
+    def __init__(self, rembg):
+        # rembg is a LazyResource so the library loads on first use
+        self._rembg = rembg
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, model):
+        with self._lock:
+            session = self._sessions.get(model)
+            if session is None:
+                logger.info(f"Creating rembg session for {model}")
+                session = self._sessions[model] = self._rembg.get().new_session(model)
+            return session
+
+    def predict(self, model, images):
+        """Return an L-mode mask for each image, at the image's own size."""
+        session = self.session(model)
+        remove = self._rembg.get().remove
+        return [remove(image, session=session, only_mask=True) for image in images]
+
+    def full_mask(self, image, model=DEFAULT_MODEL):
+        """Return the full-resolution alpha mask of a PIL image as a uint8 array.
+
+        Inference runs on a copy downscaled to the model's input size; the
+        mask is brought back to full size with upsample_mask.
+        """
+        rgb = image.convert('RGB')
+        small = rgb.resize(inference_size(rgb.size, model), Image.Resampling.BILINEAR, reducing_gap=3.0)
+        mask = self.predict(model, [small])[0]
+        mask = np.asarray(mask.convert('L').resize(small.size))
+        guide_full = np.asarray(rgb.convert('L'))
+        return upsample_mask(mask, np.asarray(small.convert('L')), guide_full)
@@ -0,0 +1,164 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from PIL import Image
+
+from utils.pipeline import Pipeline
+from utils import encoder
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif', '.webp'}
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def recipe_hash(steps):
+    """Stable hash of a recipe, so outputs made with another recipe are redone."""
+    return hashlib.sha1(json.dumps(steps, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def find_inputs(pattern, exclude=None):
+    """Expand a directory or glob pattern into a sorted list of image files.
+
+    Files under the exclude directory, e.g. the batch's own output, are left out.
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*')
+    paths = glob.glob(pattern, recursive=True)
+    excluded = os.path.abspath(exclude) + os.sep if exclude else None
+    return sorted(p for p in paths
+                  if os.path.isfile(p) and os.path.splitext(p)[1].lower() in IMAGE_EXTENSIONS
+                  and not (excluded and os.path.abspath(p).startswith(excluded)))
+
+
+def input_root(pattern):
+    """The directory outputs are laid out relative to: the pattern's leading non-glob part."""
+    if os.path.isdir(pattern):
+        return pattern
+    parts = []
+    for part in pattern.split(os.sep):
+        if any(c in part for c in '*?['):
+            return os.sep.join(parts) or ('/' if pattern.startswith(os.sep) else '.')
+        parts.append(part)
+    return os.path.dirname(pattern) or '.'
+
+
+def output_path_for(source, root, output_dir, output_format=None):
+    relative = os.path.relpath(source, root)
+    if output_format:
+        relative = os.path.splitext(relative)[0] + '.' + output_format.lstrip('.')
+    return os.path.join(output_dir, relative)
+
+
+def process_file(source, destination, steps):
+    """Apply a recipe to one file; runs inside a worker process."""
+    start = time.perf_counter()
+    try:
+        with Image.open(source) as image:
+            result = Pipeline(steps).to_image(image)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        # Write next to the target and rename so an interrupted run leaves no partial file
+        # Encoded like /process results, e.g. transparency flattened for JPEG
+        fmt, _ = encoder.output_format(destination)
+        temp_path = f'{destination}.part{os.path.splitext(destination)[1]}'
+        encoder.encode(result, temp_path, fmt)
+        os.replace(temp_path, destination)
+        return {'status': 'ok', 'seconds': time.perf_counter() - start,
+                'bytes': os.path.getsize(destination)}
+    except Exception as e:
+        return {'status': 'error', 'error': str(e), 'seconds': time.perf_counter() - start}
+
+
+def load_manifest(manifest_path):
+    """Return the last manifest record per source file."""
+    records = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a torn final line from an interrupted run
+                records[record['source']] = record
+    return records
+
+
+def is_up_to_date(source, destination, record, recipe):
+    if record is None or record.get('status') != 'ok' or record.get('recipe') != recipe:
+        return False
+    if not os.path.exists(destination):
+        return False
+    return os.path.getmtime(destination) >= os.path.getmtime(source)
+
+
+def run_batch(pattern, output_dir, steps, workers=None, max_in_flight=None,
+              output_format=None, progress=None):
+    """Apply a filter/transform recipe to every image matching pattern.
+
+    Files are streamed through a process pool with at most max_in_flight
+    jobs outstanding, so memory stays bounded however many files match.
+    Every result is appended to manifest.jsonl in output_dir; on the next
+    run files whose output is newer than the source and was made with the
+    same recipe are skipped, which makes an interrupted run resumable.
+    Outputs mirror the source paths below the pattern's non-glob prefix;
+    a source whose output path is already taken is recorded as an error
+    rather than overwriting it. Returns a summary dict.
+    """
+    Pipeline(steps)  # validate the recipe before starting any work
+    root = input_root(pattern)
+    sources = find_inputs(pattern, exclude=output_dir)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    recipe = recipe_hash(steps)
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path)
+    summary = {'total': len(sources), 'ok': 0, 'skipped': 0, 'error': 0,
+               'manifest': manifest_path}
+    start = time.perf_counter()
+
+    with open(manifest_path, 'a') as manifest, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def record(source, destination, result):
+            entry = dict(result, source=source, output=destination, recipe=recipe, finished_at=time.time())
+            manifest.write(json.dumps(entry) + '\n')
+            manifest.flush()
+            summary[result['status']] += 1
+            if progress:
+                progress(entry)
+
+        def drain():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source, destination = pending.pop(future)
+                record(source, destination, future.result())
+
+        claimed = {}
+        for source in sources:
+            destination = output_path_for(source, root, output_dir, output_format)
+            if destination in claimed:
+                # e.g. a.png and a.jpg both converted to a.webp
+                record(source, destination, {'status': 'error', 'seconds': 0.0,
+                                             'error': f'Output collides with {claimed[destination]}'})
+                continue
+            claimed[destination] = source
+            if is_up_to_date(source, destination, previous.get(source), recipe):
+                summary['skipped'] += 1
+                continue
+            while len(pending) >= max_in_flight:
+                drain()
+            pending[pool.submit(process_file, source, destination, steps)] = (source, destination)
+
+        while pending:
+            drain()
+
+    summary['seconds'] = time.perf_counter() - start
+    logger.info(f"Batch finished: {summary}")
+    return summary
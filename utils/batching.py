@@ -0,0 +1,109 @@
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Group requests that arrive close together into one batch call.
+
+    batch_fn receives a list of items and must return a list of results
+    in the same order. A batch is dispatched when it reaches
+    max_batch_size or when its oldest item has waited max_wait seconds,
+    so no request waits longer than max_wait for company. If a batch
+    fails, its items are retried one by one, so only those that fail on
+    their own get an exception.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait=0.05, name='batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submit an item and wait for its result."""
+        return self.submit(item).result(timeout=timeout)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait': self.max_wait
+        }
+
+    def _ensure_worker(self):
+        # Started on first use so forked worker processes get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                results = self._call(items)
+            except Exception as e:
+                logger.error(f"Error in {self.name} batch: {str(e)}")
+                if len(batch) == 1:
+                    futures[0].set_exception(e)
+                else:
+                    # One bad item must not fail everyone else's request
+                    self._run_singly(batch)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _run_singly(self, batch):
+        for item, future in batch:
+            try:
+                result = self._call([item])[0]
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += 1
+            future.set_result(result)
+
+    def _call(self, items):
+        results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise ValueError(f'{self.name} returned {len(results)} results for {len(items)} items')
+        return results
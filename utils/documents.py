@@ -0,0 +1,108 @@
+import os
+import hashlib
+import logging
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from PIL import Image
+
+try:
+    import pdf2image
+except ImportError:  # optional, needed for PDF input (and poppler on the system)
+    pdf2image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DPI = 300
+
+
+def is_document(filepath):
+    """True for PDFs and multi-page TIFFs, which are OCRed page by page."""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.pdf':
+        return True
+    if ext in ('.tif', '.tiff'):
+        with Image.open(filepath) as image:
+            return getattr(image, 'n_frames', 1) > 1
+    return False
+
+
+def page_count(filepath):
+    if filepath.lower().endswith('.pdf'):
+        if pdf2image is None:
+            raise RuntimeError('pdf2image is required to read PDF files')
+        return pdf2image.pdfinfo_from_path(filepath)['Pages']
+    with Image.open(filepath) as image:
+        return getattr(image, 'n_frames', 1)
+
+
+def iter_pages(filepath, dpi=DEFAULT_DPI):
+    """Yield (page number, image) one page at a time, starting at 1.
+
+    Only the page being yielded is held in memory: PDF pages are rendered
+    individually with pdf2image, TIFF frames are decoded on seek.
+    """
+    count = page_count(filepath)
+    if filepath.lower().endswith('.pdf'):
+        for number in range(1, count + 1):
+            pages = pdf2image.convert_from_path(filepath, dpi=dpi, first_page=number, last_page=number)
+            yield number, pages[0]
+    else:
+        with Image.open(filepath) as image:
+            for index in range(count):
+                image.seek(index)
+                frame = image.convert('RGB') if image.mode not in ('1', 'L', 'RGB') else image.copy()
+                yield index + 1, frame
+
+
+def page_hash(image, lang, detect_regions):
+    """Identify a rendered page by its pixels and the OCR settings."""
+    sha = hashlib.sha256(f'{image.mode}:{image.size}:{lang}:{detect_regions}'.encode())
+    sha.update(image.tobytes())
+    return sha.hexdigest()
+
+
+def ocr_document(filepath, engine, lang='eng', detect_regions=False, cache=None,
+                 dpi=DEFAULT_DPI, max_in_flight=None):
+    """OCR every page of a PDF or TIFF, yielding each page's result as it finishes.
+
+    Pages are rendered one at a time and queued on the OCR engine's pool
+    with at most max_in_flight outstanding, so memory stays bounded by a
+    few pages however long the document is. When a ResultCache is given,
+    each page's text is stored under its page hash, so re-running a
+    document only recognises pages whose rendering changed. Results come
+    out of order; each carries its page number.
+    """
+    max_in_flight = max_in_flight or engine.workers * 2
+    pending = {}
+
+    def finished(future):
+        number, key = pending.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Error in OCR of page {number}: {str(e)}")
+            return {'page': number, 'error': str(e)}
+        page = {'page': number, 'text': result['text'], 'timings': result['timings']}
+        if cache is not None:
+            cache.put(key, 'ocr_page', page)
+        return dict(page, cached=False)
+
+    for number, image in iter_pages(filepath, dpi):
+        key = page_hash(image, lang, detect_regions)
+        cached = cache.get(key, 'ocr_page') if cache is not None else None
+        if cached is not None:
+            result, _ = cached
+            yield dict(result, page=number, cached=True)
+            continue
+
+        while len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield finished(future)
+        pending[engine.submit(image, lang, detect_regions)] = (number, key)
+        del image
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield finished(future)
@@ -0,0 +1,187 @@
+import os
+import time
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from utils import tiling
+
+FORMATS = {
+    'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF',
+    'tif': 'TIFF', 'tiff': 'TIFF', 'bmp': 'BMP', 'gif': 'GIF',
+}
+EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp', 'AVIF': '.avif',
+              'TIFF': '.tif', 'BMP': '.bmp', 'GIF': '.gif'}
+
+# Modes each format stores directly; anything else is converted by prepare()
+ENCODABLE_MODES = {
+    'JPEG': {'L', 'RGB', 'CMYK'},
+    'PNG': {'1', 'L', 'LA', 'P', 'I;16', 'RGB', 'RGBA'},
+    'WEBP': {'RGB', 'RGBA'},
+    'AVIF': {'RGB', 'RGBA'},
+    'BMP': {'1', 'L', 'P', 'RGB'},
+    'GIF': {'L', 'P'},
+}
+
+# 'speed' for interactive use, 'size' for downloads; 'balanced' is the default.
+# PNG level 3 is close to level 1 in time and to level 6 in size on photos.
+PRESETS = {
+    'speed': {
+        'PNG': {'compress_level': 1},
+        'JPEG': {'quality': 80},
+        'WEBP': {'quality': 80, 'method': 0},
+        'AVIF': {'quality': 60, 'speed': 10},
+    },
+    'balanced': {
+        'PNG': {'compress_level': 3},
+        'JPEG': {'quality': 85, 'optimize': True},
+        'WEBP': {'quality': 80, 'method': 4},
+        'AVIF': {'quality': 60, 'speed': 6},
+    },
+    'size': {
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'JPEG': {'quality': 80, 'optimize': True, 'progressive': True},
+        'WEBP': {'quality': 75, 'method': 6},
+        'AVIF': {'quality': 50, 'speed': 4},
+    },
+}
+DEFAULT_PRESET = 'balanced'
+
+# Options a request may set directly, per format
+OPTION_KEYS = {
+    'PNG': ('compress_level', 'optimize'),
+    'JPEG': ('quality', 'optimize', 'progressive', 'subsampling'),
+    'WEBP': ('quality', 'method', 'lossless'),
+    'AVIF': ('quality', 'speed'),
+}
+
+
+def available_formats():
+    """Output formats this Pillow build can write."""
+    Image.init()
+    return sorted({fmt for fmt in FORMATS.values() if fmt in Image.SAVE})
+
+
+def output_format(filename, options=None):
+    """Return (PIL format, extension) for an output, from options['format'] or filename."""
+    requested = (options or {}).get('format')
+    name = (requested or os.path.splitext(filename)[1] or 'png').lstrip('.').lower()
+    fmt = FORMATS.get(name)
+    if fmt is None or fmt not in available_formats():
+        raise ValueError(f'Unsupported output format: {name}')
+    if requested is None and name in ('jpeg', 'tiff'):
+        # Keep the upload's own spelling of the extension
+        return fmt, '.' + name
+    return fmt, EXTENSIONS[fmt]
+
+
+def save_options(fmt, options=None, metadata=None):
+    """Build Image.save keyword arguments from a preset plus explicit options."""
+    options = options or {}
+    preset = options.get('preset', DEFAULT_PRESET)
+    if preset not in PRESETS:
+        raise ValueError(f'Unknown encode preset: {preset}')
+    save = dict(PRESETS[preset].get(fmt, {}))
+    for key in OPTION_KEYS.get(fmt, ()):
+        if key in options:
+            save[key] = options[key]
+
+    metadata = metadata or {}
+    if fmt == 'JPEG' and metadata.get('qtables') and not ('quality' in options or 'preset' in options):
+        # Re-encode a JPEG at the quality it was uploaded with
+        save.pop('quality', None)
+        save['qtables'] = metadata['qtables']
+        if metadata.get('subsampling', -1) >= 0 and 'subsampling' not in options:
+            save['subsampling'] = metadata['subsampling']
+    if options.get('keep_metadata'):
+        for key in ('exif', 'icc_profile', 'dpi'):
+            if metadata.get(key):
+                save[key] = metadata[key]
+    return save
+
+
+def source_metadata(filepath):
+    """Read what an encode may carry over from the source file, without decoding it.
+
+    EXIF, ICC profile and DPI are only written when the request asks for
+    keep_metadata; JPEG quantization tables are used to match the source
+    quality when a JPEG is re-encoded without an explicit quality.
+    """
+    metadata = {}
+    try:
+        # Only the header is read, so images over Pillow's pixel limit are fine
+        with tiling.open_unchecked(filepath) as image:
+            for key in ('exif', 'icc_profile', 'dpi'):
+                if image.info.get(key):
+                    metadata[key] = image.info[key]
+            if image.format == 'JPEG':
+                metadata['qtables'] = getattr(image, 'quantization', None)
+                metadata['subsampling'] = JpegImagePlugin.get_sampling(image)
+    except (OSError, SyntaxError):
+        pass
+    return metadata
+
+
+def _to_8bit(image):
+    """Scale a 16-bit, 32-bit integer or float image to 'L'."""
+    array = np.asarray(image)
+    if image.mode == 'F':
+        array = np.clip(array, 0, 255)
+    elif array.max(initial=0) > 255:
+        array = array / 257
+    return Image.fromarray(array.astype(np.uint8), 'L')
+
+
+def prepare(image, fmt, background=(255, 255, 255)):
+    """Convert image to a mode fmt can store.
+
+    Transparency is flattened onto background for formats without an
+    alpha channel, high bit depths are scaled down to 8 bits,
+    grayscale is expanded to RGB where the format has no gray mode, and
+    color is quantized to an adaptive palette for palette-only formats.
+    """
+    modes = ENCODABLE_MODES.get(fmt)
+    if modes is None or image.mode in modes:
+        return image
+    if image.mode in ('I', 'I;16', 'F'):
+        image = _to_8bit(image)
+    elif image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode == '1':
+        image = image.convert('L')
+    if image.mode in modes:
+        return image
+
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        if 'RGBA' in modes or 'LA' in modes:
+            return image.convert('LA' if 'LA' in modes and image.mode == 'LA' else 'RGBA')
+        flat = Image.new('RGB', image.size, background)
+        flat.paste(image.convert('RGBA'), mask=image.getchannel('A'))
+        if 'L' in modes and image.mode == 'LA':
+            return flat.convert('L')
+        image = flat
+        if image.mode in modes:
+            return image
+    if image.mode == 'L' and 'RGB' in modes:
+        return image.convert('RGB')
+    if 'RGB' not in modes and 'P' in modes:
+        # Palette-only formats such as GIF; an adaptive palette keeps the colors
+        return image.convert('RGB').quantize(256)
+    return image.convert('RGB' if 'RGB' in modes else sorted(modes)[0])
+
+
+def report(fmt, path, start):
+    """Encode stats for a file written since start (a perf_counter value)."""
+    return {
+        'format': fmt,
+        'bytes': os.path.getsize(path),
+        'encode_ms': (time.perf_counter() - start) * 1000
+    }
+
+
+def encode(image, path, fmt, options=None, metadata=None):
+    """Write image to path in fmt and return {'format', 'bytes', 'encode_ms'}."""
+    start = time.perf_counter()
+    image = prepare(image, fmt)
+    image.save(path, fmt, **save_options(fmt, options, metadata))
+    return report(fmt, path, start)
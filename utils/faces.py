@@ -0,0 +1,178 @@
+import threading
+import logging
+from collections import OrderedDict
+
+import cv2
+
+from utils.tiling import detect_in_tiles, TILED_THRESHOLD_PIXELS
+
+logger = logging.getLogger(__name__)
+
+HAAR_CASCADE = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+HAAR_WINDOW = 24  # the frontal face cascade is trained on 24x24 windows
+DNN_INPUT = (300, 300)  # res10 SSD face detector input size
+DNN_MEAN = (104.0, 177.0, 123.0)
+
+DEFAULT_MAX_SIDE = None  # detect at full resolution unless a limit is configured
+DEFAULT_MIN_FACE = None  # smallest face wanted, at full resolution
+BLUR_MODES = ('box', 'pixelate', 'gaussian')
+
+
+def detection_scale(height, width, max_side, min_face):
+    """Scale at which to detect.
+
+    With min_face the image is shrunk only as far as keeps faces of that
+    size at least as large as the detector window, so none are lost.
+    Otherwise it is shrunk to max_side on the long edge, if set; faces
+    smaller than HAAR_WINDOW / scale pixels are then missed.
+    """
+    if min_face:
+        return min(1.0, HAAR_WINDOW / min_face)
+    if max_side:
+        return min(1.0, max_side / max(height, width))
+    return 1.0
+
+
+def blur_region(image, box, mode='box'):
+    """Anonymise one face box in place.
+
+    'box' and 'pixelate' cost a fixed amount per pixel whatever the face
+    size: cv2.blur uses running sums, and pixelation is one area
+    downscale and one nearest-neighbour upscale. 'gaussian' is the old
+    99x99 kernel.
+    """
+    x, y, w, h = box
+    roi = image[y:y + h, x:x + w]
+    if roi.size == 0:
+        return
+    if mode == 'pixelate':
+        blocks = (max(1, w // 12), max(1, h // 12))
+        small = cv2.resize(roi, blocks, interpolation=cv2.INTER_AREA)
+        image[y:y + h, x:x + w] = cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+    elif mode == 'gaussian':
+        image[y:y + h, x:x + w] = cv2.GaussianBlur(roi, (99, 99), 30)
+    else:
+        size = max(3, min(w, h) // 3)
+        image[y:y + h, x:x + w] = cv2.blur(roi, (size, size))
+
+
+class FaceDetector:
+    """Face detection, on a downscaled copy where possible, with a box cache.
+
+    With a min_size, the image is shrunk as far as faces of that size still
+    cover the detector window, and the boxes are mapped back to full
+    resolution. Without one, detection runs at full resolution and finds
+    faces down to the 24 pixel window, unless max_side is set: then the
+    long edge is shrunk to max_side, which is faster on large photos but
+    misses faces smaller than 24 pixels times the shrink factor, e.g.
+    under about 94 pixels in a 4000 pixel wide image with max_side 1024.
+    backend is 'haar' or 'dnn'; the DNN backend is OpenCV's res10 SSD
+    (Caffe prototxt and model files) run on the CPU. Detectors are per
+    thread, since OpenCV's are not safe to share. Results are cached by
+    image key and settings, so detecting and then blurring the same image
+    runs the detector once.
+    """
+
+    def __init__(self, backend='haar', max_side=DEFAULT_MAX_SIDE, dnn_model=None, dnn_config=None,
+                 confidence=0.5, cache_entries=256):
+        if backend == 'dnn' and not (dnn_model and dnn_config):
+            raise ValueError('The dnn backend needs dnn_model and dnn_config files')
+        self.backend = backend
+        self.max_side = max_side
+        self.dnn_model = dnn_model
+        self.dnn_config = dnn_config
+        self.confidence = confidence
+        self.cache_entries = cache_entries
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def detect(self, image, min_size=DEFAULT_MIN_FACE, max_size=None):
+        """Return face boxes (x, y, w, h) of a BGR or grayscale array at full resolution."""
+        height, width = image.shape[:2]
+        scale = detection_scale(height, width, self.max_side, min_size if self.backend == 'haar' else 0)
+        small = image
+        if scale < 1.0:
+            small = cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        if self.backend == 'dnn':
+            boxes = self._detect_dnn(small)
+        else:
+            boxes = self._detect_haar(small, min_size * scale if min_size else 0,
+                                      max_size * scale if max_size else 0)
+
+        faces = []
+        for x, y, w, h in boxes:
+            x, y = max(0, round(x / scale)), max(0, round(y / scale))
+            w, h = min(round(w / scale), width - x), min(round(h / scale), height - y)
+            if w <= 0 or h <= 0:
+                continue
+            if (min_size and min(w, h) < min_size) or (max_size and max(w, h) > max_size):
+                continue
+            faces.append((x, y, w, h))
+        return faces
+
+    def detect_cached(self, key, load, min_size=DEFAULT_MIN_FACE, max_size=None):
+        """Return (boxes, cached) for the image identified by key; load() gives its array."""
+        cache_key = (key, self.backend, self.max_side, min_size, max_size)
+        with self._lock:
+            faces = self._cache.get(cache_key)
+            if faces is not None:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                return faces, True
+            self.misses += 1
+
+        faces = self.detect(load(), min_size, max_size)
+        with self._lock:
+            self._cache[cache_key] = faces
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return faces, False
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.backend, 'entries': len(self._cache),
+                    'hits': self.hits, 'misses': self.misses}
+
+    def _detect_haar(self, image, min_size, max_size):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            cascade = self._local.cascade = cv2.CascadeClassifier(HAAR_CASCADE)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        def run(image, min_side, max_side):
+            options = {'minSize': (max(HAAR_WINDOW, int(min_side)),) * 2}
+            if max_side:
+                options['maxSize'] = (int(max_side),) * 2
+            return cascade.detectMultiScale(image, 1.1, 4, **options)
+
+        if gray.size > TILED_THRESHOLD_PIXELS:
+            # Faces too large to fit in a tile's overlap are found on a shrunk full frame
+            return detect_in_tiles(gray, run, window=HAAR_WINDOW, min_size=min_size, max_size=max_size)
+        return [tuple(box) for box in run(gray, min_size, max_size)]
+
+    def _detect_dnn(self, image):
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            net = self._local.net = cv2.dnn.readNetFromCaffe(self.dnn_config, self.dnn_model)
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        height, width = image.shape[:2]
+        net.setInput(cv2.dnn.blobFromImage(cv2.resize(image, DNN_INPUT), 1.0, DNN_INPUT, DNN_MEAN))
+        detections = net.forward()
+
+        boxes = []
+        for i in range(detections.shape[2]):
+            if detections[0, 0, i, 2] < self.confidence:
+                continue
+            x0, y0, x1, y1 = detections[0, 0, i, 3:7] * (width, height, width, height)
+            boxes.append((float(x0), float(y0), float(x1 - x0), float(y1 - y0)))
+        return boxes
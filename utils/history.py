@@ -0,0 +1,259 @@
+import os
+import time
+import zlib
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from utils.image_cache import image_cache
+from utils.pipeline import Pipeline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024  # raw keyframe pixels kept in memory
+DEFAULT_COMPRESSED_MAX_BYTES = 128 * 1024 * 1024  # compressed keyframes before spilling
+DEFAULT_MAX_IDLE = 30 * 60  # seconds
+
+
+class Keyframe:
+    """Rendered pixels of one history state, raw, compressed or on disk."""
+
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self.array = array
+        self.compressed = None
+        self.spill_path = None
+
+    @property
+    def raw_bytes(self):
+        return self.array.nbytes if self.array is not None else 0
+
+    @property
+    def compressed_bytes(self):
+        return len(self.compressed) if self.compressed is not None else 0
+
+    @property
+    def spilled_bytes(self):
+        return os.path.getsize(self.spill_path) if self.spill_path else 0
+
+    def compress(self):
+        """Replace the raw pixels with a zlib-compressed copy."""
+        if self.array is not None:
+            self.compressed = zlib.compress(self.array.tobytes(), 1)
+            self.array = None
+
+    def spill(self, spill_dir):
+        """Move the compressed copy to a file in spill_dir."""
+        self.compress()
+        if self.compressed is not None:
+            fd, self.spill_path = tempfile.mkstemp(suffix='.kf', dir=spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.compressed)
+            self.compressed = None
+
+    def load(self):
+        """Return the pixels, decompressing or reading back as needed."""
+        if self.array is not None:
+            return self.array
+        data = self.compressed
+        if data is None:
+            with open(self.spill_path, 'rb') as f:
+                data = f.read()
+        return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(self.shape)
+
+    def discard(self):
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.array = self.compressed = self.spill_path = None
+
+
+class HistoryState:
+    """One undo/redo state: the source file plus the steps applied to it."""
+
+    def __init__(self, source, steps, keyframe=None):
+        self.source = source
+        self.source_key = image_cache.file_key(source) if source else None
+        self.steps = list(steps or [])
+        self.keyframe = keyframe
+
+    @property
+    def replayable(self):
+        if not self.source or not os.path.exists(self.source):
+            return False
+        return image_cache.file_key(self.source) == self.source_key
+
+
+class HistoryStore:
+    """Undo/redo history for every open image under one memory budget.
+
+    Each state is recorded as (source file, steps) and recomputed with
+    replay(image, steps), which defaults to running the steps through a
+    Pipeline. Rendered pixels are kept as keyframes only for the current
+    state and every keyframe_interval-th state; the rest are recomputed
+    from the source when needed. When the raw keyframes exceed max_bytes
+    the least recently used are compressed, and compressed keyframes
+    beyond compressed_max_bytes spill to disk. Sessions idle for longer
+    than max_idle seconds are dropped.
+    """
+
+    def __init__(self, max_history=10, max_bytes=DEFAULT_MAX_BYTES,
+                 compressed_max_bytes=DEFAULT_COMPRESSED_MAX_BYTES,
+                 max_idle=DEFAULT_MAX_IDLE, keyframe_interval=4, spill_dir=None,
+                 replay=None):
+        self.max_history = max_history
+        self.max_bytes = max_bytes
+        self.compressed_max_bytes = compressed_max_bytes
+        self.max_idle = max_idle
+        self.keyframe_interval = keyframe_interval
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='history_')
+        self.replay = replay or (lambda image, steps: Pipeline(steps).to_image(image))
+        self.sessions = {}
+        self._keyframes = OrderedDict()  # id(keyframe) -> keyframe, LRU order
+        self._lock = threading.RLock()
+
+    def __contains__(self, name):
+        return name in self.sessions
+
+    def push(self, name, image, source=None, steps=None):
+        """Record a new current state for name and clear its redo branch.
+
+        image may be None for a replayable state; it is then rendered from
+        its source the first time it is needed.
+        """
+        with self._lock:
+            self.expire_idle()
+            session = self.sessions.setdefault(name, {'states': [], 'position': -1})
+            session['last_access'] = time.time()
+
+            # Anything after the current position is the redo branch
+            for state in session['states'][session['position'] + 1:]:
+                self._drop_keyframe(state)
+            del session['states'][session['position'] + 1:]
+
+            if session['states']:
+                self._release_current(session)
+
+            state = HistoryState(source, steps)
+            index = len(session['states'])
+            needs_pixels = not state.replayable or not state.steps
+            if image is None and needs_pixels:
+                raise ValueError('An image is required for a state that cannot be replayed')
+            if image is not None and (needs_pixels or index % self.keyframe_interval == 0):
+                state.keyframe = self._add_keyframe(np.asarray(image))
+            session['states'].append(state)
+
+            # Undo depth is max_history, plus the current state
+            while len(session['states']) > self.max_history + 1:
+                self._drop_keyframe(session['states'].pop(0))
+            session['position'] = len(session['states']) - 1
+            self._enforce_budget()
+
+    def can_undo(self, name):
+        session = self.sessions.get(name)
+        return bool(session) and session['position'] > 0
+
+    def can_redo(self, name):
+        session = self.sessions.get(name)
+        return bool(session) and session['position'] < len(session['states']) - 1
+
+    def undo(self, name):
+        """Step back one state and return its image, or None."""
+        return self._move(name, -1) if self.can_undo(name) else None
+
+    def redo(self, name):
+        """Step forward one state and return its image, or None."""
+        return self._move(name, 1) if self.can_redo(name) else None
+
+    def discard(self, name):
+        """Forget all history for name."""
+        with self._lock:
+            session = self.sessions.pop(name, None)
+            for state in (session or {}).get('states', []):
+                self._drop_keyframe(state)
+
+    def expire_idle(self, now=None):
+        """Drop sessions that have not been touched for max_idle seconds."""
+        now = now or time.time()
+        with self._lock:
+            idle = [name for name, session in self.sessions.items()
+                    if now - session.get('last_access', now) > self.max_idle]
+            for name in idle:
+                logger.debug(f"Expiring idle history for {name}")
+                self.discard(name)
+            return len(idle)
+
+    def memory_usage(self):
+        """Report how much the history holds, by storage tier."""
+        with self._lock:
+            keyframes = list(self._keyframes.values())
+            return {
+                'sessions': len(self.sessions),
+                'states': sum(len(s['states']) for s in self.sessions.values()),
+                'keyframes': len(keyframes),
+                'raw_bytes': sum(k.raw_bytes for k in keyframes),
+                'compressed_bytes': sum(k.compressed_bytes for k in keyframes),
+                'spilled_bytes': sum(k.spilled_bytes for k in keyframes),
+                'max_bytes': self.max_bytes
+            }
+
+    def _move(self, name, delta):
+        with self._lock:
+            session = self.sessions[name]
+            session['last_access'] = time.time()
+            self._release_current(session)
+            session['position'] += delta
+            state = session['states'][session['position']]
+            image = self._render(state)
+            if state.keyframe is None:
+                # Keep the current state hot so repeated undo/redo is cheap
+                state.keyframe = self._add_keyframe(np.asarray(image))
+                self._enforce_budget()
+            return image
+
+    def _render(self, state):
+        if state.keyframe is not None:
+            self._keyframes.move_to_end(id(state.keyframe))
+            return Image.fromarray(state.keyframe.load())
+        if not state.replayable:
+            raise ValueError('History state is no longer available')
+        return self.replay(image_cache.load_image(state.source), state.steps)
+
+    def _release_current(self, session):
+        """Drop the current state's pixels unless it is a real keyframe."""
+        position = session['position']
+        state = session['states'][position]
+        if position % self.keyframe_interval and state.steps and state.replayable:
+            self._drop_keyframe(state)
+
+    def _add_keyframe(self, array):
+        keyframe = Keyframe(array)
+        self._keyframes[id(keyframe)] = keyframe
+        return keyframe
+
+    def _drop_keyframe(self, state):
+        if state.keyframe is not None:
+            self._keyframes.pop(id(state.keyframe), None)
+            state.keyframe.discard()
+            state.keyframe = None
+
+    def _enforce_budget(self):
+        raw = sum(k.raw_bytes for k in self._keyframes.values())
+        for keyframe in list(self._keyframes.values()):
+            if raw <= self.max_bytes:
+                break
+            if keyframe.array is not None:
+                raw -= keyframe.raw_bytes
+                keyframe.compress()
+
+        compressed = sum(k.compressed_bytes for k in self._keyframes.values())
+        for keyframe in list(self._keyframes.values()):
+            if compressed <= self.compressed_max_bytes:
+                break
+            if keyframe.compressed is not None:
+                compressed -= keyframe.compressed_bytes
+                keyframe.spill(self.spill_dir)
@@ -0,0 +1,143 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512MB of decoded pixels
+
+# Modes Image.fromarray can rebuild from the array alone
+ARRAY_MODES = {'1', 'L', 'RGB', 'RGBA', 'I', 'I;16', 'F'}
+
+
+def as_cacheable_array(image):
+    """Convert a decoded PIL image to the array form stored in the cache."""
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode not in ARRAY_MODES:
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+class ImageCache:
+    """Process-wide LRU cache of decoded images.
+
+    Entries are keyed by (absolute path, mtime, size) so a rewritten file
+    is decoded again. Arrays are stored read-only and shared between
+    callers; anything that needs to modify pixels must copy first.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._keys_by_path = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_bytes):
+        """Change the byte budget, evicting entries if it shrank."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    @staticmethod
+    def file_key(filepath):
+        """Return the identity key for a file on disk."""
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def load_array(self, filepath):
+        """Return the decoded pixels of filepath as a read-only array."""
+        key = self.file_key(filepath)
+        with self._lock:
+            array = self._entries.get(key)
+            if array is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return array
+            self.misses += 1
+
+        # Decode outside the lock so other files can be served meanwhile
+        array = self._decode(key[0])
+        self.put(key, array)
+        return array
+
+    def load_image(self, filepath):
+        """Return the decoded file as a PIL image backed by the cached array."""
+        return Image.fromarray(self.load_array(filepath))
+
+    def put(self, key, array):
+        """Insert an already decoded array under key."""
+        array = np.asarray(array)
+        array.flags.writeable = False
+        with self._lock:
+            # A newer version of the same file makes the old entry unreachable
+            old_key = self._keys_by_path.get(key[0])
+            if old_key is not None and old_key != key:
+                self._remove(old_key)
+            if key in self._entries:
+                self._remove(key)
+            if array.nbytes > self.max_bytes:
+                return
+            self._entries[key] = array
+            self._keys_by_path[key[0]] = key
+            self.current_bytes += array.nbytes
+            self._evict()
+
+    def invalidate(self, filepath):
+        """Drop any cached decode of filepath."""
+        path = os.path.abspath(filepath)
+        with self._lock:
+            key = self._keys_by_path.get(path)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Return hit/miss/eviction counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    @staticmethod
+    def _decode(path):
+        with Image.open(path) as image:
+            return as_cacheable_array(image)
+
+    def _remove(self, key):
+        array = self._entries.pop(key)
+        self.current_bytes -= array.nbytes
+        if self._keys_by_path.get(key[0]) == key:
+            del self._keys_by_path[key[0]]
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            logger.debug(f"Evicted decoded image {key[0]}")
+
+
+# Shared by every processor in the process
+image_cache = ImageCache()
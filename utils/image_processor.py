@@ -2,184 +2,404 @@ import cv2
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
 import os
-from collections import deque
+import time
+import subprocess
+from utils.pipeline import Pipeline
+from utils.image_cache import image_cache
+from utils.output_store import output_store
+from utils.history import HistoryStore
+from utils import tiling
+from utils import jpeg
+from utils import encoder
+from utils.parallel import BandExecutor, band_halo
+from utils.preview import PyramidCache, scale_steps, DEFAULT_VIEWPORT
+from utils.metrics import span
 
 class ImageProcessor:
-    def __init__(self):
-        self.history = {}  # Dictionary to store undo/redo history for each image
-        self.max_history = 10
-
-    def _init_history(self, filename):
-        """Initialize history for a new image."""
-        if filename not in self.history:
-            self.history[filename] = {
-                'undo': deque(maxlen=self.max_history),
-                'redo': deque(maxlen=self.max_history),
-                'current': None
-            }
+    def __init__(self, max_history=10, history_max_bytes=None, history_max_idle=None,
+                 tile_size=tiling.DEFAULT_TILE_SIZE, tiled_threshold=tiling.TILED_THRESHOLD_PIXELS,
+                 tiled_max_pixels=tiling.MAX_TILED_PIXELS, workers=None):
+        self.max_history = max_history
+        # Filters run band by band across cores; output does not depend on workers
+        self.bands = BandExecutor(workers)
+        self.tile_size = tile_size
+        self.tiled_threshold = tiled_threshold
+        self.tiled_max_pixels = tiled_max_pixels
+        self.pyramids = PyramidCache()
+        options = {}
+        if history_max_bytes is not None:
+            options['max_bytes'] = history_max_bytes
+        if history_max_idle is not None:
+            options['max_idle'] = history_max_idle
+        # Undo/redo history for each image, replayed through _replay
+        self.history = HistoryStore(max_history=max_history, replay=self._replay, **options)
+
+    @staticmethod
+    def _history_key(filename, session_id=None):
+        # Each session has its own undo/redo stack for the same upload
+        return f'{session_id}/{filename}' if session_id else filename
 
-    def _save_state(self, image, filename):
+    def _save_state(self, image, filename, source=None, steps=None, session_id=None):
         """Save current state for undo/redo."""
-        self._init_history(filename)
-        if self.history[filename]['current'] is not None:
-            self.history[filename]['undo'].append(self.history[filename]['current'])
-        self.history[filename]['current'] = image.copy()
-        self.history[filename]['redo'].clear()
+        with span('history'):
+            self.history.push(self._history_key(filename, session_id), image, source=source, steps=steps)
+
+    def _save_output(self, image, filename, session_id=None, output=None, source=None, prefix='processed'):
+        """Encode a processed image as a new immutable version.
+
+        output holds the request's encode options (format, preset, quality,
+        keep_metadata, ...); source is the file metadata is taken from.
+        Returns (url, encode stats).
+        """
+        with span('encode'):
+            fmt, ext = encoder.output_format(filename, output)
+            metadata = encoder.source_metadata(source) if source else None
+            stem = os.path.splitext(filename)[0]
+            with output_store.writing(session_id, f'{prefix}_{stem}', ext) as (output_path, url):
+                encoding = encoder.encode(image, output_path, fmt, output, metadata)
+        return url, encoding
+
+    def record_state(self, filepath, op, action, params, session_id=None):
+        """Add a history entry for a result produced elsewhere, e.g. a cache hit."""
+        self._save_state(None, os.path.basename(filepath), filepath,
+                         [{'op': op, 'action': action, 'params': params or {}}], session_id)
+
+    def _replay(self, image, steps):
+        """Recompute a history state from its source image."""
+        for step in steps:
+            op, action, params = step['op'], step['action'], step.get('params') or {}
+            if op == 'filter':
+                image = self._filter(image, action, params)
+            elif op == 'transform':
+                image = self._transform(image, action, params)
+            elif op == 'pipeline':
+                image = Pipeline(params['steps']).to_image(image)
+            else:
+                raise ValueError(f'Cannot replay step: {op}')
+        return image
+
+    def _filter(self, image, filter_type, params):
+        """Run one filter on a decoded image, or return None if unknown."""
+        if filter_type == 'grayscale':
+            return image.convert('L')
+
+        elif filter_type == 'sepia':
+            # Convert to numpy array for sepia calculation
+            img_array = np.array(image)
+            sepia_matrix = np.array([
+                [0.393, 0.769, 0.189],
+                [0.349, 0.686, 0.168],
+                [0.272, 0.534, 0.131]
+            ])
+            sepia_img = cv2.transform(img_array, sepia_matrix)
+            sepia_img = np.clip(sepia_img, 0, 255)
+            return Image.fromarray(sepia_img.astype(np.uint8))
+
+        elif filter_type == 'warm':
+            img_array = np.array(image)
+            img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 1.2, 0, 255)  # Red
+            img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.1, 0, 255)  # Green
+            return Image.fromarray(img_array)
+
+        elif filter_type == 'sharp':
+            enhancer = ImageEnhance.Sharpness(image)
+            factor = params.get('factor', 1.5)
+            return enhancer.enhance(factor)
+
+        elif filter_type == 'blur':
+            radius = params.get('radius', 2)
+            return image.filter(ImageFilter.GaussianBlur(radius=radius))
+
+        elif filter_type == 'edge':
+            # Convert to numpy array for Canny edge detection
+            img_array = np.array(image)
+            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+            edges = cv2.Canny(gray, 100, 200)
+            return Image.fromarray(edges)
+
+        return None
+
+    def _transform(self, image, transform_type, params):
+        """Run one geometric transform on a decoded image, or return None if unknown."""
+        if transform_type == 'rotate':
+            angle = params.get('angle', 90)
+            return image.rotate(angle, expand=True)
+
+        elif transform_type == 'flip':
+            direction = params.get('direction', 'horizontal')
+            if direction == 'horizontal':
+                return image.transpose(Image.FLIP_LEFT_RIGHT)
+            return image.transpose(Image.FLIP_TOP_BOTTOM)
+
+        elif transform_type == 'crop':
+            left = params.get('left', 0)
+            top = params.get('top', 0)
+            right = params.get('right', image.width)
+            bottom = params.get('bottom', image.height)
+            return image.crop((left, top, right, bottom))
+
+        elif transform_type == 'resize':
+            width = params.get('width', image.width)
+            height = params.get('height', image.height)
+            return image.resize((width, height), Image.Resampling.LANCZOS)
+
+        return None
+
+    def _should_tile(self, filepath, action, params):
+        """Decide whether an operation runs tile by tile."""
+        if 'tiled' in params:
+            return bool(params['tiled'])
+        try:
+            # Only the header is read here
+            with Image.open(filepath) as image:
+                pixels = image.width * image.height
+        except Image.DecompressionBombError:
+            # Too large to decode whole; the tiled path has its own limit
+            return True
+        return pixels > self.tiled_threshold
+
+    def _process_tiled(self, filepath, kind, action, params, session_id=None, output=None):
+        """Run a filter or transform with bounded memory. Not added to undo history."""
+        filename = os.path.basename(filepath)
+        # Tiles are decoded as they are processed, so decode counts as operation time
+        with span('operation'):
+            source = tiling.open_source(filepath, self.tiled_max_pixels)
+            if kind == 'filter':
+                steps = [(action, {k: v for k, v in params.items() if k != 'tiled'})]
+                store = tiling.TiledProcessor(self._filter, self.tile_size).run(source, steps)
+            else:
+                store = tiling.transform_store(source, action, params, self.tile_size)
+
+        fmt, ext = encoder.output_format(filename, output)
+        start = time.perf_counter()
+        with span('encode'), output_store.writing(session_id, f'processed_{os.path.splitext(filename)[0]}',
+                                                  ext) as (output_path, url):
+            if fmt == 'TIFF':
+                tiling.save_store(store, output_path)
+                encoding = encoder.report(fmt, output_path, start)
+            else:
+                encoding = encoder.encode(tiling.to_image(store), output_path, fmt, output,
+                                          encoder.source_metadata(filepath))
 
-    def apply_filter(self, filepath, filter_type, params=None):
+        return {
+            'success': True,
+            'filepath': url,
+            'tiled': True,
+            'encode': encoding
+        }
+
+    def apply_filter(self, filepath, filter_type, params=None, session_id=None, output=None):
         """Apply various filters to the image."""
         try:
-            image = Image.open(filepath)
+            params = params or {}
+            if tiling.can_tile(filter_type) and self._should_tile(filepath, filter_type, params):
+                return self._process_tiled(filepath, 'filter', filter_type, params, session_id, output)
+
+            with span('decode'):
+                image = image_cache.load_image(filepath)
             filename = os.path.basename(filepath)
-            
-            if filter_type == 'grayscale':
-                processed = image.convert('L')
-            
-            elif filter_type == 'sepia':
-                # Convert to numpy array for sepia calculation
-                img_array = np.array(image)
-                sepia_matrix = np.array([
-                    [0.393, 0.769, 0.189],
-                    [0.349, 0.686, 0.168],
-                    [0.272, 0.534, 0.131]
-                ])
-                sepia_img = cv2.transform(img_array, sepia_matrix)
-                sepia_img = np.clip(sepia_img, 0, 255)
-                processed = Image.fromarray(sepia_img.astype(np.uint8))
-            
-            elif filter_type == 'warm':
-                img_array = np.array(image)
-                img_array[:, :, 2] = np.clip(img_array[:, :, 2] * 1.2, 0, 255)  # Red
-                img_array[:, :, 1] = np.clip(img_array[:, :, 1] * 1.1, 0, 255)  # Green
-                processed = Image.fromarray(img_array)
-            
-            elif filter_type == 'sharp':
-                enhancer = ImageEnhance.Sharpness(image)
-                factor = params.get('factor', 1.5)
-                processed = enhancer.enhance(factor)
-            
-            elif filter_type == 'blur':
-                radius = params.get('radius', 2)
-                processed = image.filter(ImageFilter.GaussianBlur(radius=radius))
-            
-            elif filter_type == 'edge':
-                # Convert to numpy array for Canny edge detection
-                img_array = np.array(image)
-                gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-                edges = cv2.Canny(gray, 100, 200)
-                processed = Image.fromarray(edges)
-            
-            else:
+
+            with span('operation'):
+                processed = self.bands.apply(image, lambda band: self._filter(band, filter_type, params),
+                                             band_halo(filter_type, params))
+            if processed is None:
                 return {'error': 'Invalid filter type'}
 
             # Save state for undo/redo
-            self._save_state(processed, filename)
+            self._save_state(processed, filename, filepath,
+                             [{'op': 'filter', 'action': filter_type, 'params': params}], session_id)
             
             # Save processed image
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            processed.save(output_path)
+            url, encoding = self._save_output(processed, filename, session_id, output, filepath)
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}'
+                'filepath': url,
+                'encode': encoding
             }
 
         except Exception as e:
             return {'error': str(e)}
 
-    def transform_image(self, filepath, transform_type, params):
+    def _transform_lossless(self, filepath, transform_type, params, session_id=None, output=None):
+        """Rotate, flip or crop a JPEG in the DCT domain; None if not possible."""
+        output = output or {}
+        if set(output) - {'keep_metadata'}:
+            # Asked for a particular format or encode settings
+            return None
+        args = jpeg.lossless_plan(filepath, transform_type, params)
+        if args is None:
+            return None
+        filename = os.path.basename(filepath)
+        start = time.perf_counter()
+        try:
+            with span('operation'), output_store.writing(session_id, f'processed_{filename}',
+                                                         os.path.splitext(filename)[1]) as (output_path, url):
+                jpeg.lossless_transform(filepath, output_path, args,
+                                        'all' if output.get('keep_metadata') else 'none')
+                encoding = encoder.report('JPEG', output_path, start)
+        except (subprocess.SubprocessError, OSError):
+            # e.g. partial edge blocks; the decoding path handles these
+            return None
+
+        # Nothing was decoded, so history recomputes this state on demand
+        self._save_state(None, filename, filepath,
+                         [{'op': 'transform', 'action': transform_type, 'params': params}], session_id)
+        return {
+            'success': True,
+            'filepath': url,
+            'lossless': True,
+            'encode': encoding
+        }
+
+    def _load_for_transform(self, filepath, transform_type, params):
+        """Decode the source, at reduced size when a JPEG is being shrunk a lot."""
+        if transform_type == 'resize' and 'width' in params and 'height' in params and jpeg.is_jpeg(filepath):
+            image, scale = jpeg.draft_decode(filepath, (params['width'], params['height']))
+            if scale < 1:
+                return image
+        return image_cache.load_image(filepath)
+
+    def transform_image(self, filepath, transform_type, params, session_id=None, output=None):
         """Apply geometric transformations to the image."""
         try:
-            image = Image.open(filepath)
+            params = params or {}
+            if params.get('lossless', True):
+                result = self._transform_lossless(filepath, transform_type, params, session_id, output)
+                if result is not None:
+                    return result
+
+            tileable = transform_type in ('crop', 'flip') or (
+                transform_type == 'rotate' and params.get('angle', 90) % 90 == 0)
+            if tileable and self._should_tile(filepath, transform_type, params):
+                return self._process_tiled(filepath, 'transform', transform_type, params, session_id, output)
+
+            with span('decode'):
+                image = self._load_for_transform(filepath, transform_type, params)
             filename = os.path.basename(filepath)
-            
-            if transform_type == 'rotate':
-                angle = params.get('angle', 90)
-                processed = image.rotate(angle, expand=True)
-            
-            elif transform_type == 'flip':
-                direction = params.get('direction', 'horizontal')
-                if direction == 'horizontal':
-                    processed = image.transpose(Image.FLIP_LEFT_RIGHT)
-                else:
-                    processed = image.transpose(Image.FLIP_TOP_BOTTOM)
-            
-            elif transform_type == 'crop':
-                left = params.get('left', 0)
-                top = params.get('top', 0)
-                right = params.get('right', image.width)
-                bottom = params.get('bottom', image.height)
-                processed = image.crop((left, top, right, bottom))
-            
-            elif transform_type == 'resize':
-                width = params.get('width', image.width)
-                height = params.get('height', image.height)
-                processed = image.resize((width, height), Image.Resampling.LANCZOS)
-            
-            else:
+
+            with span('operation'):
+                processed = self._transform(image, transform_type, params)
+            if processed is None:
                 return {'error': 'Invalid transform type'}
 
             # Save state for undo/redo
-            self._save_state(processed, filename)
+            self._save_state(processed, filename, filepath,
+                             [{'op': 'transform', 'action': transform_type, 'params': params}], session_id)
             
             # Save processed image
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            processed.save(output_path)
+            url, encoding = self._save_output(processed, filename, session_id, output, filepath)
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}'
+                'filepath': url,
+                'encode': encoding
             }
 
         except Exception as e:
             return {'error': str(e)}
 
-    def undo(self, filename):
+    def apply_pipeline(self, filepath, steps, session_id=None, output=None):
+        """Apply a list of filter/transform steps with one decode and one encode."""
+        try:
+            pipeline = Pipeline(steps)
+            if not len(pipeline):
+                return {'error': 'No steps provided'}
+
+            with span('decode'):
+                image = image_cache.load_image(filepath)
+            filename = os.path.basename(filepath)
+            with span('operation'):
+                processed = pipeline.to_image(image)
+
+            # Save state for undo/redo
+            self._save_state(processed, filename, filepath,
+                             [{'op': 'pipeline', 'action': 'pipeline', 'params': {'steps': steps}}],
+                             session_id)
+
+            # Save processed image
+            url, encoding = self._save_output(processed, filename, session_id, output, filepath)
+
+            return {
+                'success': True,
+                'filepath': url,
+                'steps': len(pipeline),
+                'encode': encoding
+            }
+
+        except Exception as e:
+            return {'error': str(e)}
+
+    def render_preview(self, filepath, steps, viewport=DEFAULT_VIEWPORT, session_id=None):
+        """Render steps on a downscaled pyramid level sized to the viewport."""
+        try:
+            start = time.perf_counter()
+            filename = os.path.basename(filepath)
+            with span('decode'):
+                proxy, scale = self.pyramids.proxy(filepath, tuple(viewport))
+            with span('operation'):
+                processed = Pipeline(scale_steps(steps, scale)).to_image(proxy)
+
+            # Previews favour encode speed over size
+            preview_format = 'png' if processed.mode in ('RGBA', 'LA') else 'jpg'
+            url, encoding = self._save_output(processed, filename, session_id,
+                                              {'format': preview_format, 'preset': 'speed'}, prefix='preview')
+
+            return {
+                'success': True,
+                'filepath': url,
+                'scale': scale,
+                'width': processed.width,
+                'height': processed.height,
+                'render_ms': (time.perf_counter() - start) * 1000,
+                'encode': encoding
+            }
+
+        except Exception as e:
+            return {'error': str(e)}
+
+    def undo(self, filename, session_id=None):
         """Undo the last operation."""
         try:
-            if filename not in self.history or not self.history[filename]['undo']:
+            key = self._history_key(filename, session_id)
+            if not self.history.can_undo(key):
                 return {'error': 'No actions to undo'}
 
-            # Move current state to redo stack
-            self.history[filename]['redo'].append(self.history[filename]['current'])
-            
-            # Pop the last state from undo stack
-            previous_state = self.history[filename]['undo'].pop()
-            self.history[filename]['current'] = previous_state
+            previous_state = self.history.undo(key)
             
             # Save the image
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            previous_state.save(output_path)
+            url, encoding = self._save_output(previous_state, filename, session_id)
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}'
+                'filepath': url,
+                'encode': encoding
             }
 
         except Exception as e:
             return {'error': str(e)}
 
-    def redo(self, filename):
+    def redo(self, filename, session_id=None):
         """Redo the last undone operation."""
         try:
-            if filename not in self.history or not self.history[filename]['redo']:
+            key = self._history_key(filename, session_id)
+            if not self.history.can_redo(key):
                 return {'error': 'No actions to redo'}
 
-            # Move current state to undo stack
-            self.history[filename]['undo'].append(self.history[filename]['current'])
-            
-            # Pop the last state from redo stack
-            next_state = self.history[filename]['redo'].pop()
-            self.history[filename]['current'] = next_state
+            next_state = self.history.redo(key)
             
             # Save the image
-            output_path = os.path.join('static/uploads', f'processed_{filename}')
-            next_state.save(output_path)
+            url, encoding = self._save_output(next_state, filename, session_id)
             
             return {
                 'success': True,
-                'filepath': f'/static/uploads/processed_{filename}'
+                'filepath': url,
+                'encode': encoding
             }
 
         except Exception as e:
-            return {'error': str(e)} 
\ No newline at end of file
+            return {'error': str(e)}
+
+    def history_usage(self):
+        """Report memory held by the undo/redo history."""
+        return self.history.memory_usage()
@@ -0,0 +1,175 @@
+import time
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+def _timed_call(func, args, kwargs):
+    """Run func in the worker and report when it actually started and ended."""
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time()
+
+
+class Job:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.future = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        timings = {'submitted_at': self.submitted_at}
+        if self.started_at:
+            timings['started_at'] = self.started_at
+            timings['queue_seconds'] = self.started_at - self.submitted_at
+        if self.finished_at:
+            timings['finished_at'] = self.finished_at
+            timings['total_seconds'] = self.finished_at - self.submitted_at
+            if self.started_at:
+                timings['run_seconds'] = self.finished_at - self.started_at
+
+        data = {'id': self.id, 'name': self.name, 'state': self.state, 'timings': timings}
+        if self.state == DONE:
+            data['result'] = self.result
+        elif self.state == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """In-process job queue backed by a thread pool and a process pool.
+
+    I/O-bound jobs run on threads; jobs submitted with cpu_bound=True run
+    in worker processes so they do not hold the GIL of the web worker.
+    At most max_pending jobs may be queued or running at once, beyond
+    that submit() raises QueueFullError. Finished jobs are kept for
+    result_ttl seconds so clients can poll for them. With process_workers=0
+    there is no process pool and cpu_bound jobs are refused.
+    """
+
+    def __init__(self, max_workers=4, process_workers=2, max_pending=32, result_ttl=600):
+        self.max_workers = max_workers
+        self.process_workers = process_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._processes = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args, cpu_bound=False, **kwargs):
+        """Queue func(*args, **kwargs) and return its job id."""
+        if cpu_bound and not self.process_workers:
+            raise ValueError('This job queue has no worker processes')
+        with self._lock:
+            self._purge()
+            if self.active_count() >= self.max_pending:
+                raise QueueFullError(f'Job queue is full ({self.max_pending} jobs pending)')
+            job = Job(name)
+            self._jobs[job.id] = job
+
+        executor = self._process_pool() if cpu_bound else self._threads
+        if cpu_bound:
+            job.future = executor.submit(_timed_call, func, args, kwargs)
+        else:
+            job.future = executor.submit(self._run_thread_job, job, func, args, kwargs)
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        return job.id
+
+    def status(self, job_id):
+        """Return the job as a dict, or None if it is unknown or expired."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.state == PENDING and job.future is not None and job.future.running():
+            job.state = RUNNING
+        return job.to_dict()
+
+    def cancel(self, job_id):
+        """Cancel a job. Queued jobs never run; a running job's result is discarded."""
+        job = self._jobs.get(job_id)
+        if job is None or job.state in (DONE, FAILED, CANCELLED):
+            return False
+        job.future.cancel()
+        job.state = CANCELLED
+        job.finished_at = time.time()
+        return True
+
+    def active_count(self):
+        return sum(1 for job in self._jobs.values() if job.state in (PENDING, RUNNING))
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+            return {
+                'jobs': counts,
+                'active': self.active_count(),
+                'max_pending': self.max_pending,
+                'max_workers': self.max_workers,
+                'process_workers': self.process_workers
+            }
+
+    def shutdown(self, wait=True):
+        self._threads.shutdown(wait=wait, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait, cancel_futures=True)
+
+    def _process_pool(self):
+        with self._lock:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.process_workers)
+            return self._processes
+
+    @staticmethod
+    def _run_thread_job(job, func, args, kwargs):
+        if job.state == CANCELLED:
+            return None, None, None
+        job.state = RUNNING
+        return _timed_call(func, args, kwargs)
+
+    def _finish(self, job, future):
+        if job.state == CANCELLED:
+            return
+        try:
+            result, started, finished = future.result()
+            job.result = result
+            job.started_at, job.finished_at = started, finished
+            job.state = FAILED if isinstance(result, dict) and 'error' in result else DONE
+            if job.state == FAILED:
+                job.error = result['error']
+        except CancelledError:
+            job.state = CANCELLED
+            job.finished_at = time.time()
+        except Exception as e:
+            logger.error(f"Job {job.name} failed: {str(e)}")
+            job.state = FAILED
+            job.error = str(e)
+            job.finished_at = time.time()
+
+    def _purge(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
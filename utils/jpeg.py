@@ -0,0 +1,92 @@
+import shutil
+import subprocess
+
+from PIL import Image
+
+from utils import tiling
+
+# libjpeg's jpegtran rotates, flips and crops in the DCT domain without re-encoding
+JPEGTRAN = shutil.which('jpegtran')
+JPEGTRAN_TIMEOUT = 120
+
+# PIL rotates counter-clockwise, jpegtran clockwise
+ROTATIONS = {90: '270', 180: '180', 270: '90'}
+
+
+def is_jpeg(filepath):
+    try:
+        with open(filepath, 'rb') as f:
+            return f.read(3) == b'\xff\xd8\xff'
+    except OSError:
+        return False
+
+
+def mcu_size(image):
+    """Width and height in pixels of one MCU of an open JPEG image."""
+    layers = getattr(image, 'layer', None) or []
+    horizontal = max((layer[1] for layer in layers), default=1)
+    vertical = max((layer[2] for layer in layers), default=1)
+    return 8 * horizontal, 8 * vertical
+
+
+def lossless_args(image, action, params):
+    """Return jpegtran arguments for a transform, or None if it cannot be lossless.
+
+    Rotations must be multiples of 90 degrees and crops must start on an
+    MCU boundary; anything else needs a full decode.
+    """
+    if action == 'rotate':
+        angle = params.get('angle', 90) % 360
+        if angle not in ROTATIONS:
+            return None
+        return ['-rotate', ROTATIONS[angle]]
+    if action == 'flip':
+        return ['-flip', 'vertical' if params.get('direction', 'horizontal') == 'vertical' else 'horizontal']
+    if action == 'crop':
+        left, top = params.get('left', 0), params.get('top', 0)
+        right, bottom = params.get('right', image.width), params.get('bottom', image.height)
+        mcu_width, mcu_height = mcu_size(image)
+        if left % mcu_width or top % mcu_height:
+            return None
+        if not (0 <= left < right <= image.width and 0 <= top < bottom <= image.height):
+            return None
+        return ['-crop', f'{right - left}x{bottom - top}+{left}+{top}']
+    return None
+
+
+def lossless_plan(source, action, params):
+    """Return jpegtran arguments if action on source can be done without decoding, else None."""
+    if JPEGTRAN is None or not is_jpeg(source):
+        return None
+    # Nothing is decoded, so this also works for images over Pillow's pixel limit
+    with tiling.open_unchecked(source) as image:
+        return lossless_args(image, action, params)
+
+
+def lossless_transform(source, destination, args, copy='none'):
+    """Run jpegtran with arguments from lossless_plan.
+
+    -perfect makes jpegtran fail rather than drop partial edge blocks,
+    so a successful run is always exactly the requested transform.
+    copy is jpegtran's -copy setting: 'none' drops metadata, 'all' keeps it.
+    Raises subprocess.CalledProcessError if it is not possible.
+    """
+    subprocess.run([JPEGTRAN, '-copy', copy, '-perfect', *args, '-outfile', destination, source],
+                   check=True, capture_output=True, timeout=JPEGTRAN_TIMEOUT)
+
+
+def draft_decode(filepath, size):
+    """Decode an image at no less than size, using JPEG scale-on-decode when possible.
+
+    Image.draft makes libjpeg decode at 1/2, 1/4 or 1/8 scale, picking the
+    smallest scale that still covers size, which skips most of the IDCT
+    work. Other formats are decoded at full size. Returns (image, scale).
+    """
+    with Image.open(filepath) as image:
+        full_width = image.width
+        if image.format == 'JPEG':
+            image.draft('RGB' if image.mode == 'CMYK' else image.mode, tuple(size))
+        image.load()
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        return image, image.width / full_width
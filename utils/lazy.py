@@ -0,0 +1,131 @@
+import os
+import time
+import importlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds before a failed load is retried; doubles per consecutive failure
+RETRY_BACKOFF = 30
+MAX_RETRY_BACKOFF = 10 * 60
+
+
+def current_rss():
+    """Return the resident set size of this process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class LazyResource:
+    """A module or model that is only built the first time it is used.
+
+    The factory runs once under a lock and its result is kept. Load time
+    and the change in RSS while loading are recorded for worker sizing.
+    A failed load is re-raised without retrying until a backoff has
+    passed, which doubles with each failure up to MAX_RETRY_BACKOFF, so a
+    transient import or download error does not disable the component for
+    good. warm_up() retries straight away.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self._value = None
+        self._error = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.rss_delta = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self, retry=False):
+        """Return the resource, loading it if needed; retry=True ignores the backoff."""
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                if self._error is not None and not retry and time.monotonic() < self._retry_at:
+                    raise self._error
+                rss_before = current_rss()
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self._error = e
+                    self._failures += 1
+                    backoff = min(RETRY_BACKOFF * 2 ** (self._failures - 1), MAX_RETRY_BACKOFF)
+                    self._retry_at = time.monotonic() + backoff
+                    logger.error(f"Error loading {self.name}: {str(e)}; retrying in {backoff:.0f}s")
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                rss_after = current_rss()
+                if rss_before is not None and rss_after is not None:
+                    self.rss_delta = rss_after - rss_before
+                self._error = None
+                self._failures = 0
+                self._loaded = True
+                logger.info(f"Loaded {self.name} in {self.load_seconds:.2f}s")
+        return self._value
+
+    def stats(self):
+        return {
+            'loaded': self._loaded,
+            'load_seconds': self.load_seconds,
+            'rss_delta_bytes': self.rss_delta,
+            'error': str(self._error) if self._error else None,
+            'failures': self._failures
+        }
+
+
+# Every lazy resource in the process, by name
+registry = {}
+
+
+def lazy(name, factory):
+    """Register and return a LazyResource, reusing an existing one by name."""
+    if name not in registry:
+        registry[name] = LazyResource(name, factory)
+    return registry[name]
+
+
+def lazy_import(module_name):
+    """Register a module that is imported on first use."""
+    return lazy(module_name, lambda: importlib.import_module(module_name))
+
+
+def warm_up(names=None):
+    """Load the named resources (all when names is None) and return their stats."""
+    results = {}
+    for name in names or list(registry):
+        resource = registry.get(name)
+        if resource is None:
+            results[name] = {'error': 'Unknown component'}
+            continue
+        try:
+            resource.get(retry=True)
+        except Exception:
+            pass
+        results[name] = resource.stats()
+    return results
+
+
+def stats():
+    """Return load statistics for every registered resource."""
+    return {
+        'rss_bytes': current_rss(),
+        'components': {name: resource.stats() for name, resource in registry.items()}
+    }
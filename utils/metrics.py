@@ -0,0 +1,179 @@
+import bisect
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'imgproc_'
+# Seconds; covers a cached filter (~1 ms) up to a long video job
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = ContextVar('trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations, per label set."""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_labels(key + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_labels(key)} {count}')
+        return lines
+
+
+class Metrics:
+    """Process-wide metrics rendered in the Prometheus text format.
+
+    Histograms are fed by request traces. Gauges and counters owned by
+    other components (cache sizes, queue depths, hit counts) are not
+    copied here: each is registered as a function that is only called
+    when /metrics is scraped, so the hot path pays nothing for them.
+    """
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.requests = Histogram(prefix + 'request_seconds', 'Duration of /process requests by action.')
+        self.stages = Histogram(prefix + 'stage_seconds',
+                                'Time spent in each stage of a /process request, by action.')
+        self.http = Histogram(prefix + 'http_request_seconds', 'Duration of HTTP requests by endpoint.')
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, name, help_text, collect, kind='gauge'):
+        """Expose collect() as a metric; it returns a number or a list of (labels, value)."""
+        with self._lock:
+            self._collectors.append((self.prefix + name, help_text, collect, kind))
+
+    def observe_trace(self, trace):
+        self.requests.observe(trace.total, action=trace.action)
+        for stage, seconds in trace.stages.items():
+            self.stages.observe(seconds, action=trace.action, stage=stage)
+
+    def render(self):
+        lines = []
+        for histogram in (self.requests, self.stages, self.http):
+            lines.extend(histogram.render())
+        with self._lock:
+            collectors = list(self._collectors)
+        for name, help_text, collect, kind in collectors:
+            try:
+                value = collect()
+            except Exception as e:
+                logger.error(f"Error collecting {name}: {str(e)}")
+                continue
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            samples = value if isinstance(value, list) else [({}, value)]
+            for labels, sample in samples:
+                if sample is not None:
+                    lines.append(f'{name}{_labels(tuple(sorted(labels.items())))} {_number(sample)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """Stage timings of one request.
+
+    Stages record exclusive time: a stage nested in another is subtracted
+    from its parent, so the stages of a request add up to at most its
+    total. The same stage entered twice accumulates.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.total = None
+        self._children = [0.0]
+
+    def enter(self):
+        self._children.append(0.0)
+        return time.perf_counter()
+
+    def leave(self, stage, started):
+        elapsed = time.perf_counter() - started
+        children = self._children.pop()
+        self._children[-1] += elapsed
+        self.stages[stage] = self.stages.get(stage, 0.0) + elapsed - children
+
+    def server_timing(self):
+        """The stages as a Server-Timing header value, in milliseconds."""
+        parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in self.stages.items()]
+        if self.total is not None:
+            parts.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+@contextmanager
+def trace(action, registry=None):
+    """Time a request; spans opened in this context are recorded on the yielded Trace."""
+    current = Trace(action)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.total = time.perf_counter() - current.start
+        (registry or metrics).observe_trace(current)
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the current request; a no-op outside trace()."""
+    current = _current_trace.get()
+    if current is None:
+        yield
+        return
+    started = current.enter()
+    try:
+        yield
+    finally:
+        current.leave(stage, started)
+
+
+# Shared by the app and the processors
+metrics = Metrics()
@@ -0,0 +1,319 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+except ImportError:  # optional, keeps tesseract initialised in-process between calls
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('preprocess', 'recognize', 'postprocess')
+DEFAULT_PSM = 3  # fully automatic page segmentation, tesseract's default
+LINE_PSM = 7  # a single text line
+BLOCK_PSM = 6  # a single uniform block of text
+
+# Above this fraction of the frame covered by text, one full-page pass is cheaper
+FULL_PAGE_COVERAGE = 0.5
+# Tesseract is most accurate with glyphs at least this many pixels tall
+MIN_REGION_HEIGHT = 32
+# Discarded components taller than this fraction of the frame may be large text
+LARGE_COMPONENT = 0.125
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def postprocess_text(text):
+    """Drop form feeds and trailing whitespace from tesseract output."""
+    lines = [line.rstrip() for line in text.replace('\x0c', '').splitlines()]
+    return '\n'.join(lines).strip()
+
+
+def detect_text_regions(gray, min_height=8, min_fill=0.45, pad=4):
+    """Return (x, y, w, h) boxes likely to contain text in a grayscale array.
+
+    Text has dense, high-contrast strokes: a morphological gradient picks
+    them out, Otsu binarises the result and a wide closing joins the
+    glyphs of a word or line into one connected component. Components
+    that are too small, too tall or too sparse are discarded, and the
+    padded survivors that overlap are merged.
+    """
+    return find_text_regions(gray, min_height, min_fill, pad)[0]
+
+
+def find_text_regions(gray, min_height=8, min_fill=0.45, pad=4):
+    """Like detect_text_regions, but return (boxes, dropped_large).
+
+    dropped_large is True if a component taller than LARGE_COMPONENT of
+    the frame was discarded. That may be a big heading, whose strokes are
+    too sparse after the closing, so callers should read the whole image.
+    """
+    height, width = gray.shape[:2]
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT,
+                                cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+    joint = max(9, width // 200)
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE,
+                              cv2.getStructuringElement(cv2.MORPH_RECT, (joint, 1)))
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(closed, connectivity=8)
+    boxes = []
+    dropped_large = False
+    for x, y, w, h, _ in stats[1:count].tolist():
+        if h < min_height or w < min_height:
+            continue
+        if h > height // 2 or cv2.countNonZero(closed[y:y + h, x:x + w]) < min_fill * w * h:
+            dropped_large = dropped_large or h > LARGE_COMPONENT * height
+            continue
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        x1, y1 = min(x + w + pad, width), min(y + h + pad, height)
+        boxes.append((x0, y0, x1 - x0, y1 - y0))
+    return merge_boxes(boxes), dropped_large
+
+
+def merge_boxes(boxes):
+    """Merge overlapping boxes until none overlap."""
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]:
+                    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+                    x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+                    boxes[i] = [x0, y0, x1 - x0, y1 - y0]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(box) for box in boxes]
+
+
+def reading_order(boxes):
+    """Group boxes into lines, top to bottom, each sorted left to right.
+
+    Returns a list of lines, each a list of indices into boxes. A box
+    joins the current line if its vertical centre falls inside it.
+    """
+    lines = []
+    for index in sorted(range(len(boxes)), key=lambda i: boxes[i][1]):
+        x, y, w, h = boxes[index]
+        centre = y + h / 2
+        if lines and lines[-1][0] <= centre <= lines[-1][1]:
+            lines[-1][2].append(index)
+        else:
+            lines.append([y, y + h, [index]])
+    return [sorted(members, key=lambda i: boxes[i][0]) for _, _, members in lines]
+
+
+class OCREngine:
+    """Run tesseract on a pool of workers and record per-stage timings.
+
+    With tesserocr installed each pool worker keeps an initialised
+    PyTessBaseAPI per (lang, psm), so language data is loaded once rather
+    than per image and recognition runs in-process with the GIL released.
+    Recognition always runs on the pool, also for calls made from other
+    threads, so the number of instances is bounded by the pool size.
+    Without tesserocr every image still goes through a pytesseract
+    subprocess, but the pool keeps one running per core. Batches (pages,
+    regions) are spread over the pool and come back in input order.
+    """
+
+    def __init__(self, workers=None, lang='eng', psm=DEFAULT_PSM):
+        self.workers = workers or default_workers()
+        self.lang = lang
+        self.psm = psm
+        self.backend = 'tesserocr' if tesserocr is not None else 'pytesseract'
+        self._pool = None
+        self._local = threading.local()
+        self._apis = []
+        self._lock = threading.Lock()
+        self.totals = {stage: 0.0 for stage in STAGES}
+        self.images = 0
+
+    def configure(self, workers=None, omp_thread_limit=1):
+        """Change the pool size; takes effect for the next batch.
+
+        Unless OMP_THREAD_LIMIT is already set, it is set to omp_thread_limit
+        for this process, since tesseract's own OpenMP threads would compete
+        with the pool for cores. Pass None to leave it alone.
+        """
+        if omp_thread_limit is not None:
+            os.environ.setdefault('OMP_THREAD_LIMIT', str(omp_thread_limit))
+        if self.backend != 'tesserocr':
+            logger.warning("tesserocr is not installed; OCR starts a tesseract process per image")
+        old_pool, old_apis = None, []
+        with self._lock:
+            if workers and workers != self.workers:
+                self.workers = workers
+                old_pool, self._pool = self._pool, None
+                old_apis, self._apis = self._apis, []
+        if old_pool is not None:
+            # The old workers' instances are freed once they are done with them
+            old_pool.shutdown(wait=True)
+        for api in old_apis:
+            api.End()
+
+    def recognize(self, image, lang=None, psm=None, preprocess=None, config=''):
+        """OCR one PIL image; return its text and milliseconds spent per stage."""
+        timings = {}
+        start = time.perf_counter()
+        if preprocess is not None:
+            image = preprocess(image)
+        preprocessed = time.perf_counter()
+        timings['preprocess_ms'] = (preprocessed - start) * 1000
+
+        raw = self._recognize(image, lang or self.lang, self.psm if psm is None else psm, config)
+        finished = time.perf_counter()
+        timings['recognize_ms'] = (finished - preprocessed) * 1000
+
+        text = postprocess_text(raw)
+        timings['postprocess_ms'] = (time.perf_counter() - finished) * 1000
+
+        self._record(timings)
+        return {'text': text, 'timings': timings}
+
+    def recognize_batch(self, images, lang=None, psm=None, preprocess=None, config=''):
+        """OCR several images in parallel; results are in input order."""
+        return self._map([(image, lang, psm, preprocess, config) for image in images])
+
+    def recognize_regions(self, image, lang=None, preprocess=None, boxes=None):
+        """OCR only the text regions of image and merge them in reading order.
+
+        Regions are found with detect_text_regions unless boxes are given.
+        Regions about one line tall are read as a single line, taller ones
+        as a block. If nothing is found, text covers most of the frame, or
+        a large component that may be a heading was discarded, the whole
+        image is recognised in one pass instead.
+        """
+        start = time.perf_counter()
+        dropped_large = False
+        if boxes is None:
+            gray = np.asarray(image.convert('L'))
+            boxes, dropped_large = find_text_regions(gray)
+        detect_ms = (time.perf_counter() - start) * 1000
+
+        covered = sum(w * h for _, _, w, h in boxes)
+        if not boxes or dropped_large or covered > FULL_PAGE_COVERAGE * image.width * image.height:
+            result = self.recognize(image, lang, preprocess=preprocess)
+            result['timings']['detect_ms'] = detect_ms
+            result['regions'] = []
+            return result
+
+        line_height = sorted(h for _, _, _, h in boxes)[len(boxes) // 2]
+        calls = []
+        for x, y, w, h in boxes:
+            crop = image.crop((x, y, x + w, y + h))
+            if h < MIN_REGION_HEIGHT:
+                scale = MIN_REGION_HEIGHT / h
+                crop = crop.resize((round(w * scale), MIN_REGION_HEIGHT), Image.Resampling.LANCZOS)
+            psm = LINE_PSM if h < 2 * line_height else BLOCK_PSM
+            calls.append((crop, lang, psm, preprocess, ''))
+        results = self._map(calls)
+
+        lines = []
+        for members in reading_order(boxes):
+            words = [results[i]['text'] for i in members if results[i]['text']]
+            if words:
+                lines.append(' '.join(words))
+
+        timings = {'detect_ms': detect_ms}
+        for stage in STAGES:
+            timings[f'{stage}_ms'] = sum(result['timings'][f'{stage}_ms'] for result in results)
+        return {'text': '\n'.join(lines), 'timings': timings, 'regions': [list(box) for box in boxes]}
+
+    def submit(self, image, lang=None, detect_regions=False, preprocess=None):
+        """Queue one image on the pool and return a Future of its result.
+
+        Regions of the image are read inline on the worker, so several
+        pages can be in flight without nesting batches on the pool.
+        """
+        method = self.recognize_regions if detect_regions else self.recognize
+        return self._executor().submit(method, image, lang, preprocess=preprocess)
+
+    def stats(self):
+        """Total and mean milliseconds per stage since start-up."""
+        with self._lock:
+            count = self.images
+            return {
+                'backend': self.backend,
+                'workers': self.workers,
+                'images': count,
+                'total_ms': {stage: self.totals[stage] for stage in STAGES},
+                'mean_ms': {stage: self.totals[stage] / count if count else 0.0 for stage in STAGES}
+            }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True)
+                self._pool = None
+            for api in self._apis:
+                api.End()
+            self._apis = []
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ocr',
+                                                initializer=self._init_worker)
+            return self._pool
+
+    def _map(self, calls):
+        """Run recognize over argument tuples on the pool, in order."""
+        calls = list(calls)
+        # Batches started from inside a worker run inline to avoid starving the pool
+        if len(calls) <= 1 or self.workers == 1 or getattr(self._local, 'in_worker', False):
+            return [self.recognize(*args) for args in calls]
+        pool = self._executor()
+        futures = [pool.submit(self.recognize, *args) for args in calls]
+        return [future.result() for future in futures]
+
+    def _init_worker(self):
+        self._local.in_worker = True
+
+    def _recognize(self, image, lang, psm, config):
+        if self.backend == 'tesserocr' and not config:
+            if not getattr(self._local, 'in_worker', False):
+                # Only pool workers own tesserocr instances
+                return self._executor().submit(self._recognize, image, lang, psm, config).result()
+            api = self._api(lang, psm)
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        return pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm} {config}'.strip())
+
+    def _api(self, lang, psm):
+        """Return this pool worker's warm tesserocr instance for (lang, psm)."""
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = {}
+        api = apis.get((lang, psm))
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+            apis[(lang, psm)] = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def _record(self, timings):
+        with self._lock:
+            self.images += 1
+            for stage in STAGES:
+                self.totals[stage] += timings[f'{stage}_ms']
+
+
+# Shared by every OCR caller in the process
+ocr_engine = OCREngine()
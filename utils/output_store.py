@@ -0,0 +1,154 @@
+import os
+import re
+import time
+import uuid
+import shutil
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT = 'static/outputs'
+DEFAULT_SESSION = 'shared'
+DEFAULT_MAX_AGE = 60 * 60  # seconds a superseded version is kept
+DEFAULT_KEEP_VERSIONS = 2  # newest versions per output name that are never collected
+
+_SAFE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def _safe(part):
+    return _SAFE.sub('_', part) or '_'
+
+
+class OutputStore:
+    """Session- and version-scoped storage for generated files.
+
+    Every write goes to a new path, static/outputs/<session>/<name>.<version>.<ext>,
+    via a temporary file and an atomic rename, so concurrent requests never
+    overwrite each other and a URL always refers to the same bytes. That
+    makes the URLs safe to cache forever. Old versions are removed by
+    collect_garbage(), which can run on a background thread.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, url_prefix=None, max_age=DEFAULT_MAX_AGE,
+                 keep_versions=DEFAULT_KEEP_VERSIONS):
+        self.root = root
+        self.url_prefix = url_prefix or '/' + root.strip('/')
+        self.max_age = max_age
+        self.keep_versions = keep_versions
+        self._gc_thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def configure(self, max_age=None, keep_versions=None):
+        """Change the garbage collection policy."""
+        if max_age is not None:
+            self.max_age = max_age
+        if keep_versions is not None:
+            self.keep_versions = keep_versions
+
+    def new_version(self, session_id, name, ext):
+        """Reserve a fresh (filesystem path, URL) pair for an output."""
+        ext = ext.lstrip('.').lower()
+        if name.lower().endswith('.' + ext):
+            name = name[:-len(ext) - 1]
+        session = _safe(session_id or DEFAULT_SESSION)
+        filename = f'{_safe(name)}.{uuid.uuid4().hex[:12]}.{ext}'
+        directory = os.path.join(self.root, session)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename), f'{self.url_prefix}/{session}/{filename}'
+
+    @contextmanager
+    def writing(self, session_id, name, ext):
+        """Yield (temp_path, url); the file appears at url only if the block succeeds."""
+        path, url = self.new_version(session_id, name, ext)
+        temp_path = f'{path}.tmp{os.path.splitext(path)[1]}'
+        try:
+            yield temp_path, url
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def save_image(self, image, session_id, name, ext=None, **save_options):
+        """Encode a PIL image as a new version and return its URL."""
+        ext = ext or os.path.splitext(name)[1] or '.png'
+        with self.writing(session_id, name, ext) as (temp_path, url):
+            image.save(temp_path, **save_options)
+        return url
+
+    def write_bytes(self, data, session_id, name, ext=None):
+        ext = ext or os.path.splitext(name)[1] or '.bin'
+        with self.writing(session_id, name, ext) as (temp_path, url):
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+        return url
+
+    def path_for(self, url):
+        """Map an output URL back to its file, or None if it is not ours."""
+        if not url.startswith(self.url_prefix + '/'):
+            return None
+        relative = url[len(self.url_prefix) + 1:]
+        path = os.path.normpath(os.path.join(self.root, relative))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            return None
+        return path
+
+    def collect_garbage(self, now=None):
+        """Delete superseded versions older than max_age and empty sessions."""
+        now = now or time.time()
+        removed = 0
+        for session in os.listdir(self.root):
+            directory = os.path.join(self.root, session)
+            if not os.path.isdir(directory):
+                continue
+            versions = {}
+            for filename in os.listdir(directory):
+                if '.tmp.' in filename:
+                    continue
+                stem = filename.split('.', 1)[0]
+                path = os.path.join(directory, filename)
+                try:
+                    versions.setdefault(stem, []).append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+            for files in versions.values():
+                files.sort(reverse=True)
+                for mtime, path in files[self.keep_versions:]:
+                    if now - mtime > self.max_age:
+                        try:
+                            os.remove(path)
+                            removed += 1
+                        except OSError:
+                            pass
+                # Sessions that went quiet lose their newest versions too
+                if files and now - files[0][0] > self.max_age * 24:
+                    for _, path in files[:self.keep_versions]:
+                        if os.path.exists(path):
+                            os.remove(path)
+                            removed += 1
+            if not os.listdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+        return removed
+
+    def start_gc(self, interval=300):
+        """Run collect_garbage every interval seconds on a daemon thread."""
+        if self._gc_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    removed = self.collect_garbage()
+                    if removed:
+                        logger.debug(f"Removed {removed} old output versions")
+                except Exception as e:
+                    logger.error(f"Error in output garbage collection: {str(e)}")
+
+        self._gc_thread = threading.Thread(target=loop, name='output-gc', daemon=True)
+        self._gc_thread.start()
+
+
+# Shared by every processor in the process
+output_store = OutputStore()
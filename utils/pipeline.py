@@ -0,0 +1,230 @@
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+# ITU-R 601 luma weights, same as PIL's convert('L')
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+SEPIA_MATRIX = np.array([
+    [0.393, 0.769, 0.189],
+    [0.349, 0.686, 0.168],
+    [0.272, 0.534, 0.131]
+])
+
+# Channel gains of ImageProcessor.apply_filter('warm'), which scales channels 1 and 2
+WARM_GAINS = np.array([1.0, 1.1, 1.2])
+WARM_MATRIX = np.diag(WARM_GAINS)
+
+# Point operations are colour-affine (out = M @ rgb + offset) and can be fused
+POINT_OPS = {'grayscale', 'sepia', 'warm', 'brightness', 'contrast'}
+SPATIAL_OPS = {'sharp', 'blur', 'edge', 'rotate', 'flip', 'crop', 'resize'}
+
+# Rows handled per batch when applying a fused colour transform
+BATCH_ROWS = 512
+
+
+class Pipeline:
+    """Run a list of filter/transform steps on a single decoded buffer.
+
+    The image is decoded once into a NumPy array. Runs of adjacent point
+    operations are folded into one 3x3 matrix plus offset and applied in
+    a single pass, computed in float and rounded once at the end of the
+    run, so a longer run can differ by one level from applying its steps
+    one at a time. A run of a single grayscale, sepia or warm step uses
+    the same arithmetic as ImageProcessor.apply_filter and matches it
+    exactly. Everything else works on the same buffer, and the result is
+    encoded only when save() or to_image() is called.
+    """
+
+    def __init__(self, steps=None):
+        self.steps = []
+        for step in steps or []:
+            if isinstance(step, str):
+                self.add(step)
+            else:
+                self.add(step.get('action'), step.get('params'))
+
+    def add(self, action, params=None):
+        """Append a step and return the pipeline so calls can be chained."""
+        if action not in POINT_OPS and action not in SPATIAL_OPS:
+            raise ValueError(f'Invalid pipeline action: {action}')
+        self.steps.append((action, dict(params or {})))
+        return self
+
+    def __len__(self):
+        return len(self.steps)
+
+    def run(self, image):
+        """Apply all steps to a PIL image or array and return the result array."""
+        array, alpha = self._split_alpha(image)
+        matrix, offset = None, None
+        gray = array.ndim == 2
+
+        for action, params in self.steps:
+            if action in POINT_OPS:
+                if matrix is None:
+                    matrix, offset = np.eye(3), np.zeros(3)
+                    source_mean = None
+                    run = []
+                run.append(action)
+                if action == 'contrast':
+                    # The mean of an affine transform is the transform of the mean,
+                    # so the contrast pivot can be computed without flushing
+                    if source_mean is None:
+                        source_mean = _channel_means(array)
+                    mean = LUMA_WEIGHTS @ (matrix @ source_mean + offset)
+                    step_matrix, step_offset = _point_op(action, params, int(mean + 0.5))
+                else:
+                    step_matrix, step_offset = _point_op(action, params)
+                matrix = step_matrix @ matrix
+                offset = step_matrix @ offset + step_offset
+                if action == 'grayscale':
+                    gray = True
+                elif action in ('sepia', 'warm'):
+                    gray = False
+                continue
+
+            if matrix is not None:
+                array = _apply_run(array, run, matrix, offset, gray)
+                matrix = None
+            array, alpha = _spatial_op(action, params, array, alpha)
+            if action == 'edge':
+                gray = True
+
+        if matrix is not None:
+            array = _apply_run(array, run, matrix, offset, gray)
+
+        if alpha is not None and array.ndim == 3 and array.shape[:2] == alpha.shape:
+            array = np.dstack([array, alpha])
+        return array
+
+    def to_image(self, image):
+        """Apply all steps and return the result as a PIL image."""
+        return Image.fromarray(self.run(image))
+
+    def save(self, image, output_path, **save_kwargs):
+        """Apply all steps and encode the result once to output_path."""
+        result = self.to_image(image)
+        result.save(output_path, **save_kwargs)
+        return result
+
+    @staticmethod
+    def _split_alpha(image):
+        if isinstance(image, Image.Image):
+            if image.mode == 'P':
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            elif image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGB')
+            array = np.asarray(image)
+        else:
+            array = np.asarray(image)
+        if array.ndim == 3 and array.shape[2] == 4:
+            return np.ascontiguousarray(array[:, :, :3]), np.ascontiguousarray(array[:, :, 3])
+        return array, None
+
+
+def _channel_means(array):
+    if array.ndim == 2:
+        return np.full(3, array.mean(dtype=np.float64))
+    return array.reshape(-1, array.shape[2]).mean(axis=0, dtype=np.float64)
+
+
+def _point_op(action, params, mean=None):
+    """Return the (matrix, offset) pair describing one point operation."""
+    if action == 'grayscale':
+        return np.tile(LUMA_WEIGHTS, (3, 1)), np.zeros(3)
+    if action == 'sepia':
+        return SEPIA_MATRIX, np.zeros(3)
+    if action == 'warm':
+        return WARM_MATRIX, np.zeros(3)
+    if action == 'brightness':
+        factor = float(params.get('factor', 1.0))
+        return np.eye(3) * factor, np.zeros(3)
+    if action == 'contrast':
+        # Same blend as ImageEnhance.Contrast: mean + factor * (v - mean)
+        factor = float(params.get('factor', 1.0))
+        return np.eye(3) * factor, np.full(3, (1.0 - factor) * mean)
+    raise ValueError(f'Invalid point operation: {action}')
+
+
+def _apply_run(array, run, matrix, offset, gray):
+    """Apply a run of point operations, single filters exactly as apply_filter does."""
+    if run == ['grayscale']:
+        return np.asarray(Image.fromarray(array).convert('L'))
+    if run == ['sepia'] and array.ndim == 3:
+        return cv2.transform(array, SEPIA_MATRIX)
+    if run == ['warm'] and array.ndim == 3:
+        # apply_filter truncates rather than rounds
+        out = array.copy()
+        out[:, :, 2] = np.clip(array[:, :, 2] * WARM_GAINS[2], 0, 255)
+        out[:, :, 1] = np.clip(array[:, :, 1] * WARM_GAINS[1], 0, 255)
+        return out
+    return _apply_affine(array, matrix, offset, gray)
+
+
+def _apply_affine(array, matrix, offset, gray):
+    """Apply a fused colour transform in row batches and round once."""
+    height, width = array.shape[:2]
+    out = np.empty((height, width) if gray else (height, width, 3), dtype=np.uint8)
+    matrix_t = matrix.T.astype(np.float32)
+    offset = offset.astype(np.float32)
+
+    for start in range(0, height, BATCH_ROWS):
+        band = array[start:start + BATCH_ROWS].astype(np.float32)
+        if band.ndim == 2:
+            band = np.repeat(band[:, :, None], 3, axis=2)
+        result = band @ matrix_t
+        result += offset
+        np.rint(result, out=result)
+        np.clip(result, 0, 255, out=result)
+        out[start:start + BATCH_ROWS] = result[:, :, 0] if gray else result
+    return out
+
+
+def _spatial_op(action, params, array, alpha):
+    """Run a non-fusable step on the buffer, keeping alpha in step with it."""
+    if action == 'flip':
+        axis = 1 if params.get('direction', 'horizontal') == 'horizontal' else 0
+        array = np.flip(array, axis=axis)
+        alpha = np.flip(alpha, axis=axis) if alpha is not None else None
+        return np.ascontiguousarray(array), alpha
+
+    if action == 'crop':
+        height, width = array.shape[:2]
+        box = (slice(params.get('top', 0), params.get('bottom', height)),
+               slice(params.get('left', 0), params.get('right', width)))
+        array = array[box].copy()
+        alpha = alpha[box].copy() if alpha is not None else None
+        return array, alpha
+
+    if action == 'edge':
+        gray = array if array.ndim == 2 else cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+        return cv2.Canny(gray, 100, 200), None
+
+    if action == 'rotate':
+        angle = params.get('angle', 90)
+        if angle % 90 == 0:
+            k = (angle // 90) % 4
+            array = np.ascontiguousarray(np.rot90(array, k))
+            alpha = np.ascontiguousarray(np.rot90(alpha, k)) if alpha is not None else None
+            return array, alpha
+
+    image = Image.fromarray(array)
+    alpha_image = Image.fromarray(alpha) if alpha is not None else None
+
+    if action == 'rotate':
+        image = image.rotate(angle, expand=True)
+        if alpha_image is not None:
+            alpha_image = alpha_image.rotate(angle, expand=True)
+    elif action == 'resize':
+        size = (params.get('width', image.width), params.get('height', image.height))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+        if alpha_image is not None:
+            alpha_image = alpha_image.resize(size, Image.Resampling.LANCZOS)
+    elif action == 'sharp':
+        image = ImageEnhance.Sharpness(image).enhance(params.get('factor', 1.5))
+    elif action == 'blur':
+        image = image.filter(ImageFilter.GaussianBlur(radius=params.get('radius', 2)))
+
+    alpha = np.asarray(alpha_image) if alpha_image is not None else None
+    return np.asarray(image), alpha
@@ -0,0 +1,197 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from utils.image_cache import image_cache
+from utils.jpeg import is_jpeg, draft_decode
+from utils.job_queue import JobQueue, PENDING
+
+DEFAULT_VIEWPORT = (800, 600)
+MAX_PYRAMIDS = 16
+
+# Step parameters measured in pixels, rescaled when rendering a proxy
+PIXEL_PARAMS = {
+    'blur': ('radius',),
+    'crop': ('left', 'top', 'right', 'bottom'),
+    'resize': ('width', 'height'),
+}
+# Of those, positions that may legitimately be 0; sizes are kept at least 1
+OFFSET_PARAMS = ('left', 'top')
+
+# Full-resolution renders for the desktop apps, one at a time in the background
+render_queue = JobQueue(max_workers=1, process_workers=0)
+
+
+def scale_kernel(size, scale):
+    """Scale an odd kernel size, keeping it odd and at least 1."""
+    return max(1, int(round((size - 1) * scale / 2)) * 2 + 1)
+
+
+def build_pyramid(image, min_size=64):
+    """Return successive half-size levels of image, largest first."""
+    levels = [image]
+    while min(levels[-1].size) // 2 >= min_size:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def pick_level(levels, viewport):
+    """Return the smallest level that still covers the viewport, and its scale."""
+    full_width = levels[0].width
+    chosen = levels[0]
+    for level in levels:
+        if level.width < viewport[0] and level.height < viewport[1]:
+            break
+        chosen = level
+    return chosen, chosen.width / full_width
+
+
+def scale_steps(steps, scale):
+    """Rescale pixel-valued parameters so a proxy render matches full resolution."""
+    scaled = []
+    for step in steps:
+        params = dict(step.get('params') or {})
+        for name in PIXEL_PARAMS.get(step['action'], ()):
+            if name in params:
+                value = params[name] * scale
+                if name == 'radius':
+                    params[name] = value
+                else:
+                    params[name] = max(0 if name in OFFSET_PARAMS else 1, int(round(value)))
+        scaled.append({'action': step['action'], 'params': params})
+    return scaled
+
+
+class PyramidCache:
+    """Downscaled copies of recently previewed uploads, keyed by file identity."""
+
+    def __init__(self, max_entries=MAX_PYRAMIDS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reduced_levels(self, filepath):
+        """Return the half, quarter, ... size levels of filepath."""
+        key = image_cache.file_key(filepath)
+        with self._lock:
+            levels = self._entries.get(key)
+            if levels is not None:
+                self._entries.move_to_end(key)
+                return levels
+
+        # The full level itself stays in the decoded-image cache
+        levels = build_pyramid(image_cache.load_image(filepath))[1:]
+        with self._lock:
+            self._entries[key] = levels
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return levels
+
+    def proxy(self, filepath, viewport=DEFAULT_VIEWPORT):
+        """Return (proxy image, scale) for rendering a preview of filepath."""
+        if is_jpeg(filepath):
+            return self._draft_proxy(filepath, viewport)
+        full = image_cache.load_image(filepath)
+        return pick_level([full] + self.reduced_levels(filepath), viewport)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _draft_proxy(self, filepath, viewport):
+        """Decode a JPEG straight at the smallest 1/2^n scale that covers the viewport."""
+        key = image_cache.file_key(filepath) + (tuple(viewport),)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        entry = draft_decode(filepath, viewport)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+class ProxyEditor:
+    """Edit a low-resolution proxy interactively and replay on the original later.
+
+    Used by the desktop apps: every operation runs immediately on a proxy
+    sized to the viewport and is recorded. The full-resolution result is
+    only computed when full_image() is called, e.g. on save or OCR, and
+    only the operations added since the last call are applied.
+    """
+
+    def __init__(self, image, viewport=DEFAULT_VIEWPORT):
+        if image.mode == 'P':
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        self.original = image
+        self.viewport = viewport
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop all operations and go back to the original image."""
+        with self._lock:
+            # Twice the viewport keeps the proxy sharp after small crops and zooms
+            levels = build_pyramid(self.original)
+            proxy, self.scale = pick_level(levels, (self.viewport[0] * 2, self.viewport[1] * 2))
+            self.proxy = proxy.copy()
+            self.operations = []
+            self._full = None
+            self._applied = 0
+            self._render_job = None
+
+    def apply(self, func, *args, pixel_params=(), kernel_params=(), **kwargs):
+        """Run func(image, *args, **kwargs) on the proxy and record it.
+
+        Keyword arguments named in pixel_params are multiplied by the proxy
+        scale for the preview and used unchanged at full resolution; those
+        in kernel_params are odd kernel sizes and stay odd when scaled.
+        """
+        proxy_kwargs = dict(kwargs)
+        for name in pixel_params:
+            proxy_kwargs[name] = kwargs[name] * self.scale
+        for name in kernel_params:
+            proxy_kwargs[name] = scale_kernel(kwargs[name], self.scale)
+        self.proxy = func(self.proxy, *args, **proxy_kwargs)
+        self.operations.append((func, args, kwargs))
+        return self.proxy
+
+    def full_image(self):
+        """Bring the full-resolution image up to date and return it."""
+        with self._lock:
+            if self._full is None:
+                self._full = self.original.copy()
+            operations = self.operations[self._applied:]
+            for func, args, kwargs in operations:
+                self._full = func(self._full, *args, **kwargs)
+            self._applied += len(operations)
+            return self._full
+
+    def render_in_background(self, queue=None):
+        """Queue bringing the full-resolution image up to date; return the job id.
+
+        A render that has not started yet will pick up every operation
+        recorded so far, so no second one is queued behind it.
+        """
+        queue = queue or render_queue
+        if self._render_job is not None:
+            job = queue.status(self._render_job)
+            if job is not None and job['state'] == PENDING:
+                return self._render_job
+        self._render_job = queue.submit('proxy_render', self._render)
+        return self._render_job
+
+    def _render(self):
+        # The job keeps its result around, so don't hand it the image
+        self.full_image()
+
+    def display_image(self, size):
+        """Return a copy of the proxy that fits within size."""
+        image = self.proxy.copy()
+        image.thumbnail(size, Image.Resampling.BILINEAR)
+        return image
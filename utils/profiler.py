@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+import threading
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005
+
+
+def _fold(frame):
+    """One stack as 'outer;...;inner' in the collapsed format flame graph tools read."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """Sample the stacks of in-flight requests and keep the samples of slow ones.
+
+    One background thread wakes every interval seconds and records the
+    stack of each thread currently inside begin()/end(). Requests that
+    finish under threshold_ms are discarded; slower ones are written to
+    directory as collapsed stacks (<time>-<name>-<ms>ms.folded), which
+    flamegraph.pl, speedscope and inferno render as flame graphs. Work a
+    request hands to other threads is not sampled.
+    """
+
+    def __init__(self, threshold_ms, directory='profiles', interval=DEFAULT_INTERVAL):
+        self.threshold_ms = threshold_ms
+        self.directory = directory
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dumps = 0
+
+    def begin(self):
+        """Start sampling the calling thread; pass the result to end()."""
+        ident = threading.get_ident()
+        samples = Counter()
+        with self._lock:
+            self._active[ident] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+                self._thread.start()
+        return ident, samples, time.perf_counter()
+
+    def end(self, token, name):
+        """Stop sampling; write the samples if the request was slow. Returns the path or None."""
+        ident, samples, started = token
+        with self._lock:
+            self._active.pop(ident, None)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < self.threshold_ms or not samples:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        path = os.path.join(self.directory,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_name}-{elapsed_ms:.0f}ms.folded')
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        self.dumps += 1
+        logger.warning(f"Slow request {name} took {elapsed_ms:.0f}ms; profile written to {path}")
+        return path
+
+    def _sample(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                # Under the lock so end() never reads samples that are still being added
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        samples[_fold(frame)] += 1
@@ -0,0 +1,256 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+from utils.image_cache import image_cache
+from utils.output_store import output_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+HASH_CHUNK = 1024 * 1024
+# Part of every key; bump it when an operation's output changes so stored results are not reused
+CACHE_VERSION = 1
+
+
+def canonical_params(value):
+    """Normalise params so equivalent requests produce the same key."""
+    if isinstance(value, dict):
+        return {str(k): canonical_params(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [canonical_params(v) for v in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class ResultCache:
+    """Content-addressed cache of /process results.
+
+    Keys are derived from the SHA-256 of the image bytes, the action and
+    the canonicalised params, so the same asset uploaded under another
+    name still hits. An entry is the result dict plus the bytes of the
+    output file it points to, if any. Entries live in an LRU memory tier
+    and a disk tier, each with its own size budget; a disk hit is
+    promoted to memory. The disk tier is indexed in memory, least
+    recently used first, so eviction does not scan the cache directory.
+    """
+
+    def __init__(self, cache_dir, memory_bytes=DEFAULT_MEMORY_BYTES, disk_bytes=DEFAULT_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._disk = OrderedDict((key, size) for _, key, size in sorted(self._disk_entries()))
+        self._disk_used = sum(self._disk.values())
+
+    def content_hash(self, filepath):
+        """SHA-256 of a file, remembered per (path, mtime, size)."""
+        key = image_cache.file_key(filepath)
+        with self._lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self.remember_hash(filepath, digest)
+        return digest
+
+    def remember_hash(self, filepath, digest):
+        """Record a hash computed elsewhere, e.g. while streaming an upload."""
+        with self._lock:
+            self._hashes[image_cache.file_key(filepath)] = digest
+            while len(self._hashes) > 4096:
+                self._hashes.popitem(last=False)
+
+    def key(self, filepath, action, params):
+        payload = json.dumps([CACHE_VERSION, self.content_hash(filepath), action, canonical_params(params or {})],
+                             sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def lookup(self, filepath, action, params, session_id=None):
+        """Return the cached result for a request, or None.
+
+        A hit that has an output file is written as a new version in the
+        caller's session and named after the caller's file, as the
+        processors name their outputs, since the entry may have been
+        stored for another upload with the same bytes.
+        """
+        entry = self.get(self.key(filepath, action, params), action)
+        if entry is None:
+            return None
+        result, output = entry
+        if output is not None:
+            stem = os.path.splitext(os.path.basename(filepath))[0]
+            ext = os.path.splitext(result['filepath'])[1]
+            url = output_store.write_bytes(output, session_id, f'processed_{stem}', ext)
+            result = dict(result, filepath=url)
+        return dict(result, cached=True)
+
+    def store(self, filepath, action, params, result):
+        """Cache a successful result and the output file it points to."""
+        if isinstance(result, dict) and 'error' not in result:
+            self.put(self.key(filepath, action, params), action, result)
+
+    def get_or_compute(self, filepath, action, params, compute, session_id=None):
+        """Return the cached result for this request, or compute and store it."""
+        result = self.lookup(filepath, action, params, session_id)
+        if result is None:
+            result = compute()
+            self.store(filepath, action, params, result)
+        return result
+
+    def get(self, key, action):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            self._count(action, 'memory_hits')
+            return entry
+
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._count(action, 'disk_hits')
+            self._remember(key, entry)
+        else:
+            self._count(action, 'misses')
+        return entry
+
+    def put(self, key, action, result):
+        output = None
+        if result.get('filepath'):
+            path = output_store.path_for(result['filepath'])
+            if path is None or not os.path.exists(path):
+                return
+            with open(path, 'rb') as f:
+                output = f.read()
+        entry = (result, output)
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self):
+        """Per-action hit rates and tier usage."""
+        with self._lock:
+            actions = {}
+            for action, counts in self.counters.items():
+                hits = counts.get('memory_hits', 0) + counts.get('disk_hits', 0)
+                lookups = hits + counts.get('misses', 0)
+                actions[action] = dict(counts, hit_rate=hits / lookups if lookups else 0.0)
+            return {
+                'actions': actions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_used,
+                'disk_bytes': self._disk_used
+            }
+
+    def _count(self, action, name):
+        with self._lock:
+            counts = self.counters.setdefault(action, {})
+            counts[name] = counts.get(name, 0) + 1
+
+    def _remember(self, key, entry):
+        size = _entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= _entry_size(self._memory.pop(key))
+            self._memory[key] = entry
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, old = self._memory.popitem(last=False)
+                self._memory_used -= _entry_size(old)
+
+    def _paths(self, key):
+        directory = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(directory, f'{key}.json'), os.path.join(directory, f'{key}.bin')
+
+    def _read_disk(self, key):
+        with self._lock:
+            if key not in self._disk:
+                return None
+        meta_path, data_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                result = json.load(f)
+            output = None
+            if os.path.exists(data_path):
+                with open(data_path, 'rb') as f:
+                    output = f.read()
+            os.utime(meta_path)  # keeps the recency order across restarts
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+        return result, output
+
+    def _write_disk(self, key, entry):
+        result, output = entry
+        meta_path, data_path = self._paths(key)
+        try:
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            meta = json.dumps(result).encode()
+            if output is not None:
+                _atomic_write(data_path, output)
+            _atomic_write(meta_path, meta)
+        except (OSError, TypeError) as e:
+            logger.debug(f"Could not store result {key}: {str(e)}")
+            return
+
+        size = len(meta) + len(output or b'')
+        evicted = []
+        with self._lock:
+            self._disk_used += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            while self._disk_used > self.disk_bytes and len(self._disk) > 1:
+                old_key, old_size = self._disk.popitem(last=False)
+                self._disk_used -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            for path in self._paths(old_key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _disk_entries(self):
+        """(mtime, key, size) of every entry on disk; only read at start-up."""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.json'):
+                    meta_path = os.path.join(root, name)
+                    data_path = meta_path[:-5] + '.bin'
+                    try:
+                        size = os.path.getsize(meta_path)
+                        if os.path.exists(data_path):
+                            size += os.path.getsize(data_path)
+                        entries.append((os.path.getmtime(meta_path), name[:-5], size))
+                    except OSError:
+                        continue
+        return entries
+
+
+def _entry_size(entry):
+    result, output = entry
+    return len(output or b'') + len(json.dumps(result))
+
+
+def _atomic_write(path, data):
+    temp_path = f'{path}.tmp{os.getpid()}.{threading.get_ident()}'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
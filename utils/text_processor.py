@@ -1,32 +1,97 @@
-import pytesseract
+import os
+import time
+import threading
+from collections import OrderedDict
 from PIL import Image
-import pyttsx3
-from googletrans import Translator
 from fpdf import FPDF
-import os
 import logging
+from utils.image_cache import image_cache
+from utils.output_store import output_store
+from utils.lazy import lazy
+from utils.ocr import ocr_engine
+from utils.documents import is_document, ocr_document
 
 logger = logging.getLogger(__name__)
 
+MAX_EXPORTS = 64  # PDFs remembered by export key
+
+def _create_translator():
+    from googletrans import Translator
+    return Translator()
+
+def _create_tts_engine():
+    import pyttsx3
+    return pyttsx3.init()
+
 class TextProcessor:
-    def __init__(self):
-        self.translator = Translator()
-        self.engine = pyttsx3.init()
+    def __init__(self, page_cache=None):
+        # Optional ResultCache for per-page OCR of documents
+        self.page_cache = page_cache
+        # Export key -> PDF path, so an unchanged export is not rebuilt
+        self._exports = OrderedDict()
+        self._exports_lock = threading.Lock()
+
+        # The TTS engine and translator are created on first use
+        self._translator = lazy('translator', _create_translator)
+        self._engine = lazy('tts_engine', _create_tts_engine)
+
+    @property
+    def translator(self):
+        return self._translator.get()
+
+    @property
+    def engine(self):
+        return self._engine.get()
 
-    def extract_text(self, filepath, lang='eng'):
-        """Extract text from image using OCR."""
+    def extract_text(self, filepath, lang='eng', detect_regions=False):
+        """Extract text from image using OCR, optionally only in detected text regions."""
         try:
-            image = Image.open(filepath)
-            text = pytesseract.image_to_string(image, lang=lang)
-            return {
+            if is_document(filepath):
+                pages = sorted(self.iter_document_text(filepath, lang, detect_regions),
+                               key=lambda page: page['page'])
+                errors = [page for page in pages if 'error' in page]
+                if errors:
+                    return {'error': f"Page {errors[0]['page']}: {errors[0]['error']}"}
+                return {
+                    'success': True,
+                    'text': '\n\n'.join(page['text'] for page in pages),
+                    'pages': pages
+                }
+
+            start = time.perf_counter()
+            image = image_cache.load_image(filepath)
+            load_ms = (time.perf_counter() - start) * 1000
+            if detect_regions:
+                result = ocr_engine.recognize_regions(image, lang)
+            else:
+                result = ocr_engine.recognize(image, lang)
+            response = {
                 'success': True,
-                'text': text.strip()
+                'text': result['text'],
+                'timings': dict(result['timings'], load_ms=load_ms)
             }
+            if detect_regions:
+                response['regions'] = result['regions']
+            return response
         except Exception as e:
             logger.error(f"Error in OCR: {str(e)}")
             return {'error': str(e)}
 
-    def text_to_speech(self, text, lang='en'):
+    def iter_document_text(self, filepath, lang='eng', detect_regions=False):
+        """Yield the OCR result of each page of a PDF or TIFF as soon as it is ready."""
+        return ocr_document(filepath, ocr_engine, lang, detect_regions, cache=self.page_cache)
+
+    def extract_text_batch(self, filepaths, lang='eng'):
+        """Extract text from several images, recognised in parallel."""
+        try:
+            images = [image_cache.load_image(filepath) for filepath in filepaths]
+            return [{'success': True, 'text': result['text'], 'timings': result['timings']}
+                    for result in ocr_engine.recognize_batch(images, lang)]
+        except Exception as e:
+            logger.error(f"Error in batch OCR: {str(e)}")
+            return [{'error': str(e)} for _ in filepaths]
+
+    def text_to_speech(self, text, lang='en', session_id=None):
         """Convert text to speech."""
         try:
             if not text:
@@ -36,13 +101,13 @@ class TextProcessor:
             self.engine.setProperty('voice', lang)
             
             # Generate audio file
-            output_path = os.path.join('static/uploads', 'output.mp3')
-            self.engine.save_to_file(text, output_path)
-            self.engine.runAndWait()
+            with output_store.writing(session_id, 'speech', '.mp3') as (output_path, url):
+                self.engine.save_to_file(text, output_path)
+                self.engine.runAndWait()
             
             return {
                 'success': True,
-                'filepath': '/static/uploads/output.mp3'
+                'filepath': url
             }
         except Exception as e:
             logger.error(f"Error in TTS: {str(e)}")
@@ -65,9 +130,19 @@ class TextProcessor:
             logger.error(f"Error in translation: {str(e)}")
             return {'error': str(e)}
 
-    def export_to_pdf(self, content):
-        """Export images and text to PDF."""
+    def export_to_pdf(self, content, session_id=None, key=None):
+        """Export images and text to PDF.
+
+        key identifies the content, e.g. a hash of it; a PDF already built
+        for the same key is returned as is while its file still exists.
+        """
         try:
+            if key is not None:
+                with self._exports_lock:
+                    path = self._exports.get(key)
+                if path is not None and os.path.exists(path):
+                    return path
+
             pdf = FPDF()
             pdf.add_page()
             
@@ -87,10 +162,16 @@ class TextProcessor:
                 pdf.multi_cell(0, 10, content['text'])
             
             # Save PDF
-            output_path = os.path.join('static/uploads', 'output.pdf')
-            pdf.output(output_path)
+            with output_store.writing(session_id, 'export', '.pdf') as (output_path, url):
+                pdf.output(output_path)
             
-            return output_path
+            path = output_store.path_for(url)
+            if key is not None:
+                with self._exports_lock:
+                    self._exports[key] = path
+                    while len(self._exports) > MAX_EXPORTS:
+                        self._exports.popitem(last=False)
+            return path
         except Exception as e:
             logger.error(f"Error in PDF export: {str(e)}")
             raise 
\ No newline at end of file
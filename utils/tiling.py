@@ -0,0 +1,322 @@
+import os
+import math
+import struct
+import tempfile
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+try:
+    import tifffile
+except ImportError:  # optional, enables reading/writing tiled TIFFs without a full decode
+    tifffile = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_SIZE = 1024
+
+# Images above this many pixels are processed tile by tile
+TILED_THRESHOLD_PIXELS = 40 * 1000 * 1000
+
+# Decompression bomb limit of the tiled path, in place of Image.MAX_IMAGE_PIXELS
+MAX_TILED_PIXELS = 1000 * 1000 * 1000
+
+# Rows converted at a time when a source is not L, RGB or RGBA
+CONVERT_ROWS = 256
+
+
+def halo_for(action, params):
+    """Return how many context pixels an operation needs around each tile.
+
+    Point operations need none; neighbourhood filters need their kernel
+    support so tile seams are invisible. Canny's hysteresis can follow an
+    edge arbitrarily far, so no finite halo reproduces the untiled result
+    and edge detection is not tiled.
+    """
+    if action in ('grayscale', 'sepia', 'warm', 'brightness', 'contrast'):
+        return 0
+    if action == 'sharp':
+        return 2
+    if action == 'blur':
+        return int(math.ceil(3 * float(params.get('radius', 2)))) + 4
+    if action == 'median':
+        return int(params.get('radius', 3)) // 2 + 1
+    raise ValueError(f'Operation cannot be tiled: {action}')
+
+
+def can_tile(action):
+    try:
+        halo_for(action, {})
+        return True
+    except ValueError:
+        return False
+
+
+def open_source(path, max_pixels=MAX_TILED_PIXELS):
+    """Open an image as an array that can be sliced without decoding it all.
+
+    .npy files and uncompressed TIFFs (with tifffile installed) are memory
+    mapped. Other formats are decoded straight into a temporary
+    memory-mapped file, so decoded pixels go to the page cache rather than
+    to process memory; sources that are not L, RGB or RGBA are then
+    converted to RGB a band of rows at a time. max_pixels replaces
+    Pillow's decompression bomb limit, which this path exists to exceed;
+    larger images raise DecompressionBombError.
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if tifffile is not None and path.lower().endswith(('.tif', '.tiff')):
+        try:
+            return tifffile.memmap(path, mode='r')
+        except Exception:
+            logger.debug(f"{path} is not memory-mappable, decoding it")
+
+    image = open_unchecked(path)
+    try:
+        width, height = image.size
+        if max_pixels is not None and width * height > max_pixels:
+            raise Image.DecompressionBombError(
+                f'Image size ({width * height} pixels) exceeds limit of {max_pixels} pixels for tiled processing')
+        pixels = _decode_mapped(image)
+        if image.mode in ('L', 'RGB', 'RGBA'):
+            return pixels
+        store = pixel_store((height, width, 3), np.uint8)
+        for top in range(0, height, CONVERT_ROWS):
+            band = image.crop((0, top, width, min(top + CONVERT_ROWS, height))).convert('RGB')
+            store[top:top + band.height] = np.asarray(band)
+        store.flush()
+        return store
+    finally:
+        image.close()
+
+
+def open_unchecked(source):
+    """Image.open without its decompression bomb check.
+
+    For reading headers, or decoding under the caller's own limit; source
+    is a path or a binary file object. The check reads the
+    Image.MAX_IMAGE_PIXELS global, which other threads rely on, so the
+    format plugins are probed here the way Image.open does instead of
+    changing it.
+    """
+    Image.init()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            prefix = f.read(16)
+    else:
+        source.seek(0)
+        prefix = source.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        result = not accept or accept(prefix)
+        if not result or isinstance(result, str):
+            continue
+        try:
+            if not isinstance(source, str):
+                source.seek(0)
+            return factory(source)
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise Image.UnidentifiedImageError(f'cannot identify image file {source!r}')
+
+
+def _pixel_bytes(mode):
+    """Bytes per pixel in Pillow's own image memory."""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def _decode_mapped(image):
+    """Decode an opened image into a scratch file laid out like Pillow's image memory.
+
+    Pillow keeps the image memory it finds when loading, so the decoder
+    writes its rows straight into the mapping. Returns the pixels as an
+    array: (h, w) for single-byte modes, (h, w, 3) or (h, w, 4) for RGB
+    and RGBA, and the raw rows otherwise.
+    """
+    width, height = image.size
+    stride = width * _pixel_bytes(image.mode)
+    # map_buffer sizes '1' images at 4 bytes per pixel; the unused tail of
+    # the sparse scratch file is never written
+    length = height * (width * 4 if image.mode == '1' else stride)
+    buffer = scratch_store((length,), np.uint8)
+    core = Image.core.map_buffer(buffer, image.size, 'raw', 0, (image.mode, stride, 1))
+    image.im = core
+    image.load()
+    if image.im is not core:
+        # Pillow maps uncompressed files itself; copy them over a band at a time
+        target = Image.new(image.mode, (0, 0))._new(core)
+        for top in range(0, height, CONVERT_ROWS):
+            target.paste(image.crop((0, top, width, min(top + CONVERT_ROWS, height))), (0, top))
+    buffer.flush()
+
+    rows = buffer[:height * stride].reshape(height, stride)
+    if image.mode in ('RGB', 'RGBA'):
+        pixels = rows.reshape(height, width, 4)
+        return pixels[:, :, :3] if image.mode == 'RGB' else pixels
+    return rows
+
+
+def scratch_store(shape, dtype, directory=None):
+    """Create a temporary memory-mapped .npy array that is removed when closed."""
+    fd, path = tempfile.mkstemp(suffix='.npy', dir=directory)
+    os.close(fd)
+    store = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    os.unlink(path)  # the mapping stays valid until the array is released
+    return store
+
+
+def pixel_store(shape, dtype):
+    """scratch_store for image pixels.
+
+    8-bit RGB gets Pillow's 4-bytes-per-pixel layout, returned as an
+    (h, w, 3) view, so to_image() can encode it without a copy.
+    """
+    if len(shape) == 3 and shape[2] == 3 and np.dtype(dtype) == np.uint8:
+        return scratch_store(tuple(shape[:2]) + (4,), dtype)[:, :, :3]
+    return scratch_store(shape, dtype)
+
+
+def to_image(store):
+    """Wrap a store as a PIL image, sharing its memory where the layout allows.
+
+    8-bit L and RGBA stores, and RGB stores from pixel_store(), are mapped
+    rather than copied, so an encoder reads them from the page cache.
+    Anything else is copied with Image.fromarray.
+    """
+    height, width = store.shape[:2]
+    channels = store.shape[2] if store.ndim == 3 else 1
+    mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}.get(channels)
+    memory = store.base if channels == 3 else store
+    if (mode is None or store.dtype != np.uint8 or not isinstance(memory, np.ndarray)
+            or not memory.flags.c_contiguous or memory.ctypes.data != store.ctypes.data
+            or memory.size != height * width * (1 if channels == 1 else 4)):
+        return Image.fromarray(store)
+    return Image.new(mode, (0, 0))._new(Image.core.map_buffer(memory, (width, height), 'raw', 0, (mode, 0, 1)))
+
+
+def iter_tiles(height, width, tile_size, halo=0):
+    """Yield (inner, outer) boxes as (top, left, bottom, right) tuples.
+
+    inner boxes cover the image exactly once; outer boxes add the halo,
+    clipped to the image bounds.
+    """
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            bottom = min(top + tile_size, height)
+            right = min(left + tile_size, width)
+            outer = (max(top - halo, 0), max(left - halo, 0),
+                     min(bottom + halo, height), min(right + halo, width))
+            yield (top, left, bottom, right), outer
+
+
+class TiledProcessor:
+    """Run a chain of filters over an image one overlapping tile at a time.
+
+    apply_fn(image, action, params) is the single-image implementation
+    (e.g. ImageProcessor._filter), so tiled and untiled output agree.
+    The halo of a chain is the sum of its steps' halos. Peak memory is a
+    few tiles regardless of image size; source and result live in
+    memory-mapped stores.
+    """
+
+    def __init__(self, apply_fn, tile_size=DEFAULT_TILE_SIZE):
+        self.apply_fn = apply_fn
+        self.tile_size = tile_size
+
+    def run(self, source, steps, output_store=None):
+        """Process source (an array or memmap) and return the result store."""
+        halo = sum(halo_for(action, params) for action, params in steps)
+        height, width = source.shape[:2]
+        output = output_store
+
+        for inner, outer in iter_tiles(height, width, self.tile_size, halo):
+            tile = Image.fromarray(np.ascontiguousarray(source[outer[0]:outer[2], outer[1]:outer[3]]))
+            for action, params in steps:
+                tile = self.apply_fn(tile, action, params)
+                if tile is None:
+                    raise ValueError(f'Invalid filter type: {action}')
+            result = np.asarray(tile)
+
+            if output is None:
+                output = pixel_store((height, width) + result.shape[2:], result.dtype)
+            top, left = inner[0] - outer[0], inner[1] - outer[1]
+            output[inner[0]:inner[2], inner[1]:inner[3]] = \
+                result[top:top + inner[2] - inner[0], left:left + inner[3] - inner[1]]
+
+        if hasattr(output, 'flush'):
+            output.flush()
+        return output
+
+
+def transform_store(source, action, params, band_rows=DEFAULT_TILE_SIZE):
+    """Crop, flip or rotate by a multiple of 90 degrees without loading the image.
+
+    The transform is expressed as a strided view of source and copied
+    into a new store one band of rows at a time. Returns None for
+    transforms that cannot be done this way.
+    """
+    height, width = source.shape[:2]
+    if action == 'crop':
+        view = source[params.get('top', 0):params.get('bottom', height),
+                      params.get('left', 0):params.get('right', width)]
+    elif action == 'flip':
+        view = source[:, ::-1] if params.get('direction', 'horizontal') == 'horizontal' else source[::-1]
+    elif action == 'rotate' and params.get('angle', 90) % 90 == 0:
+        view = np.rot90(source, (params.get('angle', 90) // 90) % 4)
+    else:
+        return None
+
+    output = pixel_store(view.shape, view.dtype)
+    for start in range(0, view.shape[0], band_rows):
+        output[start:start + band_rows] = view[start:start + band_rows]
+    output.flush()
+    return output
+
+
+def save_store(store, output_path):
+    """Encode a (possibly memory-mapped) result to output_path."""
+    if tifffile is not None and output_path.lower().endswith(('.tif', '.tiff')):
+        tifffile.imwrite(output_path, store, tile=(256, 256))
+    else:
+        to_image(store).save(output_path)
+
+
+def detect_in_tiles(gray, detect_fn, tile_size=2048, overlap=512, window=24, min_size=0, max_size=0):
+    """Run an object detector over overlapping tiles and merge the boxes.
+
+    detect_fn(image, min_size, max_size) returns (x, y, w, h) boxes, with
+    0 meaning no bound. Tiles only look for objects up to overlap pixels,
+    since only those always lie wholly inside some tile. Larger ones are
+    looked for on the whole frame, shrunk so that overlap pixels become
+    window, the detector's smallest size. Duplicates found in
+    neighbouring tiles or by both passes are merged with
+    cv2.groupRectangles.
+    """
+    height, width = gray.shape[:2]
+    boxes = []
+    if not min_size or min_size <= overlap:
+        tile_max = min(max_size, overlap) if max_size else overlap
+        for _, outer in iter_tiles(height, width, tile_size, overlap):
+            tile = np.ascontiguousarray(gray[outer[0]:outer[2], outer[1]:outer[3]])
+            for (x, y, w, h) in detect_fn(tile, min_size, tile_max):
+                boxes.append([int(x) + outer[1], int(y) + outer[0], int(w), int(h)])
+
+    if not max_size or max_size > overlap:
+        scale = window / overlap
+        small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+        for (x, y, w, h) in detect_fn(small, max(window, min_size * scale),
+                                      max_size * scale if max_size else 0):
+            boxes.append([round(x / scale), round(y / scale), round(w / scale), round(h / scale)])
+
+    if not boxes:
+        return []
+    # Listing every box twice keeps boxes that were only found once
+    grouped, _ = cv2.groupRectangles(boxes + boxes, 1, 0.2)
+    return [tuple(int(v) for v in box) for box in grouped]
@@ -0,0 +1,178 @@
+import io
+import os
+import hashlib
+import tempfile
+import logging
+
+from PIL import Image
+
+from utils.image_cache import image_cache, as_cacheable_array
+from utils import tiling
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+HEADER_BYTES = 64 * 1024  # parse the header incrementally up to this much data
+
+# Uploads up to this size are kept in memory and decoded straight into the cache
+PREDECODE_MAX_BYTES = 32 * 1024 * 1024
+
+# Leading bytes of each accepted format
+SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'%PDF-', 'pdf'),
+]
+
+# Formats whose size cannot be read from the first bytes of the file
+NO_HEADER_FORMATS = {'tiff', 'pdf', 'mp4', 'avi'}
+IMAGE_FORMATS = {'png', 'jpeg', 'gif', 'bmp', 'tiff'}
+
+
+class UploadError(ValueError):
+    """Raised when an upload is rejected; the partial file is removed."""
+
+
+def sniff_format(head):
+    for signature, name in SIGNATURES:
+        if head.startswith(signature):
+            return name
+    # ISO media (MP4/MOV) and AVI carry their type after a size field
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    if head.startswith(b'RIFF') and head[8:12] == b'AVI ':
+        return 'avi'
+    return None
+
+
+def stream_to_disk(stream, filepath, max_bytes, chunk_size=CHUNK_SIZE,
+                   predecode_max_bytes=PREDECODE_MAX_BYTES, max_pixels=None):
+    """Copy an upload stream to filepath in chunks, validating as it arrives.
+
+    The format is checked against known signatures on the first chunk
+    and the header is parsed incrementally, so a bad or oversized image
+    usually fails before the rest is read. A header that is not found in
+    the first HEADER_BYTES, e.g. behind a large ICC profile, is read from
+    the finished file instead. The body is hashed on the way through
+    and written to a uniquely named temporary file next to filepath,
+    which is renamed into place only on success, so concurrent uploads
+    of the same name never write to the same file. Small uploads are
+    also decoded from the bytes already in memory and put in the
+    decoded-image cache. Images over max_pixels are rejected; by default
+    that is where Image.open raises DecompressionBombError.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(filepath) + '.', suffix='.part',
+                                     dir=os.path.dirname(filepath) or '.')
+    digest = hashlib.sha256()
+    head = bytearray()
+    buffer = io.BytesIO()
+    total = 0
+    image_format = None
+    header = None
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                if image_format is None:
+                    image_format = sniff_format(chunk)
+                    if image_format is None:
+                        raise UploadError('Unsupported or invalid image data')
+
+                total += len(chunk)
+                if total > max_bytes:
+                    raise UploadError(f'Upload exceeds {max_bytes} bytes')
+
+                if image_format in IMAGE_FORMATS and header is None and total - len(chunk) < HEADER_BYTES:
+                    head += chunk
+                    header = _parse_header(head, max_pixels)
+                if total <= predecode_max_bytes and image_format in IMAGE_FORMATS:
+                    buffer.write(chunk)
+                digest.update(chunk)
+                f.write(chunk)
+
+        if total == 0:
+            raise UploadError('Empty upload')
+        if header is None and image_format in IMAGE_FORMATS:
+            # e.g. a JPEG whose EXIF, XMP or ICC segments come before the frame header
+            header = _open_header(temp_path, image_format, max_pixels)
+        elif header is None:
+            _require_header(image_format)
+        os.chmod(temp_path, 0o644)  # mkstemp creates files readable by the owner only
+        os.replace(temp_path, filepath)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    info = {
+        'bytes': total,
+        'sha256': digest.hexdigest(),
+        'format': image_format
+    }
+    if header is not None:
+        info['width'], info['height'] = header.size
+        info['mode'] = header.mode
+
+    if total <= predecode_max_bytes and image_format in IMAGE_FORMATS:
+        _prime_cache(filepath, buffer)
+    return info
+
+
+def _parse_header(head, max_pixels=None):
+    """Return the image opened from the bytes received so far, or None if more are needed.
+
+    Like ImageFile.Parser, but Pillow's decompression bomb check is
+    replaced by max_pixels so large scans can be accepted.
+    """
+    try:
+        image = tiling.open_unchecked(io.BytesIO(bytes(head)))
+    except OSError:
+        return None  # not enough data yet
+    except Exception as e:
+        raise UploadError(f'Corrupt image header: {str(e)}')
+    return _check_size(image, max_pixels)
+
+
+def _open_header(path, image_format, max_pixels=None):
+    """Open the header of a complete upload that was not parsed while streaming."""
+    try:
+        with tiling.open_unchecked(path) as image:
+            return _check_size(image, max_pixels)
+    except UploadError:
+        raise
+    except Exception:
+        _require_header(image_format)
+
+
+def _check_size(image, max_pixels):
+    if max_pixels is None and Image.MAX_IMAGE_PIXELS:
+        max_pixels = 2 * Image.MAX_IMAGE_PIXELS
+    if max_pixels and image.width * image.height > max_pixels:
+        raise UploadError('Image dimensions are too large')
+    return image
+
+
+def _require_header(image_format):
+    # TIFF directories and PDF page trees may sit at the end of the file
+    if image_format not in NO_HEADER_FORMATS:
+        raise UploadError('Could not read image header')
+
+
+def _prime_cache(filepath, buffer):
+    """Decode the in-memory upload and store it in the decoded-image cache."""
+    try:
+        buffer.seek(0)
+        with Image.open(buffer) as image:
+            image_cache.put(image_cache.file_key(filepath), as_cacheable_array(image))
+    except Exception as e:
+        # The file on disk is still valid input; it will be decoded on first use
+        logger.debug(f"Could not pre-decode {filepath}: {str(e)}")
+
@@ -0,0 +1,192 @@
+import time
+import queue
+import threading
+import logging
+
+import cv2
+
+from utils.faces import blur_region
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DETECT_EVERY = 5
+TRACK_MAX_SIDE = 640  # frames are tracked at this size
+QUEUE_FRAMES = 16  # frames buffered between pipeline stages
+BOX_PADDING = 0.1  # blur a little beyond each box so tracking drift does not expose edges
+
+
+class BoxTracker:
+    """Follow boxes between detections by template matching near their last position.
+
+    Each box's patch from the last detection is searched for in a window
+    around where it was, which costs a few small matchTemplate calls per
+    frame. A box whose best match scores below min_score stays put.
+    """
+
+    def __init__(self, search=0.5, min_score=0.5):
+        self.search = search
+        self.min_score = min_score
+        self.boxes = []
+        self.templates = []
+
+    def reset(self, gray, boxes):
+        self.boxes = [tuple(box) for box in boxes]
+        self.templates = [gray[y:y + h, x:x + w].copy() for x, y, w, h in self.boxes]
+
+    def update(self, gray):
+        height, width = gray.shape[:2]
+        for i, (template, (x, y, w, h)) in enumerate(zip(self.templates, self.boxes)):
+            if template.size == 0:
+                continue
+            margin_x, margin_y = int(w * self.search) + 1, int(h * self.search) + 1
+            x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+            x1, y1 = min(width, x + w + margin_x), min(height, y + h + margin_y)
+            window = gray[y0:y1, x0:x1]
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                continue
+            scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, location = cv2.minMaxLoc(scores)
+            if score >= self.min_score:
+                self.boxes[i] = (x0 + location[0], y0 + location[1], w, h)
+        return self.boxes
+
+
+def _pad(box, width, height):
+    x, y, w, h = box
+    dx, dy = int(w * BOX_PADDING), int(h * BOX_PADDING)
+    x0, y0 = max(0, x - dx), max(0, y - dy)
+    return x0, y0, min(width, x + w + dx) - x0, min(height, y + h + dy) - y0
+
+
+def blur_video(input_path, output_path, detector, detect_every=DEFAULT_DETECT_EVERY, mode='box',
+               min_size=None, max_size=None, fourcc='mp4v', progress=None):
+    """Blur faces in a video, decoding, processing and encoding on separate threads.
+
+    input_path is anything cv2.VideoCapture opens, including image
+    sequences such as frames/%04d.png. The detector runs on every
+    detect_every-th frame; boxes are tracked on a downscaled copy of the
+    frames in between. Frames flow through bounded queues, so memory does
+    not grow with the length of the video. progress, if given, is called
+    with the running stats every second. Returns the final stats.
+    """
+    capture = cv2.VideoCapture(input_path)
+    if not capture.isOpened():
+        raise ValueError(f'Could not open video: {input_path}')
+    source_fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), source_fps, (width, height))
+    if not writer.isOpened():
+        capture.release()
+        raise ValueError(f'Could not open video writer for {output_path}')
+
+    scale = min(1.0, TRACK_MAX_SIDE / max(width, height))
+    decoded = queue.Queue(QUEUE_FRAMES)
+    processed = queue.Queue(QUEUE_FRAMES)
+    stop = threading.Event()
+    errors = []
+    stats = {'frames': 0, 'detected_frames': 0, 'faces': 0, 'source_fps': source_fps,
+             'busy_seconds': {'decode': 0.0, 'detect': 0.0, 'track': 0.0, 'blur': 0.0, 'encode': 0.0}}
+    busy = stats['busy_seconds']
+
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read():
+        try:
+            while not stop.is_set():
+                start = time.perf_counter()
+                ok, frame = capture.read()
+                busy['decode'] += time.perf_counter() - start
+                if not ok or not put(decoded, frame):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(decoded, None)
+
+    def write():
+        try:
+            while True:
+                try:
+                    frame = processed.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        break
+                    continue
+                if frame is None:
+                    break
+                start = time.perf_counter()
+                writer.write(frame)
+                busy['encode'] += time.perf_counter() - start
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    reader = threading.Thread(target=read, name='video-decode', daemon=True)
+    encoder = threading.Thread(target=write, name='video-encode', daemon=True)
+    reader.start()
+    encoder.start()
+
+    tracker = BoxTracker()
+    started = last_report = time.perf_counter()
+    try:
+        while not stop.is_set():
+            # If the encoder fails, the reader stops without queueing its sentinel
+            try:
+                frame = decoded.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is None:
+                break
+            start = time.perf_counter()
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) \
+                if scale < 1.0 else frame
+            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+            if stats['frames'] % detect_every == 0:
+                faces = detector.detect(frame, min_size, max_size)
+                tracker.reset(gray, [tuple(int(v * scale) for v in box) for box in faces])
+                stats['detected_frames'] += 1
+                stats['faces'] += len(faces)
+                busy['detect'] += time.perf_counter() - start
+            else:
+                faces = [tuple(int(v / scale) for v in box) for box in tracker.update(gray)]
+                busy['track'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for box in faces:
+                blur_region(frame, _pad(box, width, height), mode)
+            busy['blur'] += time.perf_counter() - start
+
+            if not put(processed, frame):
+                break
+            stats['frames'] += 1
+            now = time.perf_counter()
+            stats['seconds'] = now - started
+            stats['fps'] = stats['frames'] / stats['seconds']
+            if progress and now - last_report >= 1.0:
+                last_report = now
+                progress(dict(stats))
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        put(processed, None)
+        encoder.join()
+        stop.set()
+        reader.join()
+        capture.release()
+        writer.release()
+
+    if errors:
+        raise errors[0]
+    stats['seconds'] = time.perf_counter() - started
+    stats['fps'] = stats['frames'] / stats['seconds'] if stats['seconds'] else 0.0
+    logger.info(f"Blurred {stats['frames']} frames at {stats['fps']:.1f} fps")
+    return stats